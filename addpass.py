@@ -6,19 +6,13 @@ window that contains a couple of fields, buttons, and check boxes.
 from sys import argv, exit
 from PyQt5.QtWidgets import (QWidget, 
     QLabel, QLineEdit, QGridLayout, QMenu, QApplication, qApp, QPushButton,
-    QCheckBox)
+    QCheckBox, QMessageBox)
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import Qt, QCoreApplication, QEvent
 
 from common import setColor, buttonStylesheet
-from passwordbutton import PasswordButton
-from string import ascii_letters, digits, punctuation
-from random import choice
-from os import getenv
-from os.path import join
-from pyperclip import copy
-from Crypto.Protocol.KDF import PBKDF2
-from Crypto.Cipher import Salsa20
+from generator import Policy, generate
+import clipboard
 
 class AddPasswordScreen(QWidget):
     lettersCheck = True
@@ -27,7 +21,6 @@ class AddPasswordScreen(QWidget):
     def __init__(self, parent):
         super().__init__()
         self.password = None
-        self.key = parent.password
         self.parent = parent
         self.initUI()
     
@@ -116,50 +109,79 @@ class AddPasswordScreen(QWidget):
         '''
         Saves the currently entered password
         '''
-        cleanedTitle = ''.join(filter(
-            lambda x: x in ascii_letters + digits + ' ', self.userBox.text()))
+        #Not imported at the top, so that the module can be loaded before
+        #the login window without the vault
+        from vault import cleanTitle, KeyChangedError
+        cleanedTitle = cleanTitle(self.userBox.text())
         if self.passBox.text() == '' or cleanedTitle == '':
             return
 
         try:
-            with open(join(join(getenv('APPDATA'), 'PassManData'),
-            cleanedTitle), 'xb') as file:
-                salt = "".join([choice(ascii_letters + digits) for _ in range(16)])
-                derivedKey = PBKDF2(
-                    self.key,
-                    salt.encode(),
-                    dkLen=32
-                    )
-
-                cipher = Salsa20.new(derivedKey)
-                data = cipher.encrypt(self.passBox.text().encode())
-                string = cipher.nonce + salt.encode() + data
-
-                file.write(string)
-                self.parent.files.append(cleanedTitle)
-                self.parent.updateButtons()
-                self.close()
+            self.parent.vault.put(cleanedTitle, self.passBox.text())
+            self.parent.addEntry(cleanedTitle)
+            self.close()
 
         except FileExistsError:
+            self.replacePassword(cleanedTitle)
+        except KeyChangedError:
+            self.keyChanged()
+        except ValueError:
+            #A name the program keeps for its own files
+            self.userLabel.setText(
+                "<font color='red'>That name cannot be used</font>")
+
+    def keyChanged(self):
+        '''
+        Tells the user that nothing was saved because the master password
+        was changed from somewhere else
+        '''
+        self.userLabel.setText("<font color='red'>The master password was "
+            "changed elsewhere, log in again to save</font>")
+
+    def replacePassword(self, name):
+        '''
+        Saves the entered password over an existing entry once the user has
+        agreed to it. The old password stays in the entry's history
+        '''
+        from vault import KeyChangedError
+        msg = QMessageBox()
+        msg.setText("%s already has a saved password. Replace it?" % name)
+        msg.setInformativeText("The old password is kept in its history")
+        msg.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+        msg.setDefaultButton(QMessageBox.Cancel)
+        if msg.exec() != QMessageBox.Ok:
             self.userLabel.setText(
                 "<font color='red'>Name already exsists</font>")
+            return
+        try:
+            try:
+                self.parent.vault.update(name, self.passBox.text())
+            except FileNotFoundError:
+                #Deleted in the meantime, so it is a new entry after all
+                self.parent.vault.put(name, self.passBox.text())
+                self.parent.addEntry(name)
+        except KeyChangedError:
+            self.keyChanged()
+            return
+        self.parent.decryptor.forget(name)
+        self.close()
 
     def genPassword(self, **kwargs):
         '''
-        Generates a random password
+        Generates a random password from the checked character classes
         '''
-        chars = ''
-        chars += ascii_letters if self.lettersRB.isChecked() else ''
-        chars += digits if self.digitsRB.isChecked() else ''
-        chars += punctuation if self.symbolsRB.isChecked() else ''
-
-        if chars == '':
+        try:
+            policy = Policy(letters=self.lettersRB.isChecked(),
+                digits=self.digitsRB.isChecked(),
+                symbols=self.symbolsRB.isChecked())
+        except ValueError:
             return
-        
-        password= ''.join([choice(chars) for _ in range(24)])
+
+        password = generate(policy)
         self.password = password
+        self.passBox.setToolTip(policy.report())
         self.passBox.setText(password)
-        copy(password)
+        clipboard.copy(password, clipboard.CLEAR_SECONDS)
 
     def setState(self, boxName, box):
         '''
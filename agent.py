@@ -0,0 +1,261 @@
+'''
+An optional unlock agent, in the spirit of ssh-agent. The agent keeps an
+unlocked vault in memory and answers list/get requests over a Unix domain
+socket that only the current user can open, so scripts can fetch many
+secrets without the master password being typed or the KDF being run again
+for every one. The agent locks itself and exits after sitting idle for a
+while.
+
+Requests and responses are a one byte code and a four byte big endian length
+followed by that many bytes. A client can send any number of requests over
+one connection.
+
+Start one with: python passmancli.py agent [--background]
+'''
+
+from os import chmod, getenv, remove, umask
+from os.path import join
+from selectors import DefaultSelector, EVENT_READ
+from struct import Struct
+from time import monotonic
+import socket
+
+from storage import dataDir
+
+HEADER = Struct('>BI')
+MAX_PAYLOAD = 1 << 20
+
+#Request codes
+PING = 1
+LIST = 2
+GET = 3
+LOCK = 4
+
+#Response codes
+OK = 0
+NOT_FOUND = 1
+FAILED = 2
+
+IDLE_TIMEOUT = 15 * 60
+
+class AgentError(Exception):
+    pass
+
+def isSupported():
+    """Checks if this platform has Unix domain sockets"""
+    return hasattr(socket, 'AF_UNIX')
+
+def agentPath():
+    '''
+    Returns where the agent's socket lives: PASSMAN_AGENT_SOCK if it is set,
+    otherwise the per-user runtime folder, otherwise the data folder
+    '''
+    path = getenv('PASSMAN_AGENT_SOCK')
+    if path:
+        return path
+    runtime = getenv('XDG_RUNTIME_DIR')
+    if runtime:
+        return join(runtime, 'passman-agent.sock')
+    return join(dataDir(), '.agent.sock')
+
+def receiveExactly(connection, length):
+    data = b''
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return data
+
+def receiveMessage(connection):
+    code, length = HEADER.unpack(receiveExactly(connection, HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ConnectionError('Message too large')
+    return code, receiveExactly(connection, length)
+
+def sendMessage(connection, code, payload=b''):
+    connection.sendall(HEADER.pack(code, len(payload)) + payload)
+
+class Agent:
+    def __init__(self, vault, path=None, idleTimeout=IDLE_TIMEOUT,
+        lockOnExit=True):
+        '''
+        Serves the already unlocked vault. If lockOnExit is set the vault's
+        keys are dropped when the agent stops; the GUI turns this off when it
+        hosts an agent for its own vault
+        '''
+        self.vault = vault
+        self.path = path or agentPath()
+        self.idleTimeout = idleTimeout
+        self.lockOnExit = lockOnExit
+        self.running = False
+        self.listener = None
+
+    def listen(self):
+        '''
+        Creates the socket with permissions that only let this user connect.
+        Raises AgentError if another agent is answering on it; a socket left
+        by one that died is replaced
+        '''
+        if isRunning(self.path):
+            raise AgentError('An unlock agent is already running at %s' %
+                self.path)
+        try:
+            remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldMask = umask(0o177)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            umask(oldMask)
+        chmod(self.path, 0o600)
+        self.listener.listen(16)
+
+    def serve(self):
+        '''
+        Answers requests until the agent is locked, stopped or sits idle for
+        longer than the timeout. Listens first unless listen() was called
+        '''
+        if self.listener is None:
+            self.listen()
+        self.running = True
+        selector = DefaultSelector()
+        selector.register(self.listener, EVENT_READ)
+        lastUsed = monotonic()
+        try:
+            while self.running:
+                remaining = lastUsed + self.idleTimeout - monotonic()
+                if remaining <= 0:
+                    break
+                #Wake up now and then so stop() from another thread is seen
+                for key, _ in selector.select(min(remaining, 1.0)):
+                    lastUsed = monotonic()
+                    if key.fileobj is self.listener:
+                        self.accept(selector)
+                    else:
+                        self.answer(selector, key.fileobj)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+            try:
+                remove(self.path)
+            except FileNotFoundError:
+                pass
+            if self.lockOnExit:
+                self.vault.password = None
+                self.vault.masterKey = None
+
+    def accept(self, selector):
+        connection, _ = self.listener.accept()
+        if not self.isSameUser(connection):
+            connection.close()
+            return
+        selector.register(connection, EVENT_READ)
+
+    def isSameUser(self, connection):
+        """Checks the peer's user id where the platform can tell us it"""
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        #Only imported here, since Windows has no user ids
+        from os import getuid
+        credentials = Struct('3i')
+        _, uid, _ = credentials.unpack(connection.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+        return uid == getuid()
+
+    def answer(self, selector, connection):
+        try:
+            code, payload = receiveMessage(connection)
+            sendMessage(connection, *self.handle(code, payload))
+        except (ConnectionError, OSError):
+            selector.unregister(connection)
+            connection.close()
+
+    def handle(self, code, payload):
+        """Returns the response code and payload for a request"""
+        if code == PING:
+            return OK, b''
+        if code == LIST:
+            return OK, '\n'.join(self.vault.names()).encode()
+        if code == GET:
+            #Not imported at the top, so that clients start without the
+            #vault module
+            from vault import checkName, DecodingError, WrongPasswordError
+            try:
+                name = payload.decode()
+            except UnicodeDecodeError:
+                return FAILED, b'Entry names must be UTF-8'
+            try:
+                #Not a name any entry can have, nor a path to follow
+                checkName(name)
+            except ValueError:
+                return NOT_FOUND, b''
+            try:
+                return OK, self.vault.get(name).encode()
+            except FileNotFoundError:
+                return NOT_FOUND, b''
+            except (DecodingError, WrongPasswordError):
+                return FAILED, b'Unable to decode'
+        if code == LOCK:
+            self.running = False
+            return OK, b''
+        return FAILED, b'Unknown request'
+
+    def stop(self):
+        self.running = False
+
+class AgentClient:
+    '''
+    Connection to a running agent. Raises OSError if there is none
+    '''
+    def __init__(self, path=None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(path or agentPath())
+        except OSError:
+            self.connection.close()
+            raise
+
+    def request(self, code, payload=b''):
+        sendMessage(self.connection, code, payload)
+        status, payload = receiveMessage(self.connection)
+        if status == NOT_FOUND:
+            raise FileNotFoundError()
+        if status != OK:
+            raise AgentError(payload.decode())
+        return payload
+
+    def ping(self):
+        self.request(PING)
+
+    def names(self):
+        payload = self.request(LIST).decode()
+        return payload.split('\n') if payload else []
+
+    def get(self, name):
+        return self.request(GET, name.encode()).decode()
+
+    def lock(self):
+        self.request(LOCK)
+
+    def close(self):
+        self.connection.close()
+
+def isRunning(path=None):
+    """Checks if an agent is answering on the socket"""
+    if not isSupported():
+        return False
+    try:
+        client = AgentClient(path)
+    except OSError:
+        return False
+    try:
+        client.ping()
+        return True
+    except (OSError, AgentError):
+        return False
+    finally:
+        client.close()
@@ -0,0 +1,433 @@
+'''
+Attachments: notes, SSH keys and files of any size kept with an entry.
+
+Attachments are not entries. They live in their own folder (.attachments) in
+the data folder, whatever the entry store is, so listing the vault never
+touches them and a vault with large files lists as fast as one without.
+
+Each attachment is two files named after a hash of its entry's name and a
+random id:
+
+    <entry hash>.<id>       the contents, in CHUNK_SIZE chunks, each
+                            encrypted and authenticated with
+                            ChaCha20-Poly1305 under a random key
+    <entry hash>.<id>.key   the entry's name, the attachment's label, its
+                            size and that random key, as an entry in the
+                            current format (see keys.py)
+
+A chunk's nonce is its number and a flag set only on the last chunk, and
+the file's header is authenticated with every chunk, so chunks cannot be
+reordered, dropped or cut off without it being noticed. Files are written
+and read a chunk at a time, so memory use does not depend on their size,
+and reads map the file and only decrypt the chunks a byte range covers.
+Changing the master password only re-encrypts the small key files.
+'''
+
+from hashlib import sha256
+from json import dumps, loads
+from mmap import mmap, ACCESS_READ
+from os import fsync, listdir, makedirs, remove, replace, scandir, urandom
+from os.path import basename, join, exists
+from struct import Struct
+
+from Crypto.Cipher import ChaCha20_Poly1305
+
+from keys import decryptEntry, encryptEntry, AuthenticationError
+from storage import (moveIntoPlace, removeStaleTemporary, syncDirectory,
+    writeAtomic, writeTemporary)
+
+ATTACHMENTS_NAME = '.attachments'
+KEY_SUFFIX = '.key'
+#Key files re-encrypted for a new master password wait in the staging
+#folder under this prefix, see rotate.py
+STAGED_PREFIX = 'attachment-'
+
+MAGIC = b'PMATTACH'
+VERSION = 1
+HEADER = Struct('<8sBI')        #magic, version, chunk size
+COUNTER = Struct('>I')
+CHUNK_SIZE = 1 << 16
+TAG_SIZE = 16
+
+def entryHash(name):
+    return sha256(name.encode()).hexdigest()[:16]
+
+def chunkNonce(index, final):
+    return bytes(7) + COUNTER.pack(index) + bytes([final])
+
+def readFull(source, size):
+    """Reads size bytes from source, or fewer only at its end"""
+    data = source.read(size)
+    while 0 < len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+class AttachmentReader:
+    '''
+    Reads an attachment through a memory map, decrypting only the chunks
+    that are asked for
+    '''
+    def __init__(self, path, key, size):
+        self.key = key
+        self.size = size
+        self.file = open(path, 'rb')
+        self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        self.header = self.map[:HEADER.size]
+        magic, version, self.chunkSize = HEADER.unpack(self.header)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise AuthenticationError('Not an attachment')
+        body = len(self.map) - HEADER.size
+        stride = self.chunkSize + TAG_SIZE
+        self.count = max(1, -(-body // stride))
+        if body - self.count * TAG_SIZE != size:
+            self.close()
+            raise AuthenticationError('Attachment is truncated')
+
+    def chunk(self, index, data=None):
+        '''
+        Returns the decrypted contents of one chunk, taken from the memory
+        map unless its stored bytes are passed in
+        '''
+        if data is None:
+            start = HEADER.size + index * (self.chunkSize + TAG_SIZE)
+            data = self.map[start:start + self.chunkSize + TAG_SIZE]
+        cipher = ChaCha20_Poly1305.new(key=self.key,
+            nonce=chunkNonce(index, index == self.count - 1))
+        cipher.update(self.header)
+        try:
+            return cipher.decrypt_and_verify(data[:-TAG_SIZE],
+                data[-TAG_SIZE:])
+        except ValueError:
+            raise AuthenticationError('Attachment chunk %d failed '
+                'authentication' % index)
+
+    def read(self, offset=0, length=None):
+        '''
+        Returns length bytes from offset, or everything after offset if
+        length is None
+        '''
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError('Negative offset or length')
+        end = self.size if length is None else min(self.size, offset + length)
+        if offset >= end:
+            return b''
+        parts = []
+        for index in range(offset // self.chunkSize,
+            (end - 1) // self.chunkSize + 1):
+            chunkStart = index * self.chunkSize
+            parts.append(self.chunk(index)[max(0, offset - chunkStart):
+                end - chunkStart])
+        return b''.join(parts)
+
+    def chunks(self):
+        '''
+        Yields the decrypted contents a chunk at a time. The file is read
+        rather than mapped here, since every mapped page read would stay
+        counted against this process for as long as the map is open
+        '''
+        self.file.seek(HEADER.size)
+        for index in range(self.count):
+            yield self.chunk(index, self.file.read(self.chunkSize + TAG_SIZE))
+
+    def copyTo(self, target):
+        '''
+        Writes the whole attachment to a binary file object, a chunk at a
+        time. Returns the number of bytes written
+        '''
+        for data in self.chunks():
+            target.write(data)
+        return self.size
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class AttachmentStore:
+    '''
+    The attachments of every entry in a data folder
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.root = join(directory, ATTACHMENTS_NAME)
+
+    def ids(self, name=None):
+        """Returns the ids of the attachments of an entry, or of every one"""
+        if not exists(self.root):
+            return []
+        prefix = '' if name is None else entryHash(name) + '.'
+        return [x.name[:-len(KEY_SUFFIX)] for x in scandir(self.root)
+            if x.name.endswith(KEY_SUFFIX) and x.name.startswith(prefix)]
+
+    def record(self, masterKey, id):
+        '''
+        Returns the decrypted key file of an attachment: its entry, label,
+        size and key
+        '''
+        with open(join(self.root, id + KEY_SUFFIX), 'rb') as file:
+            fields = loads(
+                decryptEntry(file.read(), masterKey, None)[0].decode())
+        #Key files moved between attachments do not check out
+        if fields['id'] != id:
+            raise AuthenticationError('Attachment key file was moved')
+        return fields
+
+    def list(self, masterKey, name):
+        '''
+        Returns the labels and sizes of an entry's attachments, sorted by
+        label
+        '''
+        found = []
+        for id in self.ids(name):
+            fields = self.record(masterKey, id)
+            if fields['entry'] == name:
+                found.append((fields['label'], fields['size']))
+        return sorted(found)
+
+    def find(self, masterKey, name, label):
+        """Returns the id and key file of an attachment"""
+        for id in self.ids(name):
+            fields = self.record(masterKey, id)
+            if fields['entry'] == name and fields['label'] == label:
+                return id, fields
+        raise FileNotFoundError('%s has no attachment %s' % (name, label))
+
+    def add(self, masterKey, name, label, source):
+        '''
+        Encrypts everything read from the binary file object source as an
+        attachment of the named entry. Raises FileExistsError if the entry
+        already has an attachment with that label. Returns its size
+        '''
+        self.checkLabel(masterKey, name, label)
+        id, key, size = self.writeContents(name, source)
+        self.writeKey(masterKey, id, name, label, key, size)
+        return size
+
+    def checkLabel(self, masterKey, name, label):
+        """Raises FileExistsError if the entry has an attachment with label"""
+        try:
+            self.find(masterKey, name, label)
+        except FileNotFoundError:
+            return
+        raise FileExistsError('%s already has an attachment %s' % (name, label))
+
+    def writeContents(self, name, source):
+        '''
+        Encrypts everything read from source into the contents of a new
+        attachment of the named entry, under a random key. It is not listed
+        until writeKey saves its key file. Returns the id, key and size
+        '''
+        makedirs(self.root, exist_ok=True)
+        removeStaleTemporary(self.root)
+        id = entryHash(name) + '.' + urandom(8).hex()
+        path = join(self.root, id)
+        key = urandom(32)
+        header = HEADER.pack(MAGIC, VERSION, CHUNK_SIZE)
+
+        tempPath = writeTemporary(path, header, sync=False)
+        size = 0
+        try:
+            with open(tempPath, 'ab') as file:
+                #One chunk is read ahead, to know which one is the last
+                current = readFull(source, CHUNK_SIZE)
+                index = 0
+                while True:
+                    following = b''
+                    if len(current) == CHUNK_SIZE:
+                        following = readFull(source, CHUNK_SIZE)
+                    final = not following
+                    cipher = ChaCha20_Poly1305.new(key=key,
+                        nonce=chunkNonce(index, final))
+                    cipher.update(header)
+                    ciphertext, tag = cipher.encrypt_and_digest(current)
+                    file.write(ciphertext)
+                    file.write(tag)
+                    size += len(current)
+                    if final:
+                        break
+                    current = following
+                    index += 1
+                file.flush()
+                fsync(file.fileno())
+            moveIntoPlace(tempPath, path, True)
+        except BaseException:
+            if exists(tempPath):
+                remove(tempPath)
+            raise
+        return id, key, size
+
+    def discard(self, id):
+        """Removes contents written by writeContents that get no key file"""
+        remove(join(self.root, id))
+        syncDirectory(self.root)
+
+    def writeKey(self, masterKey, id, name, label, key, size):
+        '''
+        Saves the key file that makes the contents written by writeContents
+        an attachment. It goes in last, so a crash leaves no attachment
+        rather than a broken one
+        '''
+        writeAtomic(join(self.root, id + KEY_SUFFIX), encryptEntry(masterKey,
+            dumps({'id': id, 'entry': name, 'label': label, 'size': size,
+            'key': key.hex()}).encode()), exclusive=True)
+
+    def open(self, masterKey, name, label):
+        """Returns an AttachmentReader for one of an entry's attachments"""
+        id, fields = self.find(masterKey, name, label)
+        return AttachmentReader(join(self.root, id),
+            bytes.fromhex(fields['key']), fields['size'])
+
+    def readKeyFile(self, id):
+        """Returns the stored (encrypted) bytes of an attachment's key file"""
+        with open(join(self.root, id + KEY_SUFFIX), 'rb') as file:
+            return file.read()
+
+    def storedChunks(self, id):
+        '''
+        Yields the stored (encrypted) bytes of an attachment's contents a
+        chunk at a time, for copying them as they are
+        '''
+        with open(join(self.root, id), 'rb') as file:
+            while True:
+                data = file.read(CHUNK_SIZE)
+                if not data:
+                    return
+                yield data
+
+    def remove(self, masterKey, name, label):
+        id, _ = self.find(masterKey, name, label)
+        self.removeIds([id])
+
+    def removeAll(self, names):
+        '''
+        Removes every attachment of the given entries, along with any left
+        half written by a crash. Needs no key, so it works on a locked vault
+        '''
+        if not exists(self.root):
+            return
+        prefixes = set(entryHash(x) + '.' for x in names)
+        length = len(next(iter(prefixes), ''))
+        removed = False
+        for entry in scandir(self.root):
+            if entry.name[:length] in prefixes:
+                try:
+                    remove(entry.path)
+                    removed = True
+                except FileNotFoundError:
+                    pass
+        if removed:
+            syncDirectory(self.root)
+
+    def removeIds(self, ids):
+        for id in ids:
+            #The key file first, so nothing is left that looks readable
+            remove(join(self.root, id + KEY_SUFFIX))
+            remove(join(self.root, id))
+        syncDirectory(self.root)
+
+class AttachmentCopy:
+    '''
+    Copies the stored files of an attachment into a store as they are, for
+    restoring a backup. The contents are written a chunk at a time, and the
+    key file goes in last, as with AttachmentStore.add
+    '''
+    def __init__(self, store, id):
+        makedirs(store.root, exist_ok=True)
+        self.root = store.root
+        self.id = id
+        self.path = join(store.root, id)
+        self.tempPath = writeTemporary(self.path, b'', sync=False)
+        self.file = open(self.tempPath, 'ab')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def finish(self, keyData):
+        '''
+        Puts the contents and then the key file in place. Raises
+        FileExistsError if the store already has an attachment with this id
+        '''
+        try:
+            self.file.flush()
+            fsync(self.file.fileno())
+            self.file.close()
+            moveIntoPlace(self.tempPath, self.path, True)
+        except BaseException:
+            self.abort()
+            raise
+        writeAtomic(join(self.root, self.id + KEY_SUFFIX), keyData,
+            exclusive=True)
+
+    def abort(self):
+        """Removes the contents copied so far"""
+        self.file.close()
+        if exists(self.tempPath):
+            remove(self.tempPath)
+
+def attachPath(vault, name, path, label=None):
+    '''
+    Attaches the file at path to an entry, under its file name unless a
+    label is given. Returns the label and size
+    '''
+    label = label or basename(path)
+    with open(path, 'rb') as source:
+        return label, vault.attach(name, label, source)
+
+def extractTo(vault, name, label, path):
+    '''
+    Decrypts an attachment into the file at path a chunk at a time. Returns
+    the label and size
+    '''
+    with vault.openAttachment(name, label) as reader:
+        with open(path, 'wb') as target:
+            return label, reader.copyTo(target)
+
+def stageAttachmentKeys(directory, staging, oldMasterKey, newMasterKey):
+    '''
+    Re-encrypts the key file of every attachment under a new master key into
+    the staging folder of a master password change. The contents of the
+    attachments are left as they are, and so are key files already staged,
+    since they never change
+    '''
+    store = AttachmentStore(directory)
+    for id in store.ids():
+        target = join(staging, STAGED_PREFIX + id + KEY_SUFFIX)
+        if exists(target):
+            continue
+        try:
+            with open(join(store.root, id + KEY_SUFFIX), 'rb') as file:
+                record = decryptEntry(file.read(), oldMasterKey, None)[0]
+        except FileNotFoundError:
+            #Removed while the key files were being staged
+            continue
+        writeAtomic(target, encryptEntry(newMasterKey, record))
+
+def swapAttachmentKeys(staging, directory):
+    '''
+    Moves the key files made by stageAttachmentKeys over the old ones. Can
+    be run again after a crash part way through, or after the staging folder
+    is gone
+    '''
+    root = join(directory, ATTACHMENTS_NAME)
+    if not exists(staging):
+        return
+    for name in listdir(staging):
+        if not name.startswith(STAGED_PREFIX):
+            continue
+        target = join(root, name[len(STAGED_PREFIX):])
+        #Attachments removed while the new key files were being made
+        if exists(target[:-len(KEY_SUFFIX)]):
+            replace(join(staging, name), target)
+        else:
+            remove(join(staging, name))
+    if exists(root):
+        syncDirectory(root)
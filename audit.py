@@ -0,0 +1,219 @@
+'''
+Auditing a vault for reused and weak passwords.
+
+Entries are decrypted on a process pool, as in upgrade.py, and no password
+ever leaves the worker that decrypted it. Each worker returns, per entry, a
+keyed hash of the password (an HMAC under a key derived from the master
+key, so the hashes are useless without it) and a strength estimate.
+Entries with the same hash share a password.
+
+Results are cached in the data folder (.audit), encrypted like an entry,
+under the stamp of each entry's stored file (see Store.stamps), so auditing
+again only decrypts the entries that changed since. The report can be shown
+in the GUI or written out as JSON, which names entries but holds no
+passwords or hashes.
+
+python passmancli.py audit [--json FILE]
+'''
+
+from hashlib import sha256
+from hmac import new as hmacNew
+from json import dump, dumps, loads
+from math import log2
+from os.path import join
+
+from generator import CLASSES
+from keys import (decodeSecret, decryptEntry, encryptEntry, expandKey,
+    DecodingError, VERSION)
+from storage import writeAtomic
+from upgrade import checkEntry, mapVault, FAILED
+
+AUDIT_NAME = '.audit'
+#Passwords shorter than this are reported whatever their other scores
+MIN_LENGTH = 12
+#Estimated bits of entropy below which a password is weak, and below which
+#it is only fair
+WEAK_BITS = 50
+FAIR_BITS = 75
+#Size assumed for the characters outside the usual classes
+OTHER_SIZE = 100
+
+def estimateBits(secret):
+    '''
+    Estimates the entropy of a password from the classes of characters it
+    uses. A character that repeats the one before it or continues a run
+    like abc or 321 only counts for a bit
+    '''
+    pool = sum(len(characters) for _, characters in CLASSES
+        if any(x in characters for x in secret))
+    if any(not any(x in y for _, y in CLASSES) for x in secret):
+        pool += OTHER_SIZE
+    if pool == 0:
+        return 0.0
+    perCharacter = log2(pool)
+    bits = 0.0
+    previous = None
+    for character in secret:
+        if previous is not None and abs(ord(character) - ord(previous)) <= 1:
+            bits += 1
+        else:
+            bits += perCharacter
+        previous = character
+    return bits
+
+def rate(secret):
+    '''
+    Returns the estimated bits of a password, a rating of weak, fair or
+    strong, and a list of what is wrong with it
+    '''
+    bits = estimateBits(secret)
+    problems = []
+    if len(secret) < MIN_LENGTH:
+        problems.append('shorter than %d characters' % MIN_LENGTH)
+    classes = sum(1 for _, characters in CLASSES
+        if any(x in characters for x in secret))
+    #Long passphrases of plain words are strong enough
+    if classes < 2 and bits < FAIR_BITS:
+        problems.append('only one kind of character')
+    if bits < WEAK_BITS:
+        rating = 'weak'
+    elif bits < FAIR_BITS:
+        rating = 'fair'
+    else:
+        rating = 'strong'
+    return round(bits, 1), rating, problems
+
+def reuseKey(masterKey):
+    return expandKey(masterKey, b'PassMan audit reuse')
+
+def auditBatch(masterKey, password, entries):
+    '''
+    Returns the keyed hash and rating of each entry's password, or the
+    reason it could not be read. Run in the worker processes
+    '''
+    key = reuseKey(masterKey)
+    results = []
+    for data in entries:
+        status, secret, reason = checkEntry(data, masterKey, password)
+        if status == FAILED:
+            results.append({'failed': reason})
+            continue
+        try:
+            #checkEntry hands back older formats as UTF-8 too
+            secret = decodeSecret(secret, VERSION)
+        except DecodingError:
+            #Authenticated, but not text this program saved
+            results.append({'failed': 'Unable to decode'})
+            continue
+        bits, rating, problems = rate(secret)
+        results.append({
+            'hash': hmacNew(key, secret.encode(), sha256).hexdigest(),
+            'length': len(secret),
+            'bits': bits,
+            'rating': rating,
+            'problems': problems
+            })
+    return results
+
+class AuditReport:
+    '''
+    The result of an audit: every entry's result, and how many of them were
+    worked out this time rather than taken from the cache
+    '''
+    def __init__(self, results, audited):
+        self.results = results
+        self.audited = audited
+
+    def reused(self):
+        """Returns the groups of entries that share a password, largest first"""
+        groups = {}
+        for name, result in self.results.items():
+            if 'hash' in result:
+                groups.setdefault(result['hash'], []).append(name)
+        return sorted((sorted(x) for x in groups.values() if len(x) > 1),
+            key=lambda x: (-len(x), x[0].lower()))
+
+    def weak(self):
+        '''
+        Returns the (name, result) of the entries rated weak or with any
+        problem, weakest first
+        '''
+        found = [(name, result) for name, result in self.results.items()
+            if 'hash' in result and (result['rating'] == 'weak' or
+            result['problems'])]
+        return sorted(found, key=lambda x: (x[1]['bits'], x[0].lower()))
+
+    def failed(self):
+        return sorted((name, result['failed'])
+            for name, result in self.results.items() if 'failed' in result)
+
+    def summary(self):
+        reused = self.reused()
+        return ('%d passwords, %d reused across %d groups, %d weak, '
+            '%d unreadable' % (len(self.results), sum(len(x) for x in reused),
+            len(reused), len(self.weak()), len(self.failed())))
+
+    def toJson(self):
+        """Returns the report as a dictionary, with no passwords or hashes"""
+        return {
+            'entries': len(self.results),
+            'reused': self.reused(),
+            'weak': [dict(name=name, length=result['length'],
+                bits=result['bits'], rating=result['rating'],
+                problems=result['problems']) for name, result in self.weak()],
+            'unreadable': [dict(name=name, reason=reason)
+                for name, reason in self.failed()]
+            }
+
+    def writeJson(self, path):
+        with open(path, 'w') as file:
+            dump(self.toJson(), file, indent=2)
+
+def loadCache(vault):
+    '''
+    Returns the cached results, name -> [stamp, result], or nothing if there
+    is no cache or it was made under another master key
+    '''
+    try:
+        with open(join(vault.directory, AUDIT_NAME), 'rb') as file:
+            data = file.read()
+        return loads(decryptEntry(data, vault.masterKey, None)[0].decode())
+    except (OSError, ValueError):
+        return {}
+
+def saveCache(vault, cache):
+    writeAtomic(join(vault.directory, AUDIT_NAME),
+        encryptEntry(vault.masterKey, dumps(cache).encode()))
+
+def auditVault(vault, workers=None):
+    '''
+    Audits every entry of an unlocked vault, decrypting only the entries
+    that changed since the last audit. Returns an AuditReport
+    '''
+    vault.checkUnlocked()
+    stamps = vault.store.stamps()
+    cache = loadCache(vault)
+    results = {}
+    changed = []
+    for name, stamp in stamps.items():
+        #JSON has no tuples
+        stamp = list(stamp) if isinstance(stamp, tuple) else stamp
+        stamps[name] = stamp
+        cached = cache.get(name)
+        if cached is not None and cached[0] == stamp:
+            results[name] = cached[1]
+        else:
+            changed.append(name)
+
+    def finish(names, entries, batch):
+        results.update(zip(names, batch))
+    #Entries deleted since they were stamped read as None from the snapshot,
+    #and are left out of the report and the cache
+    audited = 0
+    if changed:
+        audited = mapVault(vault, auditBatch, finish, workers, names=changed)
+
+    #Entries saved while this ran are stamped afresh next time
+    saveCache(vault, dict((name, [stamps[name], result])
+        for name, result in results.items()))
+    return AuditReport(results, audited)
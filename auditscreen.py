@@ -0,0 +1,93 @@
+'''
+The window that shows the result of a password audit: the entries that share
+a password, the weak ones and any that could not be read, see audit.py. The
+report can be saved as JSON, which holds no passwords
+'''
+
+from PyQt5.QtWidgets import (QWidget, QLabel, QPushButton, QGridLayout,
+    QTreeWidget, QTreeWidgetItem, QFileDialog)
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QFont
+
+from common import setColor, buttonStylesheet
+
+class AuditScreen(QWidget):
+    def __init__(self, report, parent):
+        super().__init__()
+        self.report = report
+        self.parent = parent
+        self.initUI()
+
+    def initUI(self):
+        font = QFont("Arial", 12)
+
+        #Labels
+        summaryLabel = QLabel(
+            "<font color='white'>%s</font>" % self.report.summary())
+        summaryLabel.setFont(font)
+        summaryLabel.setWordWrap(True)
+        summaryLabel.setAlignment(Qt.AlignCenter)
+
+        #Findings, one branch for each kind
+        tree = QTreeWidget()
+        tree.setFont(font)
+        tree.setHeaderLabels(["Entry", "Details"])
+        reused = QTreeWidgetItem(tree, ["Reused passwords",
+            "%d groups" % len(self.report.reused())])
+        for number, group in enumerate(self.report.reused()):
+            item = QTreeWidgetItem(reused, ["Group %d" % (number + 1),
+                "%d entries" % len(group)])
+            for name in group:
+                QTreeWidgetItem(item, [name, ""])
+        weak = QTreeWidgetItem(tree, ["Weak passwords",
+            "%d entries" % len(self.report.weak())])
+        for name, result in self.report.weak():
+            QTreeWidgetItem(weak, [name, "%s, %s bits%s" % (result['rating'],
+                result['bits'], ''.join('; ' + x for x in result['problems']))])
+        if self.report.failed():
+            failed = QTreeWidgetItem(tree, ["Unreadable entries",
+                "%d entries" % len(self.report.failed())])
+            for name, reason in self.report.failed():
+                QTreeWidgetItem(failed, [name, reason])
+        tree.expandToDepth(0)
+        tree.resizeColumnToContents(0)
+
+        #Buttons
+        exportButton = QPushButton('Export JSON...')
+        exportButton.setFont(font)
+        exportButton.setStyleSheet(buttonStylesheet)
+        exportButton.clicked.connect(lambda x: self.exportJson())
+
+        closeButton = QPushButton('Close')
+        closeButton.setFont(font)
+        closeButton.setStyleSheet(buttonStylesheet)
+        closeButton.clicked.connect(lambda x: self.close())
+
+        #Layout setup
+        grid = QGridLayout()
+        grid.setSpacing(20)
+
+        grid.addWidget(summaryLabel, 0, 0, 1, 2)
+        grid.addWidget(tree, 1, 0, 1, 2)
+        grid.addWidget(exportButton, 2, 0)
+        grid.addWidget(closeButton, 2, 1)
+
+        setColor(self, 51, 51, 51)
+        self.setLayout(grid)
+        self.setWindowTitle("Password Audit")
+        self.resize(500, 500)
+        self.show()
+
+    def exportJson(self):
+        '''
+        Writes the report to a file of the user's choosing
+        '''
+        path, _ = QFileDialog.getSaveFileName(self, "Export audit",
+            "passman-audit.json", "JSON files (*.json)")
+        if path == '':
+            return
+        try:
+            self.report.writeJson(path)
+        except OSError as error:
+            self.parent.tray.showMessage("Password Manager",
+                "Failed: %s" % error)
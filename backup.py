@@ -0,0 +1,458 @@
+'''
+Backup archives of a whole vault in one file.
+
+An archive is written from a point in time snapshot of the vault, so saving
+entries while it runs does not leave it half old and half new. Entries are
+copied still encrypted, a chunk at a time, so memory use does not depend on
+the size of the vault.
+
+Layout: MAGIC, a random salt for the archive key and the master password
+record, then a zlib stream of frames, then an HMAC-SHA256 of everything
+before it. Each frame is a kind, a name and a payload, and an end frame
+holding the entry count comes last. The HMAC is keyed from the master key the
+record gives, so an archive can only be checked and restored with the master
+password it was made with.
+
+Every entry frame comes first, then a frame for each entry's history log and
+then each attachment: its stored contents in frames of up to CHUNK bytes, and
+its key file last. Both are copied as stored, still encrypted. A restore
+checks the archive and copies its frames to a temporary file in the same
+pass, and only restores from that copy once the HMAC matches, so nothing
+from an archive that was changed is written. Archives from older versions, with the salt of a
+separate master key in the header and the record in the first frame, can
+still be restored.
+
+python passmancli.py export FILE
+python passmancli.py restore FILE
+'''
+
+from hmac import compare_digest, new as hmacNew
+from hashlib import sha256
+from os import fstat, fsync, remove, replace, urandom
+from os.path import exists
+from re import compile as compileRegex
+from struct import Struct
+from tempfile import TemporaryFile
+from zlib import compressobj, decompressobj, error as ZlibError
+
+from attachments import entryHash, AttachmentCopy
+from history import parseLog
+from importer import ImportReport
+from keys import deriveLegacyMasterKey, expandKey, reencryptEntry
+from masterkey import createRecord, isLegacy, readFields, verify
+from storage import writeAtomic, writeTemporary
+from vault import checkName, Vault, WrongPasswordError
+
+MAGIC = b'PMBACKUP\x02'
+HEADER = Struct('<9s16sI')       #magic, archive key salt, record length
+LEGACY_MAGIC = b'PMBACKUP\x01'
+LEGACY_HEADER = Struct('<9s16s16s')     #magic, master key salt, archive salt
+MAX_RECORD = 1 << 16
+FRAME = Struct('<BHI')           #kind, name length, payload length
+COUNT = Struct('<Q')
+MAC_SIZE = 32
+
+RECORD = 1
+ENTRY = 2
+END = 3
+HISTORY = 4
+ATTACHMENT = 5
+ATTACHMENT_KEY = 6
+
+CHUNK = 1 << 16
+BATCH = 1000
+#An entry hash and a random id, see AttachmentStore.writeContents
+ATTACHMENT_ID = compileRegex('[0-9a-f]{16}\\.[0-9a-f]{16}')
+
+class CorruptArchiveError(Exception):
+    """The archive is damaged, truncated or was changed after it was made"""
+    pass
+
+def archiveMac(masterKey, archiveSalt):
+    return hmacNew(expandKey(masterKey, b'PassMan backup' + archiveSalt),
+        digestmod=sha256)
+
+class ArchiveWriter:
+    '''
+    Compresses frames into the archive a chunk at a time, adding everything
+    written to the HMAC
+    '''
+    def __init__(self, file, mac):
+        self.file = file
+        self.mac = mac
+        self.compressor = compressobj(6)
+        self.pending = []
+        self.pendingSize = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.mac.update(data)
+
+    def frame(self, kind, name, payload):
+        encodedName = name.encode()
+        self.pending.append(FRAME.pack(kind, len(encodedName), len(payload)))
+        self.pending.append(encodedName)
+        self.pending.append(payload)
+        self.pendingSize += FRAME.size + len(encodedName) + len(payload)
+        if self.pendingSize >= CHUNK:
+            self.flush()
+
+    def flush(self):
+        self.write(self.compressor.compress(b''.join(self.pending)))
+        self.pending = []
+        self.pendingSize = 0
+
+    def finish(self):
+        self.flush()
+        self.write(self.compressor.flush())
+        self.file.write(self.mac.digest())
+
+def exportArchive(vault, path):
+    '''
+    Writes a backup of an unlocked vault, with the history and attachments
+    of its entries, to path and returns the number of entries in it. The
+    archive is written under a temporary name and renamed once complete
+    '''
+    vault.checkUnlocked()
+    with open(vault.recordPath, 'rb') as file:
+        record = file.read()
+    archiveSalt = urandom(16)
+
+    tempPath = writeTemporary(path, b'', sync=False)
+    snapshot = vault.snapshot()
+    count = 0
+    hashes = {}
+    try:
+        with open(tempPath, 'wb') as file:
+            writer = ArchiveWriter(file,
+                archiveMac(vault.masterKey, archiveSalt))
+            writer.write(HEADER.pack(MAGIC, archiveSalt, len(record)))
+            writer.write(record)
+            for name in snapshot.names():
+                data = snapshot.read(name)
+                if data is None:
+                    continue
+                writer.frame(ENTRY, name, data)
+                hashes[entryHash(name)] = name
+                count += 1
+            exportExtras(vault, writer, hashes)
+            writer.frame(END, '', COUNT.pack(count))
+            writer.finish()
+            file.flush()
+            fsync(file.fileno())
+        replace(tempPath, path)
+    finally:
+        snapshot.close()
+        if exists(tempPath):
+            remove(tempPath)
+    return count
+
+def exportExtras(vault, writer, hashes):
+    '''
+    Writes the history logs and attachments of the entries in the archive,
+    found by the hashes of their names. Those of entries saved or deleted
+    since the snapshot may be newer than it, and are left out if they are
+    gone by the time they are read
+    '''
+    for log in vault.history.logs():
+        contents = vault.history.readLog(log)
+        if log in hashes and contents:
+            writer.frame(HISTORY, hashes[log], contents)
+    store = vault.attachmentStore
+    for id in store.ids():
+        if id.split('.')[0] not in hashes:
+            continue
+        try:
+            keyData = store.readKeyFile(id)
+            for data in store.storedChunks(id):
+                writer.frame(ATTACHMENT, id, data)
+        except FileNotFoundError:
+            #Its contents, if any were written, are dropped on restore
+            continue
+        writer.frame(ATTACHMENT_KEY, id, keyData)
+
+def splitFrames(buffer):
+    '''
+    Returns the complete (kind, name, payload) frames at the start of buffer
+    and the bytes left over after them
+    '''
+    frames = []
+    position = 0
+    while len(buffer) - position >= FRAME.size:
+        kind, nameLength, payloadLength = FRAME.unpack_from(buffer, position)
+        end = position + FRAME.size + nameLength + payloadLength
+        if end > len(buffer):
+            break
+        nameStart = position + FRAME.size
+        try:
+            name = buffer[nameStart:nameStart + nameLength].decode()
+        except UnicodeDecodeError:
+            raise CorruptArchiveError('The archive is damaged')
+        frames.append((kind, name, buffer[nameStart + nameLength:end]))
+        position = end
+    return frames, buffer[position:]
+
+def stagedFrames(file):
+    """Yields the frames written to a staging file by Archive.check"""
+    buffer = b''
+    while True:
+        chunk = file.read(CHUNK)
+        if not chunk:
+            break
+        frames, buffer = splitFrames(buffer + chunk)
+        yield from frames
+    if buffer:
+        raise CorruptArchiveError('The archive is truncated')
+
+def validName(kind, name):
+    '''
+    Checks that a frame's name is one its kind can have, so that a made up
+    archive cannot name files outside the vault
+    '''
+    if kind == ATTACHMENT or kind == ATTACHMENT_KEY:
+        return ATTACHMENT_ID.fullmatch(name) is not None
+    try:
+        checkName(name)
+    except ValueError:
+        return False
+    return True
+
+def readFrames(file, mac, length):
+    '''
+    Yields the (kind, name, payload) frames from the next length bytes of
+    compressed data, adding them to the HMAC as they are read
+    '''
+    decompressor = decompressobj()
+    buffer = b''
+    remaining = length
+    while remaining > 0 or decompressor.unconsumed_tail:
+        if decompressor.unconsumed_tail:
+            chunk = decompressor.unconsumed_tail
+        else:
+            chunk = file.read(min(CHUNK, remaining))
+            if not chunk:
+                raise CorruptArchiveError('The archive is truncated')
+            remaining -= len(chunk)
+            mac.update(chunk)
+        try:
+            #Bounded output, so a damaged stream cannot balloon in memory
+            buffer += decompressor.decompress(chunk, CHUNK * 4)
+        except ZlibError:
+            raise CorruptArchiveError('The archive is damaged')
+        frames, buffer = splitFrames(buffer)
+        yield from frames
+
+    try:
+        frames, buffer = splitFrames(buffer + decompressor.flush())
+    except ZlibError:
+        raise CorruptArchiveError('The archive is damaged')
+    yield from frames
+    if buffer or not decompressor.eof:
+        raise CorruptArchiveError('The archive is truncated')
+
+class Archive:
+    '''
+    An archive opened with its master password. Opening reads only the
+    header and derives the master key, raising WrongPasswordError if the
+    password does not match the archive's record. The master key of an
+    archive in the older format (legacy) cannot be checked until the whole
+    archive is
+    '''
+    def __init__(self, path, password):
+        self.path = path
+        self.password = password
+        with open(path, 'rb') as file:
+            magic = file.read(len(MAGIC))
+            file.seek(0)
+            if magic == LEGACY_MAGIC:
+                self.openLegacy(file.read(LEGACY_HEADER.size))
+                return
+            header = file.read(HEADER.size)
+            if magic != MAGIC or len(header) < HEADER.size:
+                raise CorruptArchiveError('Not a PassMan backup: ' + path)
+            _, self.archiveSalt, length = HEADER.unpack(header)
+            if length > MAX_RECORD:
+                raise CorruptArchiveError('The archive is damaged')
+            self.record = file.read(length)
+        self.headerSize = HEADER.size + length
+        self.legacy = False
+        try:
+            self.masterKey, upgraded = verify(password, self.record)
+        except ValueError:
+            raise CorruptArchiveError('The archive is damaged')
+        if upgraded is not None:
+            raise CorruptArchiveError('The archive is damaged')
+        if self.masterKey is None:
+            raise WrongPasswordError(path)
+
+    def openLegacy(self, header):
+        if len(header) < LEGACY_HEADER.size:
+            raise CorruptArchiveError('Not a PassMan backup: ' + self.path)
+        _, keySalt, self.archiveSalt = LEGACY_HEADER.unpack(header)
+        self.headerSize = LEGACY_HEADER.size
+        self.legacy = True
+        self.record = None
+        self.masterKey = deriveLegacyMasterKey(self.password, keySalt)
+
+    def frames(self):
+        '''
+        Yields every frame in the archive. Raises CorruptArchiveError at the
+        end if the HMAC does not match, so nothing read should be trusted
+        until the generator is finished
+        '''
+        mac = archiveMac(self.masterKey, self.archiveSalt)
+        with open(self.path, 'rb') as file:
+            length = (fstat(file.fileno()).st_size - self.headerSize -
+                MAC_SIZE)
+            if length <= 0:
+                raise CorruptArchiveError('The archive is truncated')
+            mac.update(file.read(self.headerSize))
+            yield from readFrames(file, mac, length)
+            if not compare_digest(mac.digest(), file.read(MAC_SIZE)):
+                raise CorruptArchiveError(
+                    'The archive is damaged or the password is wrong')
+
+    def check(self, staging=None):
+        '''
+        Checks the whole archive in one pass. Raises WrongPasswordError or
+        CorruptArchiveError if it cannot be restored, and returns the master
+        password record and entry count. Every frame is also written to the
+        binary file staging, if one is given, to be restored from once this
+        returns
+        '''
+        record = self.record
+        count = 0
+        ended = False
+        extras = False
+        for kind, name, payload in self.frames():
+            if ended:
+                raise CorruptArchiveError('Data after the end of the archive')
+            if kind in (ENTRY, HISTORY, ATTACHMENT, ATTACHMENT_KEY) and (
+                not validName(kind, name)):
+                raise CorruptArchiveError('Invalid name in the archive')
+            if staging is not None:
+                encodedName = name.encode()
+                staging.write(FRAME.pack(kind, len(encodedName), len(payload))
+                    + encodedName + payload)
+            if kind == RECORD and record is None and self.legacy:
+                record = payload
+                try:
+                    matched = verify(self.password, record)[0] is not None
+                except ValueError:
+                    raise CorruptArchiveError('The archive is damaged')
+                if not matched:
+                    raise WrongPasswordError(self.path)
+            elif kind == ENTRY and record is not None and not extras:
+                count += 1
+            elif kind in (HISTORY, ATTACHMENT, ATTACHMENT_KEY) and (
+                record is not None):
+                extras = True
+            elif kind == END and record is not None:
+                if COUNT.unpack(payload)[0] != count:
+                    raise CorruptArchiveError('Entries are missing')
+                ended = True
+            else:
+                raise CorruptArchiveError('Unexpected frame in the archive')
+        if not ended:
+            raise CorruptArchiveError('The archive is truncated')
+        return record, count
+
+def restoreArchive(path, password, vault=None, directory=None):
+    '''
+    Restores an archive once it has been checked. With an unlocked vault the
+    archive's entries are added to it, re-encrypted if the vault has a
+    different master key and skipped if the name is taken, along with their
+    history and attachments. Otherwise a new vault is made in directory,
+    which must not have one yet. Returns an ImportReport
+    '''
+    archive = Archive(path, password)
+    #Nothing is read from the archive again after the check, so what is
+    #restored is what was checked
+    with TemporaryFile() as staging:
+        record, _ = archive.check(staging)
+        staging.seek(0)
+        return restoreFrames(archive, record, stagedFrames(staging), vault,
+            directory)
+
+def restoreFrames(archive, record, frames, vault, directory):
+    """Restores checked frames, see restoreArchive"""
+    password = archive.password
+
+    recordPath = None
+    if vault is None:
+        vault = Vault(directory)
+        if vault.exists():
+            raise FileExistsError(vault.recordPath)
+        masterKey = archive.masterKey
+        if archive.legacy:
+            #The entries are re-encrypted under the key of a new record
+            record, masterKey = createRecord(password,
+                None if isLegacy(record) else readFields(record)['n'])
+        vault.setUnlocked(password, masterKey, fresh=True)
+        recordPath = vault.recordPath
+    vault.checkUnlocked()
+    sameKey = compare_digest(vault.masterKey, archive.masterKey)
+
+    report = ImportReport()
+    batch = []
+    def save():
+        skipped = set(vault.createMany(batch))
+        report.duplicates.extend(skipped)
+        report.imported.extend(x[0] for x in batch if x[0] not in skipped)
+        del batch[:]
+
+    def reencrypt(data):
+        if sameKey:
+            return data
+        return reencryptEntry(data, archive.masterKey, password,
+            vault.masterKey)
+
+    #Entries come first, so by the first history or attachment frame the
+    #last batch is saved and it is known which entries were imported
+    imported = None
+    copy = None
+    try:
+        for kind, name, payload in frames:
+            if kind == ENTRY:
+                batch.append((name, reencrypt(payload)))
+                if len(batch) >= BATCH:
+                    save()
+                continue
+            if kind not in (HISTORY, ATTACHMENT, ATTACHMENT_KEY):
+                continue
+            if imported is None:
+                save()
+                imported = {entryHash(x): x for x in report.imported}
+            if kind == HISTORY and imported.get(entryHash(name)) == name:
+                with vault.writeLock:
+                    vault.checkWritable()
+                    vault.history.write(name, [(when, reencrypt(data))
+                        for when, data in parseLog(payload)])
+            elif kind == ATTACHMENT and name.split('.')[0] in imported:
+                if copy is not None and copy.id != name:
+                    copy.abort()
+                    copy = None
+                if copy is None:
+                    copy = AttachmentCopy(vault.attachmentStore, name)
+                copy.write(payload)
+            elif kind == ATTACHMENT_KEY and copy is not None and (
+                copy.id == name):
+                current, copy = copy, None
+                try:
+                    with vault.writeLock:
+                        vault.checkWritable()
+                        current.finish(reencrypt(payload))
+                except FileExistsError:
+                    pass
+    finally:
+        if copy is not None:
+            copy.abort()
+    save()
+    vault.sync()
+
+    #The master password record goes in last, so an interrupted restore
+    #does not look like a finished vault
+    if recordPath is not None:
+        writeAtomic(recordPath, record)
+        vault.close()
+    return report
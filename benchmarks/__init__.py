@@ -0,0 +1,23 @@
+'''
+Benchmarks for PassMan. Run them from the repository root:
+
+python -m benchmarks.run            times the real code paths against
+                                    synthetic vaults, see run.py
+python -m benchmarks.synthvault     writes a synthetic vault to a folder
+python -m benchmarks.bench_search   micro-benchmark of the search index
+python -m benchmarks.bench_entrytable
+                                    micro-benchmark of the sorted entry table
+python -m benchmarks.bench_layout
+                                    flat and sharded entry folders compared
+python -m benchmarks.bench_stores   conformance checks and timings for every
+                                    storage backend
+python -m benchmarks.bench_attachments
+                                    streams a large attachment in and out
+                                    and checks memory and listing times
+python -m benchmarks.bench_watcher  checks that entries saved by another
+                                    program reach the list in one update
+python -m benchmarks.bench_generator
+                                    micro-benchmark of the password generator
+python -m benchmarks.crashtest      kills a process mid save and checks that
+                                    no entry is lost or torn
+'''
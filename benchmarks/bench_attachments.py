@@ -0,0 +1,113 @@
+'''
+Benchmark of attachments. Attaches a large file to an entry of a synthetic
+vault and times writing it, copying it back out and reading small byte
+ranges from it, and checks that memory use stays flat while doing so and
+that listing the vault takes no longer than it did without the attachment.
+
+Run from the repository root:
+python benchmarks/bench_attachments.py [megabytes] [number of entries]
+'''
+
+from io import RawIOBase
+from os import devnull, makedirs, urandom
+from os.path import dirname, abspath, join
+from random import Random
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from statistics import median
+from sys import argv, exit, path
+from tempfile import mkdtemp
+from time import perf_counter
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from masterkey import MIN_N
+from vault import Vault
+from benchmarks.bench_search import syntheticNames
+
+PASSWORD = b'benchmark master password'
+BLOCK = 1 << 20
+RANGE_READS = 200
+#Memory a streamed copy may add, whatever the size of the attachment
+MAX_GROWTH = 32 << 20
+
+class RandomFile(RawIOBase):
+    """A readable file of size random bytes that never exists in full"""
+    def __init__(self, size):
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.remaining, BLOCK)
+        buffer[:count] = urandom(count)
+        self.remaining -= count
+        return count
+
+def peakMemory():
+    """Returns the peak resident memory of this process so far, in bytes"""
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+def timedListing(vault):
+    times = []
+    for _ in range(5):
+        start = perf_counter()
+        vault.names()
+        times.append(perf_counter() - start)
+    return median(times)
+
+def main(megabytes, count):
+    size = megabytes << 20
+    root = mkdtemp(prefix='passman-attach-')
+    failed = False
+    try:
+        directory = join(root, 'PassManData')
+        makedirs(directory)
+        vault = Vault(directory)
+        vault.create(PASSWORD, MIN_N)
+        names = syntheticNames(count)
+        for name in names:
+            vault.put(name, 'secret')
+        before = timedListing(vault)
+
+        peak = peakMemory()
+        start = perf_counter()
+        vault.attach(names[0], 'large.bin', RandomFile(size))
+        writeS = perf_counter() - start
+        writeGrowth = peakMemory() - peak
+        after = timedListing(vault)
+
+        random = Random(0)
+        with vault.openAttachment(names[0], 'large.bin') as reader:
+            start = perf_counter()
+            for _ in range(RANGE_READS):
+                reader.read(random.randrange(size), 100)
+            rangeUs = (perf_counter() - start) * 1e6 / RANGE_READS
+            peak = peakMemory()
+            start = perf_counter()
+            with open(devnull, 'wb') as target:
+                reader.copyTo(target)
+            readS = perf_counter() - start
+            readGrowth = peakMemory() - peak
+
+        print('attachment:         %d MB' % megabytes)
+        print('write:              %.2f s (%.0f MB/s)' % (writeS,
+            megabytes / writeS))
+        print('copy out:           %.2f s (%.0f MB/s)' % (readS,
+            megabytes / readS))
+        print('100 byte range:     %.0f us' % rangeUs)
+        print('memory growth:      %.1f MB writing, %.1f MB copying out' % (
+            writeGrowth / 2**20, readGrowth / 2**20))
+        print('listing %d entries: %.2f ms before, %.2f ms after' % (count,
+            before * 1000, after * 1000))
+        if max(writeGrowth, readGrowth) > MAX_GROWTH:
+            print('FAIL: memory grew with the size of the attachment')
+            failed = True
+        vault.close()
+    finally:
+        rmtree(root)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    exit(main(int(argv[1]) if len(argv) > 1 else 256,
+        int(argv[2]) if len(argv) > 2 else 1000))
@@ -0,0 +1,86 @@
+'''
+Micro-benchmark for the main screen's entry table. Times building it,
+looking names up, saving and deleting single entries and deleting a
+multi-selection, next to the same operations on a plain list, and measures
+the memory the table adds per entry, on top of the names themselves, and
+the peak while sorting.
+
+Run from the repository root:
+python benchmarks/bench_entrytable.py [number of names]
+'''
+
+from os.path import dirname, abspath
+from random import Random
+from sys import argv, exit, getsizeof, path
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from entrytable import EntryTable
+from benchmarks.bench_search import syntheticNames
+
+OPERATIONS = 1000
+SELECTION = 500
+#The table only holds a reference per entry, plus a little slack from
+#growing the list
+MAX_BYTES_PER_ENTRY = 10
+
+def timeEach(function, items):
+    """Returns the mean time of function over items in microseconds"""
+    begin = perf_counter()
+    for item in items:
+        function(item)
+    return (perf_counter() - begin) * 1e6 / len(items)
+
+def main(count):
+    random = Random(0)
+    names = syntheticNames(count)
+    taken = set(names)
+    extra = [x for x in syntheticNames(OPERATIONS * 2, seed=1)
+        if x not in taken][:OPERATIONS]
+    lookups = random.sample(names, OPERATIONS)
+
+    start()
+    begin = perf_counter()
+    table = EntryTable(names)
+    buildMs = (perf_counter() - begin) * 1000
+    peak = get_traced_memory()[1]
+    stop()
+    perEntry = getsizeof(table.names) / count
+
+    plain = list(names)
+    rows = [
+        ('lookup', timeEach(table.find, lookups),
+            timeEach(plain.index, lookups[:50])),
+        ('save', timeEach(table.add, extra), timeEach(plain.append, extra)),
+        ('delete', timeEach(lambda x: table.removeMany([x]), extra),
+            timeEach(plain.remove, extra)),
+        ]
+
+    selection = random.sample(names, SELECTION)
+    begin = perf_counter()
+    table.removeMany(selection)
+    batchMs = (perf_counter() - begin) * 1000
+    begin = perf_counter()
+    for name in selection:
+        plain.remove(name)
+    plainBatchMs = (perf_counter() - begin) * 1000
+
+    print('names:              %d' % count)
+    print('build (sorted):     %.1f ms' % buildMs)
+    print('table memory:       %.1f bytes per entry' % perEntry)
+    print('build peak:         %.1f bytes per entry' % (peak / count))
+    print('%-20s%12s%12s' % ('', 'table', 'plain list'))
+    for name, tableUs, plainUs in rows:
+        print('%-20s%9.2f us%9.2f us' % (name + ':', tableUs, plainUs))
+    print('%-20s%9.2f ms%9.2f ms' % ('delete %d:' % SELECTION, batchMs,
+        plainBatchMs))
+
+    if perEntry > MAX_BYTES_PER_ENTRY:
+        print('FAIL: the table uses more than %d bytes per entry'
+            % MAX_BYTES_PER_ENTRY)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    exit(main(int(argv[1]) if len(argv) > 1 else 100000))
@@ -0,0 +1,57 @@
+'''
+Micro-benchmark for the password generator. Times single passwords the way
+the Add Password screen makes them and bulk batches for a few policies, and
+checks that every character of the alphabet comes up about equally often.
+
+Run from the repository root:
+python benchmarks/bench_generator.py [number of passwords]
+'''
+
+from collections import Counter
+from os.path import dirname, abspath
+from sys import argv, exit, path
+from time import perf_counter
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from generator import Policy, generate, generateMany
+
+POLICIES = [
+    ('default', Policy()),
+    ('no symbols', Policy(symbols=False)),
+    ('16 with minimums', Policy(length=16, excludeLookalikes=True,
+        minimums={'upper': 1, 'digits': 2, 'symbols': 1})),
+    ]
+
+#Largest allowed gap between the most and least common character, relative
+#to the expected count
+MAX_SKEW = 0.05
+
+def main(count):
+    failed = False
+    start = perf_counter()
+    for _ in range(10000):
+        generate()
+    print('single password:    %.1f us' % ((perf_counter() - start) * 100))
+
+    for name, policy in POLICIES:
+        start = perf_counter()
+        passwords = generateMany(count, policy)
+        elapsed = perf_counter() - start
+        print('%-20s%10.0f passwords/s  %s' % (name + ':', count / elapsed,
+            policy.report()))
+
+        counts = Counter(''.join(passwords[:100000]))
+        expected = sum(counts.values()) / len(counts)
+        skew = (max(counts.values()) - min(counts.values())) / expected
+        #Minimums make their classes more common, so only the policies
+        #without them should be flat
+        if not policy.minimums and skew > MAX_SKEW:
+            print('FAIL: character counts are skewed by %.1f%%' % (skew * 100))
+            failed = True
+        if not all(policy.check(x.encode()) for x in passwords):
+            print('FAIL: a password does not meet the policy')
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    exit(main(int(argv[1]) if len(argv) > 1 else 1000000))
@@ -0,0 +1,76 @@
+'''
+Micro-benchmark of the flat and sharded entry layouts. Fills a folder of
+each kind with the same entries, then times listing them, saving new ones
+and deleting them.
+
+Run from the repository root:
+python benchmarks/bench_layout.py [number of entries]
+'''
+
+from os import makedirs, urandom
+from os.path import dirname, abspath, join
+from shutil import rmtree
+from statistics import median
+from sys import argv, exit, path
+from tempfile import mkdtemp
+from time import perf_counter
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from shardstore import ShardStore, migrateToShards
+from storage import DirectoryStore
+from benchmarks.bench_search import syntheticNames
+
+OPERATIONS = 200
+ENTRY_SIZE = 120
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return median(times)
+
+def measure(store, extra):
+    listMs = timed(store.names, 5) * 1000
+    start = perf_counter()
+    for name in extra:
+        store.create(name, urandom(ENTRY_SIZE))
+    createUs = (perf_counter() - start) * 1e6 / len(extra)
+    start = perf_counter()
+    for name in extra:
+        store.delete(name)
+    deleteUs = (perf_counter() - start) * 1e6 / len(extra)
+    return listMs, createUs, deleteUs
+
+def main(count):
+    names = syntheticNames(count)
+    taken = set(names)
+    extra = [x for x in syntheticNames(OPERATIONS * 2, seed=1)
+        if x not in taken][:OPERATIONS]
+    root = mkdtemp()
+    try:
+        flatDirectory = join(root, 'flat')
+        shardDirectory = join(root, 'sharded')
+        for directory in (flatDirectory, shardDirectory):
+            makedirs(directory)
+            DirectoryStore(directory).createMany(
+                [(x, urandom(ENTRY_SIZE)) for x in names])
+        start = perf_counter()
+        migrateToShards(shardDirectory)
+        migrateS = perf_counter() - start
+
+        print('entries:            %d' % count)
+        print('migration:          %.2f s' % migrateS)
+        print('%-20s%12s%12s%12s' % ('', 'list', 'save', 'delete'))
+        for label, store in (('flat', DirectoryStore(flatDirectory)),
+            ('sharded', ShardStore(shardDirectory))):
+            listMs, createUs, deleteUs = measure(store, extra)
+            print('%-20s%9.1f ms%9.0f us%9.0f us' % (label + ':', listMs,
+                createUs, deleteUs))
+    finally:
+        rmtree(root)
+    return 0
+
+if __name__ == '__main__':
+    exit(main(int(argv[1]) if len(argv) > 1 else 100000))
@@ -0,0 +1,76 @@
+'''
+Micro-benchmark for the entry name search index. Builds an index over
+synthetic entry names and times every keystroke of a set of queries as if
+they were typed into the search box, plus incremental adds and removes.
+
+Run from the repository root:
+python benchmarks/bench_search.py [number of names]
+'''
+
+from os.path import dirname, abspath
+from random import Random
+from sys import argv, exit, path
+from time import perf_counter
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from searchindex import buildIndex
+
+#One frame at 60Hz
+FRAME_MS = 16.0
+
+WORDS = ['mail', 'bank', 'google', 'amazon', 'work', 'home', 'router', 'vpn',
+    'github', 'steam', 'forum', 'shop', 'cloud', 'server', 'admin', 'test',
+    'school', 'library', 'wifi', 'phone', 'account', 'backup', 'db', 'prod']
+
+QUERIES = ['google mail', 'bnak', 'server 12', 'a', 'zz', 'prod db 4',
+    'githbu', 'library 99999']
+
+def syntheticNames(count, seed=0):
+    """Returns count unique entry names made of letters, digits and spaces"""
+    random = Random(seed)
+    names = set()
+    while len(names) < count:
+        words = random.sample(WORDS, random.randint(1, 3))
+        names.add(' '.join(words).title() + ' ' + str(random.randint(0, 99999)))
+    return list(names)
+
+def main(count):
+    names = syntheticNames(count)
+
+    start = perf_counter()
+    #Built the way the main screen builds it, see buildIndex
+    index = buildIndex(names)
+    buildMs = (perf_counter() - start) * 1000
+
+    worst = 0.0
+    timings = []
+    for query in QUERIES:
+        for i in range(1, len(query) + 1):
+            start = perf_counter()
+            index.search(query[:i])
+            elapsed = (perf_counter() - start) * 1000
+            timings.append(elapsed)
+            worst = max(worst, elapsed)
+
+    extra = syntheticNames(1000, seed=1)
+    start = perf_counter()
+    for name in extra:
+        index.add(name)
+    for name in extra:
+        index.remove(name)
+    updateUs = (perf_counter() - start) * 1e6 / (2 * len(extra))
+
+    timings.sort()
+    print('names:              %d' % count)
+    print('index build:        %.1f ms' % buildMs)
+    print('keystroke median:   %.2f ms' % timings[len(timings) // 2])
+    print('keystroke worst:    %.2f ms' % worst)
+    print('add/remove:         %.1f us per name' % updateUs)
+
+    if worst > FRAME_MS:
+        print('FAIL: a keystroke took longer than %.0f ms' % FRAME_MS)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    exit(main(int(argv[1]) if len(argv) > 1 else 100000))
@@ -0,0 +1,167 @@
+'''
+Conformance checks and benchmarks for the storage backends. Every backend is
+put through the same checks of the Store interface in storage.py, and then
+timed saving entries one at a time, saving them in bulk, listing, reading
+and deleting them, and reading from several threads while another writes.
+
+Run from the repository root:
+python benchmarks/bench_stores.py [number of entries] [backend ...]
+'''
+
+from os import makedirs, urandom
+from os.path import dirname, abspath, join
+from random import Random
+from shutil import rmtree
+from sys import argv, exit, path
+from tempfile import mkdtemp
+from threading import Thread
+from time import perf_counter
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from shardstore import ShardStore
+from sqlitestore import SqliteStore
+from storage import DirectoryStore, SQLITE_NAME, VAULT_NAME
+from vaultfile import VaultFile
+from benchmarks.bench_search import syntheticNames
+
+BACKENDS = {
+    'directory': lambda directory: DirectoryStore(directory),
+    'sharded': lambda directory: ShardStore(directory),
+    'vaultfile': lambda directory: VaultFile(join(directory, VAULT_NAME)),
+    'sqlite': lambda directory: SqliteStore(join(directory, SQLITE_NAME)),
+    }
+
+SINGLE = 200
+READERS = 4
+ENTRY_SIZE = 120
+
+def expectError(error, function, *args):
+    try:
+        function(*args)
+    except error:
+        return
+    raise AssertionError('%s did not raise %s' % (function.__name__,
+        error.__name__))
+
+def conformance(openStore, directory):
+    '''
+    Checks the behaviour every backend has to share. Raises AssertionError
+    on the first difference
+    '''
+    store = openStore(directory)
+    assert store.names() == []
+    store.create('alpha', b'one')
+    assert store.read('alpha') == b'one'
+    expectError(FileExistsError, store.create, 'alpha', b'two')
+    store.write('alpha', b'two')
+    assert store.read('alpha') == b'two'
+    expectError(FileNotFoundError, store.read, 'missing')
+    expectError(FileNotFoundError, store.delete, 'missing')
+
+    #Names that would be reserved in the data folder are only reserved there
+    skipped = store.createMany([('beta', b'b'), ('alpha', b'x'),
+        ('gamma 1', b'g' * 70000)])
+    assert skipped == ['alpha'], skipped
+    assert sorted(store.names()) == ['alpha', 'beta', 'gamma 1']
+    assert store.read('gamma 1') == b'g' * 70000
+
+    with store.group():
+        store.create('delta', b'd')
+        store.delete('beta')
+    assert sorted(store.names()) == ['alpha', 'delta', 'gamma 1']
+
+    snapshot = store.snapshot()
+    store.create('epsilon', b'e')
+    store.delete('delta')
+    assert sorted(snapshot.names()) == ['alpha', 'delta', 'gamma 1']
+    assert snapshot.read('alpha') == b'two'
+    snapshot.close()
+
+    store.sync()
+    store.close()
+    store = openStore(directory)
+    assert sorted(store.names()) == ['alpha', 'epsilon', 'gamma 1']
+    assert store.read('epsilon') == b'e'
+    store.close()
+
+def timed(function):
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+def benchmark(openStore, directory, names):
+    '''
+    Returns the timings of one backend in a dictionary: microseconds per
+    entry for each operation, and reads per second with concurrent writes
+    '''
+    random = Random(0)
+    entries = [(x, urandom(ENTRY_SIZE)) for x in names]
+    store = openStore(directory)
+    results = {}
+
+    single = entries[:SINGLE]
+    def createSingle():
+        for name, data in single:
+            store.create(name, data)
+    results['create'] = timed(createSingle) / len(single)
+    results['createMany'] = (timed(lambda: store.createMany(entries[SINGLE:]))
+        / max(1, len(entries) - SINGLE))
+    results['names'] = timed(store.names) / len(entries)
+    sample = random.sample(names, min(len(names), 2000))
+    results['read'] = timed(lambda: [store.read(x) for x in sample]) / len(sample)
+
+    #Readers on their own threads while this one keeps saving
+    counts = [0] * READERS
+    done = []
+    def reader(number):
+        local = Random(number)
+        while not done:
+            store.read(local.choice(names))
+            counts[number] += 1
+    threads = [Thread(target=reader, args=(x,)) for x in range(READERS)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for name, data in single:
+        store.write(name, data)
+    done.append(True)
+    for thread in threads:
+        thread.join()
+    results['concurrentReads'] = sum(counts) / (perf_counter() - start)
+
+    results['delete'] = timed(
+        lambda: [store.delete(x) for x, _ in single]) / len(single)
+    store.close()
+    return results
+
+def main(count, backends):
+    names = syntheticNames(count)
+    root = mkdtemp()
+    failed = False
+    try:
+        print('%-12s%10s%12s%10s%10s%10s%14s' % ('', 'create', 'createMany',
+            'names', 'read', 'delete', 'reads/s'))
+        for backend in backends:
+            openStore = BACKENDS[backend]
+            directory = join(root, backend + '-conformance')
+            makedirs(directory)
+            try:
+                conformance(openStore, directory)
+            except AssertionError as error:
+                print('%-12sFAIL: %s' % (backend, error))
+                failed = True
+                continue
+            directory = join(root, backend)
+            makedirs(directory)
+            results = benchmark(openStore, directory, names)
+            print('%-12s%8.0fus%10.1fus%8.2fus%8.1fus%8.0fus%14.0f' % (
+                backend, results['create'] * 1e6, results['createMany'] * 1e6,
+                results['names'] * 1e6, results['read'] * 1e6,
+                results['delete'] * 1e6, results['concurrentReads']))
+    finally:
+        rmtree(root)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    count = int(argv[1]) if len(argv) > 1 else 20000
+    exit(main(count, argv[2:] or list(BACKENDS)))
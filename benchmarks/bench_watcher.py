@@ -0,0 +1,106 @@
+'''
+Checks that entries dropped into the data folder by another program reach
+the main window's list in one update. A second store saves a batch of
+entries behind the window's back, as a sync tool or a second instance would,
+and the model's reset and insert signals are counted until the list has all
+of them. Qt is run on its offscreen platform, so no display is needed.
+
+Run from the repository root:
+python benchmarks/bench_watcher.py [number of entries] [--existing N]
+'''
+
+from argparse import ArgumentParser
+from os import environ, urandom
+from os.path import dirname, abspath
+from shutil import rmtree
+from sys import exit, path
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+
+environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+path.insert(0, dirname(dirname(abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+from passman import MainScreen
+from storage import DirectoryStore
+from vault import Vault
+from benchmarks.bench_search import syntheticNames
+
+ENTRY_SIZE = 120
+TIMEOUT = 60
+
+def waitFor(app, condition, timeout=TIMEOUT):
+    """Runs the event loop until condition() is true, or timeout runs out"""
+    end = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > end:
+            return False
+        app.processEvents()
+        sleep(0.005)
+    return True
+
+def main():
+    parser = ArgumentParser(description='Benchmark the entry list watcher')
+    parser.add_argument('count', type=int, nargs='?', default=10000)
+    parser.add_argument('--existing', type=int, default=1000,
+        help='entries in the vault before the drop')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    names = syntheticNames(args.existing + args.count)
+    existing, dropped = names[:args.existing], names[args.existing:]
+    directory = mkdtemp(prefix='passman-watch-')
+    failed = False
+    try:
+        DirectoryStore(directory).createMany(
+            [(x, urandom(ENTRY_SIZE)) for x in existing])
+        main = MainScreen(Vault(directory), show=False)
+        #Let the watcher take its first stamps
+        waitFor(app, lambda: main.watcher.stamps is not None)
+
+        updates = []
+        model = main.model
+        model.modelReset.connect(lambda: updates.append('reset'))
+        model.rowsInserted.connect(lambda *x: updates.append('insert'))
+        model.rowsRemoved.connect(lambda *x: updates.append('remove'))
+
+        other = DirectoryStore(directory)
+        start = perf_counter()
+        other.createMany([(x, urandom(ENTRY_SIZE)) for x in dropped])
+        written = perf_counter() - start
+        arrived = waitFor(app, lambda: len(main.files) == len(names))
+        latency = perf_counter() - start
+
+        print('entries dropped:    %d onto %d' % (len(dropped), len(existing)))
+        print('written in:         %.2f s' % written)
+        print('shown after:        %.2f s' % latency)
+        print('list updates:       %d (%s)' % (len(updates),
+            ', '.join(sorted(set(updates))) or 'none'))
+        if not arrived:
+            print('FAIL: only %d of %d entries shown after %d s' % (
+                len(main.files) - len(existing), len(dropped), TIMEOUT))
+            failed = True
+        elif len(updates) > 1:
+            print('FAIL: the drop caused %d list updates' % len(updates))
+            failed = True
+
+        #Deleted behind the window's back, again in one update
+        del updates[:]
+        with other.group():
+            for name in dropped:
+                other.delete(name)
+        if not waitFor(app, lambda: len(main.files) == len(existing)):
+            print('FAIL: deleted entries still shown')
+            failed = True
+        elif len(updates) > 1:
+            print('FAIL: the delete caused %d list updates' % len(updates))
+            failed = True
+        main.close()
+        app.processEvents()
+    finally:
+        rmtree(directory, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,129 @@
+'''
+Crash test for the entry stores. A child process saves entries as fast as
+it can and reports each one once its save has returned; the parent kills it
+with SIGKILL at a random moment, opens the store and checks that
+
+    every entry the child reported is there
+    no entry is torn: each one holds a checksum of its own contents
+
+This tests crashes of the process, not of the machine. Durability across
+power loss depends on the fsync calls reaching the disk, which no test run
+on a working computer can show.
+
+Run from the repository root:
+python benchmarks/crashtest.py [rounds] [directory|sharded|vaultfile] [--group]
+'''
+
+from hashlib import sha256
+from os import urandom
+from os.path import dirname, abspath, join
+from random import Random, uniform
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from sys import argv, executable, exit, path, stdout
+from tempfile import mkdtemp
+from time import sleep
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+from shardstore import ShardStore
+from storage import DirectoryStore, VAULT_NAME
+from vaultfile import VaultFile
+
+#Entries are reused so the child both creates new files and replaces old ones
+NAMES = 500
+GROUP = 20
+MAX_SIZE = 1 << 14
+
+def openStore(kind, directory):
+    if kind == 'vaultfile':
+        return VaultFile(join(directory, VAULT_NAME))
+    if kind == 'sharded':
+        return ShardStore(directory)
+    return DirectoryStore(directory)
+
+def makeEntry(random):
+    payload = urandom(random.randrange(MAX_SIZE))
+    return sha256(payload).digest() + payload
+
+def isWhole(data):
+    return sha256(data[32:]).digest() == data[:32]
+
+#Names the child has saved, which are replaced rather than created
+existing = set()
+
+def save(store, name, data):
+    if name in existing:
+        store.write(name, data)
+    else:
+        store.create(name, data)
+        existing.add(name)
+
+def child(kind, directory, grouped):
+    '''
+    Saves entries until it is killed, printing the name of each one after
+    it is saved
+    '''
+    store = openStore(kind, directory)
+    existing.update(store.names())
+    random = Random()
+    while True:
+        names = ['e %d' % random.randrange(NAMES) for _ in range(GROUP)]
+        if not grouped:
+            for name in names:
+                save(store, name, makeEntry(random))
+                stdout.write(name + '\n')
+                stdout.flush()
+            continue
+        #Nothing in a group is saved until the whole group is
+        with store.group():
+            for name in names:
+                save(store, name, makeEntry(random))
+        stdout.write('\n'.join(names) + '\n')
+        stdout.flush()
+
+def check(kind, directory, committed):
+    """Returns a list of problems found in the store"""
+    store = openStore(kind, directory)
+    problems = []
+    try:
+        names = set(store.names())
+        for name in committed - names:
+            problems.append('lost entry: ' + name)
+        for name in names:
+            if not isWhole(store.read(name)):
+                problems.append('torn entry: ' + name)
+    finally:
+        store.close()
+    return problems
+
+def main(rounds, kind, grouped):
+    directory = mkdtemp()
+    committed = set()
+    failed = False
+    try:
+        for number in range(rounds):
+            arguments = [executable, abspath(__file__), 'child', kind,
+                directory] + (['--group'] if grouped else [])
+            process = Popen(arguments, stdout=PIPE)
+            sleep(uniform(0.05, 0.5))
+            process.kill()
+            output, _ = process.communicate()
+            #The last line may have been cut off by the kill
+            lines = output.decode().split('\n')[:-1]
+            committed.update(lines)
+            problems = check(kind, directory, committed)
+            print('round %3d: %5d saves reported, %s' % (number + 1,
+                len(lines), '; '.join(problems[:5]) or 'ok'))
+            failed = failed or bool(problems)
+    finally:
+        rmtree(directory)
+    return failed
+
+if __name__ == '__main__':
+    if argv[1:2] == ['child']:
+        child(argv[2], argv[3], '--group' in argv)
+    else:
+        options = [x for x in argv[1:] if not x.startswith('--')]
+        rounds = int(options[0]) if options else 20
+        kind = options[1] if len(options) > 1 else 'directory'
+        exit(1 if main(rounds, kind, '--group' in argv) else 0)
@@ -0,0 +1,210 @@
+'''
+Times PassMan's real code paths against synthetic vaults of growing size. Qt
+is run on its offscreen platform, so no display is needed.
+
+Results are written as JSON. Passing the JSON from an earlier run as the
+baseline compares every timing against it and exits with an error if any of
+them got slower by more than the threshold, so runs can be compared across
+commits.
+
+python -m benchmarks.run [--sizes 1000 10000 100000] [--format 1|2|3]
+    [--output results.json] [--baseline old.json] [--threshold 0.25]
+'''
+
+from argparse import ArgumentParser
+from json import dump, load
+from os import environ
+from os.path import join
+from platform import platform, python_version
+from shutil import rmtree
+from statistics import median
+from subprocess import check_output, CalledProcessError
+from sys import exit
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+
+environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+
+from benchmarks.synthvault import generate, PASSWORD
+from keys import VERSION
+
+def timed(function, repeat=1):
+    """Returns the median time in seconds of running function repeat times"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return median(times)
+
+def waitFor(app, condition):
+    """Runs the event loop until condition() is true"""
+    while not condition():
+        app.processEvents()
+        sleep(0.001)
+
+def benchmarkSize(app, root, size, format):
+    '''
+    Generates a vault of size entries under root and times each code path on
+    it. Returns a dictionary of timings in seconds
+    '''
+    #Every module finds the vault through APPDATA, so point it at this one
+    environ['APPDATA'] = root
+    names = generate(join(root, 'PassManData'), size, format)
+
+    import clipboard
+    from addpass import AddPasswordScreen
+    from passman import MainScreen, Startup
+    from storage import openStore
+    from audit import auditVault
+    from upgrade import verifyVault
+    from vault import Vault
+
+    def login():
+        vault = Vault()
+        vault.unlock(PASSWORD)
+        vault.close()
+    results = {}
+    results['login'] = timed(login, 3)
+
+    #The whole startup in one event loop: time to the login prompt, then
+    #from entering the password to a usable list
+    startup = Startup(Vault(), perf_counter())
+    waitFor(app, lambda: 'prompt' in startup.timings)
+    startup.login.passwordBox.setText(PASSWORD.decode())
+    startup.login.checkPassword(startup.login.passwordBox,
+        startup.login.wrongPasswordLabel)
+    waitFor(app, lambda: 'usable' in startup.timings)
+    results['timeToPrompt'] = startup.timings['prompt']
+    results['timeToList'] = startup.timings['usable']
+    startup.main.close()
+    app.processEvents()
+    vault = Vault()
+    vault.unlock(PASSWORD)
+
+    def listing():
+        store = openStore()
+        store.names()
+        store.close()
+    results['listing'] = timed(listing, 5)
+
+    start = perf_counter()
+    main = MainScreen(vault)
+    app.processEvents()
+    results['startup'] = perf_counter() - start
+    #Keep the benchmark away from the system clipboard
+    main.decryptor.decrypted.disconnect()
+
+    results['visibleEntries'] = timed(main.visibleEntriesChanged, 50)
+
+    def scrollFrame():
+        main.list.scrollRows(3)
+        main.list.viewport().repaint()
+    results['scrollFrame'] = timed(scrollFrame, 200)
+
+    #Straight onto Qt's clipboard, with the timed clear scheduled
+    results['clipboardCopy'] = timed(
+        lambda: clipboard.copy('correct horse battery staple', 30), 200)
+
+    copyNames = iter(names[::max(1, len(names) // 50)])
+    results['copy'] = timed(
+        lambda: main.decryptor.decryptJob(next(copyNames)), 50)
+
+    #Every entry decrypted and authenticated across all cores
+    results['verify'] = timed(lambda: verifyVault(vault))
+    #The first audit decrypts everything, the second only reads its cache
+    results['audit'] = timed(lambda: auditVault(vault))
+    results['auditCached'] = timed(lambda: auditVault(vault), 3)
+
+    saveTimes = []
+    for i in range(20):
+        screen = AddPasswordScreen(main)
+        screen.userBox.setText('Benchmark Save %d' % i)
+        screen.passBox.setText('correct horse battery staple')
+        saveTimes.append(timed(screen.savePassword))
+    results['save'] = median(saveTimes)
+
+    #A multi-selection of entries deleted from the context menu
+    selection = names[1::max(1, len(names) // 100)][:100]
+    def deleteSelection():
+        vault.deleteMany(selection)
+        main.removeEntries(selection)
+    results['deleteSelection'] = timed(deleteSelection)
+
+    #The search index is built on a worker thread after the list loads
+    main.indexer.wait()
+    app.processEvents()
+    results['firstSearch'] = timed(lambda: main.searchBox.setText('mail'))
+    queries = iter(['ma', 'mai', 'mail', 'mail ', 'mail b', 'mail ba'] * 5)
+    results['searchKeystroke'] = timed(
+        lambda: main.searchBox.setText(next(queries)), 30)
+
+    main.close()
+    app.processEvents()
+    return results
+
+def gitCommit():
+    try:
+        return check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except (CalledProcessError, OSError):
+        return None
+
+def compare(results, baseline, threshold):
+    '''
+    Returns a line for every timing that is more than threshold slower than
+    the same timing in baseline
+    '''
+    regressions = []
+    for size, timings in results.items():
+        old = baseline['results'].get(size, {})
+        for name, seconds in timings.items():
+            if name in old and seconds > old[name] * (1 + threshold):
+                regressions.append('%s entries, %s: %.2f ms -> %.2f ms' % (
+                    size, name, old[name] * 1000, seconds * 1000))
+    return regressions
+
+def main():
+    parser = ArgumentParser(description='Benchmark PassMan')
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=[1000, 10000, 100000])
+    parser.add_argument('--format', type=int, choices=(1, 2, 3),
+        default=VERSION, help='entry format to generate, 3 being the current '
+        'one and 1 the original one')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='allowed slowdown against the baseline, 0.25 being 25%%')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+    for size in args.sizes:
+        root = mkdtemp(prefix='passman-bench-')
+        try:
+            results[str(size)] = benchmarkSize(app, root, size, args.format)
+        finally:
+            rmtree(root, ignore_errors=True)
+        for name, seconds in results[str(size)].items():
+            print('%7d entries  %-16s %10.3f ms' % (size, name, seconds * 1000))
+
+    with open(args.output, 'w') as file:
+        dump({
+            'commit': gitCommit(),
+            'platform': platform(),
+            'python': python_version(),
+            'format': args.format,
+            'results': results
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, load(file), args.threshold)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
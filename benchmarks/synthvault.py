@@ -0,0 +1,91 @@
+'''
+Generates synthetic vaults for benchmarking, laid out exactly like a real
+PassManData folder: a master password record, its key check value and one
+entry per name, in any of the entry formats keys.py reads: 3 (the current
+one), 2 (Salsa20 under a key from the master key) or 1 (the original
+nonce + salt + ciphertext). Formats 1 and 2 are what upgrade.py rewrites.
+
+python -m benchmarks.synthvault <folder> <number of entries> [--format 1|2|3]
+'''
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import pbkdf2_hmac
+from os import urandom
+from random import Random
+from string import ascii_letters, digits
+
+from Crypto.Cipher import Salsa20
+
+from benchmarks.bench_search import syntheticNames
+from keys import encryptEntry, entryKey, LEGACY_HEADER, VERSION
+from masterkey import MIN_N
+from vault import Vault
+
+PASSWORD = b'benchmark master password'
+BATCH = 2000
+
+def legacyEntry(password, secret):
+    '''
+    Encrypts secret the way the original version did: a 16 character salt,
+    PBKDF2 over the raw master password and Salsa20
+    '''
+    random = Random(urandom(8))
+    salt = ''.join([random.choice(ascii_letters + digits)
+        for _ in range(16)]).encode()
+    cipher = Salsa20.new(pbkdf2_hmac('sha1', password, salt, 1000, 32))
+    return cipher.nonce + salt + cipher.encrypt(secret)
+
+def version2Entry(masterKey, secret):
+    """Encrypts secret in the unauthenticated version 2 format"""
+    salt = urandom(16)
+    cipher = Salsa20.new(entryKey(masterKey, salt))
+    return LEGACY_HEADER + cipher.nonce + salt + cipher.encrypt(secret)
+
+def encryptBatch(format, password, masterKey, secrets):
+    if format == 1:
+        return [legacyEntry(password, x) for x in secrets]
+    if format == 2:
+        return [version2Entry(masterKey, x) for x in secrets]
+    return [encryptEntry(masterKey, x) for x in secrets]
+
+def generate(directory, count, format=VERSION, password=PASSWORD, seed=0):
+    '''
+    Fills directory with a vault of count entries and returns their names.
+    Encryption is spread over all cores since old format entries each need
+    a PBKDF2 run
+    '''
+    vault = Vault(directory)
+    #A fixed cost keeps login timings comparable between machines
+    vault.create(password, MIN_N)
+    masterKey = vault.masterKey
+
+    names = syntheticNames(count, seed)
+    random = Random(seed)
+    secrets = [''.join([random.choice(ascii_letters + digits)
+        for _ in range(24)]).encode() for _ in names]
+
+    store = vault.store
+    with ProcessPoolExecutor() as pool:
+        batches = [secrets[i:i+BATCH] for i in range(0, len(secrets), BATCH)]
+        results = pool.map(encryptBatch, [format] * len(batches),
+            [password] * len(batches), [masterKey] * len(batches), batches)
+        position = 0
+        for batch in results:
+            #One group commit per batch rather than two syncs per entry
+            store.createMany(zip(names[position:position + len(batch)],
+                batch))
+            position += len(batch)
+    vault.close()
+    return names
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Generate a synthetic PassMan vault')
+    parser.add_argument('directory')
+    parser.add_argument('count', type=int)
+    parser.add_argument('--format', type=int, choices=(1, 2, 3),
+        default=VERSION, help='entry format to generate, 3 being the current '
+        'one and 1 the original one')
+    args = parser.parse_args()
+    generate(args.directory, args.count, args.format)
+    print('Wrote %d entries to %s' % (args.count, args.directory))
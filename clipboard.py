@@ -0,0 +1,85 @@
+'''
+Copying passwords to the clipboard. In the GUI this goes through Qt's
+QClipboard, in process. pyperclip, which on Linux starts xclip or xsel for
+every copy, is only used when no QApplication is running, as in scripts.
+
+A copied password can be cleared again after a delay. The clear runs on a
+QTimer in the GUI and on a daemon thread otherwise, so nothing waits for it,
+and it leaves the clipboard alone if something else was copied since.
+
+    copy(secret, clearAfter=CLEAR_SECONDS)
+'''
+
+from os import getenv
+from sys import modules
+from threading import Lock, Timer
+
+#Seconds a copied password stays on the clipboard, 0 to keep it there
+CLEAR_SECONDS = float(getenv('PASSMAN_CLIPBOARD_CLEAR', '30'))
+
+lock = Lock()
+#Counts copies, so a clear can tell if it is still about the latest one
+generation = 0
+
+def qtClipboard():
+    '''
+    Returns the application's QClipboard, or None if there is no
+    QApplication. Qt is never imported here, only looked for
+    '''
+    widgets = modules.get('PyQt5.QtWidgets')
+    if widgets is None or widgets.QApplication.instance() is None:
+        return None
+    return widgets.QApplication.clipboard()
+
+def setText(text):
+    clipboard = qtClipboard()
+    if clipboard is not None:
+        clipboard.setText(text)
+    else:
+        #pyperclip looks for a clipboard program when it is imported, so
+        #that is left until it is needed
+        from pyperclip import copy as pyperclipCopy
+        pyperclipCopy(text)
+
+def text():
+    """Returns what is on the clipboard"""
+    clipboard = qtClipboard()
+    if clipboard is not None:
+        return clipboard.text()
+    from pyperclip import paste
+    return paste()
+
+def copy(value, clearAfter=0):
+    '''
+    Puts value on the clipboard. With clearAfter set, it is cleared that
+    many seconds later unless something else has been copied by then
+    '''
+    global generation
+    with lock:
+        generation += 1
+        current = generation
+    setText(value)
+    if clearAfter:
+        scheduleClear(value, current, clearAfter)
+
+def scheduleClear(value, current, seconds):
+    if qtClipboard() is not None:
+        #Qt's clipboard belongs to the GUI thread, so the clear waits in its
+        #event loop
+        from PyQt5.QtCore import QTimer
+        QTimer.singleShot(int(seconds * 1000), lambda: clear(value, current))
+    else:
+        timer = Timer(seconds, clear, (value, current))
+        timer.daemon = True
+        timer.start()
+
+def clear(value, current):
+    '''
+    Empties the clipboard if it still holds value from the copy numbered
+    current
+    '''
+    with lock:
+        if generation != current:
+            return
+    if text() == value:
+        setText('')
@@ -2,6 +2,7 @@
 A set of common helper functions/variables that are used by the rest of the program
 '''
 from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QThread, pyqtSignal
 
 def setColor(window, r, g, b):
     """Sets the window color to the given RGB value"""
@@ -19,4 +20,19 @@ buttonStylesheet = """ QPushButton {
     QPushButton:pressed {
         background-color: #8888AA;
     }
-    """
\ No newline at end of file
+    """
+
+class Worker(QThread):
+    '''
+    Runs a function on its own thread and hands its result back to the GUI
+    thread through the done signal
+    '''
+    done = pyqtSignal(object)
+
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+
+    def run(self):
+        self.done.emit(self.function(*self.args))
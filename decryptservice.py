@@ -0,0 +1,140 @@
+'''
+Decrypts entries on a pool of worker threads so that the window never waits
+on disk or key derivation. Results are sent back to the GUI thread through
+signals.
+
+While the user is idle, the keys for the entries currently on screen are
+derived ahead of time, so that copying one of them only has to run Salsa20.
+Prefetch work for entries that have been scrolled away from is cancelled.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from threading import Lock
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from tracing import span
+
+class DecryptService(QObject):
+    #Entry name and the decrypted password
+    decrypted = pyqtSignal(str, str)
+    #Entry name and a message to show for it
+    failed = pyqtSignal(str, str)
+
+    #How long the list has to sit still before keys are prefetched
+    idleDelay = 400
+
+    def __init__(self, vault):
+        super().__init__()
+        self.vault = vault
+        self.pool = ThreadPoolExecutor(max_workers=cpu_count() or 2)
+        self.lock = Lock()
+        #Entry name -> (stored bytes, derived key) for the entries on screen
+        self.keys = {}
+        self.pending = []
+        self.generation = 0
+        self.wanted = []
+
+        self.idleTimer = QTimer()
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.setInterval(self.idleDelay)
+        self.idleTimer.timeout.connect(self.startPrefetch)
+
+    def request(self, name):
+        """Decrypts an entry in the background"""
+        self.pool.submit(self.decryptJob, name)
+
+    def decryptJob(self, name):
+        #Loaded by then, but not yet when the login window comes up
+        from vault import DecodingError, LockedError, WrongPasswordError
+        try:
+            with span('copy.job'):
+                with self.lock:
+                    cached = self.keys.get(name)
+                if cached is None:
+                    data = self.vault.read(name)
+                    key = None
+                else:
+                    data, key = cached
+                secret = self.vault.decrypt(name, data, key)
+            self.decrypted.emit(name, secret)
+        except FileNotFoundError:
+            self.failed.emit(name, 'File not found')
+        except WrongPasswordError:
+            self.failed.emit(name, 'Wrong key or damaged entry')
+        except LockedError:
+            self.failed.emit(name, 'Vault is locked')
+        except DecodingError:
+            self.failed.emit(name, 'Unable to decode')
+        except ValueError:
+            #Cut off or in a format this version does not know
+            self.failed.emit(name, 'Damaged entry')
+        except OSError:
+            self.failed.emit(name, 'Unable to read entry')
+
+    def prefetch(self, names):
+        '''
+        Called whenever the entries on screen change. Work for entries that
+        are no longer shown is cancelled now, and prefetching for the new ones
+        starts once the list has been still for a moment
+        '''
+        if list(names) == self.wanted:
+            return
+        self.wanted = list(names)
+        self.cancelPending()
+        self.idleTimer.start()
+
+    def cancelPending(self):
+        self.generation += 1
+        for future in self.pending:
+            future.cancel()
+        self.pending = []
+
+    def startPrefetch(self):
+        with self.lock:
+            for name in list(self.keys):
+                if name not in self.wanted:
+                    del self.keys[name]
+            names = [x for x in self.wanted if x not in self.keys]
+        generation = self.generation
+        self.pending = [self.pool.submit(self.prefetchJob, name, generation)
+            for name in names]
+
+    def prefetchJob(self, name, generation):
+        from vault import LockedError
+        if generation != self.generation:
+            return
+        try:
+            data = self.vault.read(name)
+            key = self.vault.deriveKey(data)
+        except FileNotFoundError:
+            #Deleted since it was shown
+            return
+        except (LockedError, OSError, ValueError):
+            #Copying it would fail the same way, so say so now
+            if generation == self.generation:
+                self.failed.emit(name, 'Unable to read entry')
+            return
+        if generation == self.generation:
+            with self.lock:
+                self.keys[name] = (data, key)
+
+    def forget(self, name):
+        """Drops anything cached for an entry that was changed or removed"""
+        with self.lock:
+            self.keys.pop(name, None)
+
+    def forgetAll(self):
+        """Drops every cached key, for when the master key has changed"""
+        self.cancelPending()
+        self.wanted = []
+        with self.lock:
+            self.keys.clear()
+
+    def shutdown(self):
+        self.idleTimer.stop()
+        self.cancelPending()
+        with self.lock:
+            self.keys.clear()
+        self.pool.shutdown(wait=False)
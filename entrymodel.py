@@ -0,0 +1,98 @@
+'''
+List model over the saved entries. The view only asks it for the rows that
+are on screen, so the cost of drawing the list does not grow with the number
+of entries.
+
+The model shows either the main screen's EntryTable itself, in which case
+entries are inserted and removed through the model so the view hears about
+it, or a list of search results.
+'''
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, QVariant
+
+from entrytable import EntryTable
+
+class EntryListModel(QAbstractListModel):
+    #Role that always gives the entry's name, even while a status is shown
+    NameRole = Qt.UserRole
+
+    def __init__(self, entries, statuses):
+        super().__init__()
+        self.entries = entries
+        self.statuses = statuses
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.entries):
+            return QVariant()
+        name = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            return self.statuses.get(name, name)
+        if role == EntryListModel.NameRole:
+            return name
+        return QVariant()
+
+    def name(self, row):
+        """Returns the name of the entry in the given row"""
+        return self.entries[row]
+
+    def find(self, name):
+        """Returns the row an entry is shown in, or -1 if it is not shown"""
+        if isinstance(self.entries, EntryTable):
+            return self.entries.find(name)
+        try:
+            return self.entries.index(name)
+        except ValueError:
+            return -1
+
+    def setEntries(self, entries):
+        '''
+        Replaces the entries that are shown, with either an EntryTable or a
+        list that the model takes over
+        '''
+        self.beginResetModel()
+        self.entries = entries
+        self.endResetModel()
+
+    def insert(self, name):
+        """Adds an entry to the EntryTable being shown, in its sorted place"""
+        row = self.entries.position(name)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.entries.add(name)
+        self.endInsertRows()
+
+    def removeMany(self, names):
+        '''
+        Removes the entries that are shown out of names. Removing several is
+        reported to the view as a single reset, so it only redraws once
+        '''
+        if isinstance(self.entries, EntryTable):
+            rows = self.entries.rows(names)
+        else:
+            removed = set(names)
+            rows = [i for i, x in enumerate(self.entries) if x in removed]
+        if not rows:
+            return
+        if len(rows) == 1:
+            self.beginRemoveRows(QModelIndex(), rows[0], rows[0])
+        else:
+            self.beginResetModel()
+        if isinstance(self.entries, EntryTable):
+            self.entries.removeRows(rows)
+        else:
+            self.entries = [x for x in self.entries if x not in removed]
+        if len(rows) == 1:
+            self.endRemoveRows()
+        else:
+            self.endResetModel()
+
+    def refresh(self, name):
+        """Redraws an entry, for example after its status has changed"""
+        row = self.find(name)
+        if row >= 0:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
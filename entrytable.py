@@ -0,0 +1,111 @@
+'''
+Table of the entry names shown on the main screen, kept sorted the way the
+list shows them: case insensitively, with names that differ only in case in
+a fixed order.
+
+Each entry takes one slot of a single Python list holding a reference to its
+name, so the table costs 8 bytes per entry on top of the names themselves
+and a row number is just an index into it. Lookups and insertions find their
+slot with a binary search; removing a batch of entries rebuilds the list in
+one pass instead of shifting it once per entry.
+'''
+
+from itertools import compress
+
+#Batches up to this size are removed one slot at a time, which is cheaper
+#than rebuilding the list when there are only a few
+SMALL_BATCH = 16
+
+def sortKey(name):
+    return (name.lower(), name)
+
+def sortNames(names):
+    '''
+    Sorts a list in place by sortKey. Two stable sorts give the same order
+    without building a tuple per name
+    '''
+    names.sort()
+    names.sort(key=str.lower)
+
+class EntryTable:
+    __slots__ = ('names',)
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        sortNames(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, row):
+        return self.names[row]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return self.find(name) >= 0
+
+    def position(self, name):
+        '''
+        Returns the row name has, or would be inserted at if it is not in the
+        table
+        '''
+        key = sortKey(name)
+        names = self.names
+        low = 0
+        high = len(names)
+        while low < high:
+            middle = (low + high) // 2
+            if sortKey(names[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, name):
+        """Returns the row of an entry, or -1 if it is not in the table"""
+        row = self.position(name)
+        if row < len(self.names) and self.names[row] == name:
+            return row
+        return -1
+
+    def add(self, name):
+        """Inserts an entry in its sorted place and returns its row"""
+        row = self.position(name)
+        self.names.insert(row, name)
+        return row
+
+    def extend(self, names):
+        """Inserts a batch of entries"""
+        names = list(names)
+        if len(names) <= SMALL_BATCH:
+            for name in names:
+                self.add(name)
+        else:
+            self.names.extend(names)
+            sortNames(self.names)
+
+    def rows(self, names):
+        """Returns the sorted rows of the given entries that are in the table"""
+        return sorted(set(x for x in map(self.find, names) if x >= 0))
+
+    def removeRows(self, rows):
+        """Removes the entries in the given sorted rows"""
+        if len(rows) <= SMALL_BATCH:
+            for row in reversed(rows):
+                del self.names[row]
+            return
+        keep = bytearray(b'\x01') * len(self.names)
+        for row in rows:
+            keep[row] = 0
+        self.names = list(compress(self.names, keep))
+
+    def removeMany(self, names):
+        '''
+        Removes every given entry that is in the table and returns the rows
+        they had
+        '''
+        rows = self.rows(names)
+        self.removeRows(rows)
+        return rows
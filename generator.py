@@ -0,0 +1,207 @@
+'''
+Password generation from the operating system's CSPRNG.
+
+Random bytes are read from os.urandom in large buffers and turned into
+characters with bytes.translate: bytes below the largest multiple of the
+alphabet size are mapped onto the alphabet and the rest are deleted, which
+is rejection sampling done in C, so every character is uniformly chosen.
+Passwords that do not meet the policy's minimum counts are thrown away
+whole, which keeps the passwords that are returned uniform over all the
+ones the policy allows. In bulk the counts are checked for a whole buffer
+at once, see Policy.acceptedMask.
+
+    password = generate(Policy(length=32, minimums={'digits': 2}))
+    accounts = generateMany(100000, Policy(symbols=False))
+'''
+
+from itertools import compress
+from math import ceil, factorial, log2
+from os import urandom
+from string import ascii_lowercase, ascii_uppercase, digits, punctuation
+
+CLASSES = (
+    ('lower', ascii_lowercase),
+    ('upper', ascii_uppercase),
+    ('digits', digits),
+    ('symbols', punctuation),
+    )
+
+#Characters that are easy to mistake for one another when read or typed
+LOOKALIKES = 'Il1|O0o`\'"'
+
+#Bytes read from the CSPRNG at a time when making many passwords
+BUFFER = 1 << 20
+#Policies whose minimums reject more random strings than this are refused,
+#as generating for them would mostly be throwing passwords away
+MIN_ACCEPTANCE = 0.001
+#Counts are added up a byte each when checking in bulk
+MAX_LENGTH = 255
+
+def choose(n, k):
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+class Policy:
+    '''
+    What a generated password has to look like. The letters, digits and
+    symbols flags match the check boxes on the Add Password screen, and
+    minimums maps a class name (lower, upper, digits or symbols) to how many
+    characters of that class every password needs
+    '''
+    def __init__(self, length=24, letters=True, digits=True, symbols=True,
+        minimums=None, excludeLookalikes=False, exclude=''):
+        self.length = length
+        self.minimums = dict(minimums or {})
+        enabled = {'lower': letters, 'upper': letters, 'digits': digits,
+            'symbols': symbols}
+        excluded = set(exclude) | (set(LOOKALIKES) if excludeLookalikes
+            else set())
+
+        self.classes = []
+        for name, characters in CLASSES:
+            characters = ''.join(x for x in characters if x not in excluded)
+            if enabled[name] and characters:
+                self.classes.append((name, characters))
+            elif self.minimums.get(name):
+                raise ValueError('Class %s is required but not allowed' % name)
+        for name in self.minimums:
+            if name not in enabled:
+                raise ValueError('Unknown character class: %s' % name)
+
+        self.alphabet = ''.join(x[1] for x in self.classes)
+        if not self.alphabet:
+            raise ValueError('No characters are allowed')
+        if not 0 < length <= MAX_LENGTH:
+            raise ValueError('The length must be between 1 and %d' % MAX_LENGTH)
+        if sum(self.minimums.values()) > length:
+            raise ValueError('The minimums add up to more than the length')
+
+        #Translation that keeps bytes below the largest multiple of the
+        #alphabet size, mapped onto the alphabet, and deletes the rest
+        size = len(self.alphabet)
+        self.limit = 256 - 256 % size
+        self.table = bytes(self.alphabet.encode()[x % size] for x in range(256))
+        self.rejected = bytes(range(self.limit, 256))
+
+        #For each class with a minimum: the bytes to delete to count it, a
+        #translation marking its characters with 1 and everything else with
+        #0, and one marking counts that are high enough with 1
+        self.checks = []
+        self.counters = []
+        for name, characters in self.classes:
+            minimum = self.minimums.get(name)
+            if minimum:
+                others = bytes(x for x in range(256)
+                    if chr(x) not in characters)
+                self.checks.append((others, minimum))
+                self.counters.append((
+                    bytes(int(chr(x) in characters) for x in range(256)),
+                    bytes(int(x >= minimum) for x in range(256))))
+        if self.acceptance() < MIN_ACCEPTANCE:
+            raise ValueError('The minimums are too strict for this length')
+
+    def characters(self, count):
+        '''
+        Returns at least count random alphabet characters as ASCII bytes
+        '''
+        #Draw a little more than the expected need so one read is usually enough
+        wanted = ceil(count * 256 / self.limit * 1.05) + 16
+        data = urandom(wanted).translate(self.table, self.rejected)
+        while len(data) < count:
+            data += urandom(wanted).translate(self.table, self.rejected)
+        return data
+
+    def check(self, password):
+        """Checks the minimum counts for a password given as ASCII bytes"""
+        for others, minimum in self.checks:
+            if len(password.translate(None, others)) < minimum:
+                return False
+        return True
+
+    def acceptedMask(self, data, count):
+        '''
+        Checks count passwords laid end to end in data all at once. Returns
+        a byte per password, 1 if it meets the minimums and 0 if not.
+
+        Each class is counted by marking its characters with a 1 byte and
+        reading the marks as one little endian number. Multiplying that by
+        a number made of length 1 bytes adds up every run of length marks,
+        and as no sum can reach 256 each one lands in its own byte, so
+        every length-th byte of the product is one password's count
+        '''
+        length = self.length
+        ones = int.from_bytes(b'\x01' * length, 'little')
+        mask = None
+        for members, enough in self.counters:
+            marks = int.from_bytes(data.translate(members), 'little')
+            sums = (marks * ones).to_bytes(len(data) + length, 'little')
+            passed = sums[length - 1::length][:count].translate(enough)
+            if mask is None:
+                mask = passed
+            else:
+                mask = (int.from_bytes(mask, 'little')
+                    & int.from_bytes(passed, 'little')).to_bytes(count, 'little')
+        return mask
+
+    def combinations(self):
+        '''
+        Returns how many different passwords the policy allows, counting the
+        ways to split the length between the classes and fill each part
+        '''
+        ways = [1] + [0] * self.length
+        for name, characters in self.classes:
+            minimum = self.minimums.get(name, 0)
+            size = len(characters)
+            new = [0] * (self.length + 1)
+            for used in range(self.length + 1):
+                if ways[used] == 0:
+                    continue
+                for count in range(minimum, self.length - used + 1):
+                    new[used + count] += (ways[used]
+                        * choose(used + count, count) * size ** count)
+            ways = new
+        return ways[self.length]
+
+    def entropy(self):
+        """Returns the strength of the policy's passwords in bits"""
+        return log2(self.combinations())
+
+    def acceptance(self):
+        """Returns the fraction of random strings that meet the minimums"""
+        return self.combinations() / len(self.alphabet) ** self.length
+
+    def report(self):
+        """Describes the policy and how strong its passwords are"""
+        return '%d characters from %d symbols, %.1f bits of entropy' % (
+            self.length, len(self.alphabet), self.entropy())
+
+DEFAULT = Policy()
+
+def generate(policy=DEFAULT):
+    """Returns one random password that meets the policy"""
+    while True:
+        password = policy.characters(policy.length)[:policy.length]
+        if policy.check(password):
+            return password.decode()
+
+def generateMany(count, policy=DEFAULT):
+    '''
+    Returns a list of count random passwords that meet the policy. The
+    CSPRNG is read in large buffers and the passwords are cut from it, so
+    this makes millions of passwords a second
+    '''
+    length = policy.length
+    acceptance = policy.acceptance()
+    passwords = []
+    perBuffer = max(1, BUFFER // length)
+    while len(passwords) < count:
+        wanted = min(perBuffer, ceil((count - len(passwords))
+            / acceptance * 1.05))
+        data = policy.characters(wanted * length)[:wanted * length]
+        text = data.decode()
+        starts = range(0, wanted * length, length)
+        if policy.counters:
+            #Only the passwords that are kept are cut out
+            starts = compress(starts, policy.acceptedMask(data, wanted))
+        passwords.extend([text[x:x + length] for x in starts])
+    del passwords[count:]
+    return passwords
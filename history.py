@@ -0,0 +1,253 @@
+'''
+Earlier revisions of entries, so that changing a password does not lose the
+old one.
+
+The current revision stays the entry itself, so reading it costs the same
+however long its history is. When an entry is saved again, its old stored
+bytes are appended, as they are, to the entry's log in the history folder
+(.history), named after a hash of the entry's name like its attachments.
+A log is a run of records of RECORD (the length and the time it was replaced)
+followed by the stored bytes, so each revision costs RECORD.size bytes on
+top of its ciphertext. A record cut off by a crash is ignored.
+
+Logs are pruned to the newest KEEP_REVISIONS revisions no older than
+KEEP_DAYS days, on a background thread, after each append and once for every
+log when a vault is opened, holding the vault's write lock so that no other
+process appends to a log while it is rewritten. Both can be set with PASSMAN_HISTORY_KEEP and
+PASSMAN_HISTORY_DAYS, 0 days keeping revisions for good.
+'''
+
+from contextlib import nullcontext
+from os import fsync, getenv, listdir, makedirs, remove, replace, scandir
+from os.path import join, exists
+from struct import Struct
+from threading import Lock, Thread
+from time import time
+
+from attachments import entryHash
+from keys import reencryptEntry
+from storage import (removeStaleTemporary, syncDirectory, writeAtomic,
+    TEMP_PREFIX)
+
+HISTORY_NAME = '.history'
+#Logs rewritten for a new master password wait in the staging folder under
+#this prefix, see rotate.py
+STAGED_PREFIX = 'history-'
+RECORD = Struct('<II')          #length, time it was replaced
+
+KEEP_REVISIONS = int(getenv('PASSMAN_HISTORY_KEEP', '10'))
+KEEP_DAYS = float(getenv('PASSMAN_HISTORY_DAYS', '365'))
+
+def parseLog(contents):
+    """Returns the (time, stored bytes) of every whole record, oldest first"""
+    records = []
+    position = 0
+    while position + RECORD.size <= len(contents):
+        length, when = RECORD.unpack_from(contents, position)
+        start = position + RECORD.size
+        if start + length > len(contents):
+            break
+        records.append((when, contents[start:start + length]))
+        position = start + length
+    return records
+
+def packLog(records):
+    return b''.join(RECORD.pack(len(data), when) + data
+        for when, data in records)
+
+class History:
+    '''
+    The revision logs of every entry in a data folder. Pruning takes
+    fileLock, the lock other processes append under, if one is given
+    '''
+    def __init__(self, directory, fileLock=None):
+        self.root = join(directory, HISTORY_NAME)
+        #Appends and rewrites of logs by this process take turns
+        self.lock = Lock()
+        self.fileLock = fileLock or nullcontext()
+        self.pending = set()
+        self.pendingLock = Lock()
+        self.pruning = False
+
+    def path(self, name):
+        return join(self.root, entryHash(name))
+
+    def append(self, name, data, when=None):
+        '''
+        Adds the stored bytes of a replaced revision to the entry's log, and
+        syncs it before returning
+        '''
+        path = self.path(name)
+        with self.lock:
+            makedirs(self.root, exist_ok=True)
+            created = not exists(path)
+            with open(path, 'ab') as file:
+                #A record cut off by a crash would swallow the one after it
+                whole = len(packLog(self.records(name)))
+                if file.tell() > whole:
+                    file.truncate(whole)
+                file.write(RECORD.pack(len(data), int(when or time())) + data)
+                file.flush()
+                fsync(file.fileno())
+            if created:
+                syncDirectory(self.root)
+        self.schedulePrune(name)
+
+    def write(self, name, records):
+        '''
+        Replaces the entry's log with the given (time, stored bytes)
+        records, as restored from a backup
+        '''
+        with self.lock:
+            makedirs(self.root, exist_ok=True)
+            writeAtomic(self.path(name), packLog(records))
+        self.schedulePrune(name)
+
+    def logs(self):
+        """Returns the entry hashes of every log, see attachments.entryHash"""
+        if not exists(self.root):
+            return []
+        return [x.name for x in scandir(self.root)
+            if not x.name.startswith(TEMP_PREFIX)]
+
+    def readLog(self, log):
+        '''
+        Returns the stored bytes of the log with the given entry hash, or
+        None if it is gone
+        '''
+        try:
+            with open(join(self.root, log), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def records(self, name):
+        """Returns the (time, stored bytes) of the entry's revisions"""
+        try:
+            with open(self.path(name), 'rb') as file:
+                return parseLog(file.read())
+        except FileNotFoundError:
+            return []
+
+    def remove(self, names):
+        """Removes the logs of deleted entries"""
+        if not exists(self.root):
+            return
+        removed = False
+        with self.lock:
+            for name in names:
+                try:
+                    remove(self.path(name))
+                    removed = True
+                except FileNotFoundError:
+                    pass
+        if removed:
+            syncDirectory(self.root)
+
+    def prunePath(self, path, now=None):
+        '''
+        Rewrites a log without the revisions the retention policy no longer
+        keeps, removing it if there are none left
+        '''
+        now = now or time()
+        #The file lock first, as appends hold it before taking self.lock
+        with self.fileLock, self.lock:
+            try:
+                with open(path, 'rb') as file:
+                    contents = file.read()
+            except FileNotFoundError:
+                return
+            records = parseLog(contents)
+            kept = records
+            if KEEP_DAYS:
+                kept = [x for x in kept if now - x[0] <= KEEP_DAYS * 86400]
+            kept = kept[-KEEP_REVISIONS:] if KEEP_REVISIONS else []
+            if kept == records and len(packLog(kept)) == len(contents):
+                return
+            if kept:
+                writeAtomic(path, packLog(kept))
+            else:
+                remove(path)
+                syncDirectory(self.root)
+
+    def schedulePrune(self, name=None):
+        '''
+        Prunes an entry's log, or every log if name is None, on a background
+        thread
+        '''
+        with self.pendingLock:
+            self.pending.add(name)
+            if self.pruning:
+                return
+            self.pruning = True
+        Thread(target=self.pruneLoop, daemon=True).start()
+
+    def pruneLoop(self):
+        while True:
+            with self.pendingLock:
+                if not self.pending:
+                    self.pruning = False
+                    return
+                name = self.pending.pop()
+            try:
+                if name is not None:
+                    self.prunePath(self.path(name))
+                    continue
+                with self.fileLock:
+                    removeStaleTemporary(self.root)
+                for entry in scandir(self.root):
+                    if not entry.name.startswith(TEMP_PREFIX):
+                        self.prunePath(entry.path)
+            except (OSError, ValueError):
+                #Tried again after the next append or open. ValueError is
+                #the lock file of a vault closed in the meantime
+                pass
+
+    def sweep(self):
+        """Prunes every log in the background, if there are any"""
+        if exists(self.root):
+            self.schedulePrune(None)
+
+def stageHistory(directory, staging, oldMasterKey, oldPassword, newMasterKey,
+    names=None):
+    '''
+    Re-encrypts every revision log, or those of the named entries, under a
+    new master key into the staging folder of a master password change
+    '''
+    root = join(directory, HISTORY_NAME)
+    if not exists(root):
+        return
+    if names is None:
+        logs = [x.name for x in scandir(root)
+            if not x.name.startswith(TEMP_PREFIX)]
+    else:
+        logs = [entryHash(x) for x in names]
+    for log in logs:
+        try:
+            with open(join(root, log), 'rb') as file:
+                records = parseLog(file.read())
+        except FileNotFoundError:
+            continue
+        writeAtomic(join(staging, STAGED_PREFIX + log),
+            packLog([(when, reencryptEntry(data, oldMasterKey, oldPassword,
+                newMasterKey)) for when, data in records]))
+
+def swapHistory(staging, directory):
+    '''
+    Moves the logs made by stageHistory over the old ones. Can be run again
+    after a crash part way through, or after the staging folder is gone
+    '''
+    root = join(directory, HISTORY_NAME)
+    if not exists(staging):
+        return
+    for name in listdir(staging):
+        if not name.startswith(STAGED_PREFIX):
+            continue
+        target = join(root, name[len(STAGED_PREFIX):])
+        #Entries deleted while the new logs were being made
+        if exists(target):
+            replace(join(staging, name), target)
+        else:
+            remove(join(staging, name))
+    if exists(root):
+        syncDirectory(root)
@@ -0,0 +1,198 @@
+'''
+Bulk import of passwords exported from other password managers or browsers.
+
+CSV files need a header row naming a title column (name, title or url) and a
+password column, or else have the title and password as their first two
+columns. JSON files can be either an array of objects or one object per line,
+with the same keys. Both are read as a stream, so the size of the file does
+not matter.
+
+Entries are encrypted in batches across a process pool while earlier batches
+are written, and everything is synced once at the end. Titles are cleaned
+and checked the same way the Add Password screen does it.
+
+python passmancli.py import FILE
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader
+from itertools import islice
+from json import JSONDecoder
+from os import cpu_count
+from os.path import splitext
+
+from keys import encryptEntry
+from storage import isReserved
+from vault import cleanTitle
+
+BATCH = 1000
+CHUNK = 1 << 16
+#Larger objects are taken for a damaged file rather than read on to the end
+MAX_OBJECT = 1 << 20
+
+TITLE_KEYS = ('name', 'title', 'url')
+PASSWORD_KEYS = ('password', 'login_password')
+
+class ImportReport:
+    '''
+    What an import did: the names that were added, the titles that collided
+    with an existing entry and how many rows had no title or password
+    '''
+    def __init__(self):
+        self.imported = []
+        self.duplicates = []
+        self.skipped = 0
+
+    def summary(self):
+        return '%d imported, %d duplicates, %d skipped' % (
+            len(self.imported), len(self.duplicates), self.skipped)
+
+def findColumn(header, keys):
+    for key in keys:
+        if key in header:
+            return header.index(key)
+    return None
+
+def readCsv(file):
+    """Yields the (title, password) of every row of a CSV file"""
+    rows = reader(file)
+    first = next(rows, None)
+    if first is None:
+        return
+    header = [x.strip().lower() for x in first]
+    titleColumn = findColumn(header, TITLE_KEYS)
+    passwordColumn = findColumn(header, PASSWORD_KEYS)
+    if titleColumn is None or passwordColumn is None:
+        #No header, so the first row is an entry too
+        titleColumn, passwordColumn = 0, 1
+        yield (first[0], first[1]) if len(first) > 1 else ('', '')
+
+    for row in rows:
+        if len(row) > max(titleColumn, passwordColumn):
+            yield row[titleColumn], row[passwordColumn]
+        else:
+            yield '', ''
+
+def readJsonObjects(file):
+    '''
+    Yields the objects of a JSON array or of a file with one object per line,
+    reading the file a chunk at a time. Raises ValueError for an object that
+    does not parse within MAX_OBJECT characters
+    '''
+    decoder = JSONDecoder()
+    buffer = ''
+    position = 0
+    finished = False
+    while True:
+        #Skip whitespace and the array's punctuation between objects
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            if finished:
+                return
+            buffer, position = file.read(CHUNK), 0
+            finished = buffer == ''
+            continue
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if finished:
+                raise
+            if len(buffer) - position > MAX_OBJECT:
+                raise ValueError('A JSON object is damaged or too large')
+            #The object runs past the end of the buffer
+            chunk = file.read(CHUNK)
+            finished = chunk == ''
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield value
+
+def readJson(file):
+    """Yields the (title, password) of every object in a JSON file"""
+    for value in readJsonObjects(file):
+        if not isinstance(value, dict):
+            yield '', ''
+            continue
+        lowered = dict((str(k).lower(), v) for k, v in value.items())
+        title = next((lowered[x] for x in TITLE_KEYS if lowered.get(x)), '')
+        password = next((lowered[x] for x in PASSWORD_KEYS
+            if lowered.get(x)), '')
+        yield str(title), str(password)
+
+def readEntries(file, format):
+    """Yields (title, password) pairs from an open csv or json file"""
+    if format == 'csv':
+        return readCsv(file)
+    if format == 'json':
+        return readJson(file)
+    raise ValueError('Unknown import format: %s' % format)
+
+def encryptBatch(masterKey, secrets):
+    return [encryptEntry(masterKey, x.encode()) for x in secrets]
+
+def importEntries(vault, entries, workers=None):
+    '''
+    Saves (title, password) pairs into an unlocked vault. Titles are cleaned
+    with cleanTitle, and rows that end up with no title or password, or with
+    a name the program keeps for itself, are skipped, as the Add Password
+    screen does. Cleaned titles that are already taken, by the vault or
+    earlier in the import, are reported as duplicates. Returns an
+    ImportReport
+    '''
+    vault.checkUnlocked()
+    report = ImportReport()
+    taken = set(vault.names())
+    entries = iter(entries)
+    pending = deque()
+
+    def finish(names, future):
+        encrypted = future.result()
+        for name in vault.createMany(list(zip(names, encrypted))):
+            #Something else saved this name while the import was running
+            names.remove(name)
+            report.duplicates.append(name)
+        report.imported.extend(names)
+
+    workers = workers or cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        limit = workers * 2
+        while True:
+            batch = list(islice(entries, BATCH))
+            if not batch:
+                break
+            names = []
+            secrets = []
+            for title, password in batch:
+                name = cleanTitle(title)
+                if name == '' or password == '' or isReserved(name):
+                    report.skipped += 1
+                elif name in taken:
+                    report.duplicates.append(name)
+                else:
+                    taken.add(name)
+                    names.append(name)
+                    secrets.append(password)
+            if not names:
+                continue
+
+            #Keep a bounded number of batches in flight so the input is
+            #streamed rather than read in whole
+            pending.append((names,
+                pool.submit(encryptBatch, vault.masterKey, secrets)))
+            if len(pending) >= limit:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+
+    vault.sync()
+    return report
+
+def importFile(vault, path, format=None, workers=None):
+    '''
+    Imports a csv or json file, working out which from its extension unless
+    format is given. Returns an ImportReport
+    '''
+    format = format or splitext(path)[1][1:].lower()
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        return importEntries(vault, readEntries(file, format), workers)
@@ -0,0 +1,216 @@
+'''
+Key derivation and the entry file formats.
+
+The master key comes from the scrypt hash that checks the master password at
+login (see masterkey.py). Every entry then gets its own key from a cheap HKDF
+style expansion of the master key over the entry's salt, so copying or saving
+an entry no longer runs a slow KDF. Vaults made before that had a master key
+of their own, from PBKDF2 over a salt kept in .keysalt; they are moved over
+to the scrypt one the first time they are unlocked.
+
+Version 3 entries are HEADER + nonce(12) + salt(16) + ChaCha20-Poly1305
+ciphertext + tag(16), with the header and salt authenticated too, so a wrong
+key or a changed byte is rejected before any plaintext is produced. Entries
+saved by older versions can still be read: version 2 (Salsa20 under the
+derived key) and the original nonce + salt + ciphertext, keyed with PBKDF2
+over the raw password. Neither is authenticated, and both are rewritten in
+the current format the first time they are read.
+
+The vault also keeps a key check value, a MAC of a fixed string under the
+master key, so a master key that does not belong to the vault is caught at
+unlock with one constant time comparison.
+'''
+
+from hashlib import pbkdf2_hmac, sha256
+from hmac import compare_digest, new as hmacNew
+from os import urandom
+from os.path import join
+
+from storage import writeAtomic
+
+from Crypto.Cipher import ChaCha20_Poly1305, Salsa20
+
+KEYSALT_NAME = '.keysalt'
+KEYCHECK_NAME = '.keycheck'
+LEGACY_ITERATIONS = 200000
+
+#Entries written by this version start with MAGIC, a version byte and a zero
+#byte. Old entries have an alphanumeric salt character at that offset, so the
+#two formats cannot be confused
+MAGIC = b'PASSMAN'
+VERSION = 3
+HEADER = MAGIC + bytes([VERSION, 0])
+LEGACY_HEADER = MAGIC + bytes([2, 0])
+NONCE_SIZE = 12
+SALT_SIZE = 16
+TAG_SIZE = 16
+
+class AuthenticationError(ValueError):
+    """An entry was changed, damaged or encrypted under another key"""
+    pass
+
+class DecodingError(ValueError):
+    """An entry decrypted, but does not hold text this program saved"""
+    pass
+
+def readKeySalt(directory):
+    '''
+    Returns the salt of an older vault's own master key, or None if the
+    vault's master key comes from its master password record
+    '''
+    try:
+        with open(join(directory, KEYSALT_NAME), 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+def deriveLegacyMasterKey(password, salt):
+    """Returns the master key of a vault with a .keysalt file"""
+    return pbkdf2_hmac('sha256', password, salt, LEGACY_ITERATIONS, 32)
+
+def keyCheckValue(masterKey):
+    return hmacNew(masterKey, b'PassMan key check', sha256).digest()
+
+def writeKeyCheck(directory, masterKey):
+    """Saves the key check value for a vault's new master key"""
+    writeAtomic(join(directory, KEYCHECK_NAME), keyCheckValue(masterKey))
+
+def readKeyCheck(directory):
+    """Returns the vault's key check value, or None if it has none yet"""
+    try:
+        with open(join(directory, KEYCHECK_NAME), 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+def checkKey(directory, masterKey):
+    '''
+    Checks that masterKey is the one the vault's entries are encrypted
+    under. Vaults made before there was a key check value get one now
+    '''
+    expected = readKeyCheck(directory)
+    if expected is None:
+        writeKeyCheck(directory, masterKey)
+        return True
+    return compare_digest(expected, keyCheckValue(masterKey))
+
+def expandKey(key, info, length=32):
+    """HKDF-Expand (RFC 5869) using SHA-256, with key used as the PRK"""
+    output = b''
+    block = b''
+    counter = 1
+    while len(output) < length:
+        block = hmacNew(key, block + info + bytes([counter]), sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+def entryKey(masterKey, salt):
+    """Returns the cipher key for the entry with the given salt"""
+    return expandKey(masterKey, b'PassMan entry key' + salt)
+
+def entryVersion(data):
+    """Returns the format version of the stored bytes of an entry"""
+    if data[:len(MAGIC)] == MAGIC and len(data) > 9 and data[8] == 0:
+        return data[7]
+    return 1
+
+def encryptEntry(masterKey, secret):
+    """Returns the bytes to store for the secret in the current format"""
+    nonce = urandom(NONCE_SIZE)
+    salt = urandom(SALT_SIZE)
+    cipher = ChaCha20_Poly1305.new(key=entryKey(masterKey, salt), nonce=nonce)
+    cipher.update(HEADER + salt)
+    ciphertext, tag = cipher.encrypt_and_digest(secret)
+    return HEADER + nonce + salt + ciphertext + tag
+
+def splitEntry(data):
+    '''
+    Returns the version, nonce, salt and ciphertext of a stored entry. The
+    ciphertext of a version 3 entry ends with its tag
+    '''
+    version = entryVersion(data)
+    if version == 1:
+        return version, data[:8], data[8:24], data[24:]
+    if version == 2:
+        data = data[len(LEGACY_HEADER):]
+        return version, data[:8], data[8:24], data[24:]
+    if version == 3:
+        if len(data) < len(HEADER) + NONCE_SIZE + SALT_SIZE + TAG_SIZE:
+            raise AuthenticationError('Entry is truncated')
+        data = data[len(HEADER):]
+        return (version, data[:NONCE_SIZE],
+            data[NONCE_SIZE:NONCE_SIZE + SALT_SIZE],
+            data[NONCE_SIZE + SALT_SIZE:])
+    raise ValueError('Unsupported entry format version %d' % version)
+
+def deriveEntryKey(data, masterKey, password):
+    '''
+    Returns the cipher key for the stored bytes of an entry. For entries in
+    the old format this is the slow part of decrypting them
+    '''
+    version, nonce, salt, ciphertext = splitEntry(data)
+    if version == 1:
+        #The same PBKDF2 (HMAC-SHA1, 1000 rounds) older versions used, but from
+        #hashlib so other threads keep running while it works
+        return pbkdf2_hmac('sha1', password, salt, 1000, 32)
+    return entryKey(masterKey, salt)
+
+def decryptEntry(data, masterKey, password, key=None):
+    '''
+    Decrypts the stored bytes of an entry in any supported format. Returns the
+    plaintext and whether the entry should be rewritten in the current format.
+    The entry key can be passed in if it was already derived. Raises
+    AuthenticationError if a current entry does not check out
+    '''
+    version, nonce, salt, ciphertext = splitEntry(data)
+    if key is None:
+        key = deriveEntryKey(data, masterKey, password)
+    if version < 3:
+        return Salsa20.new(key, nonce).decrypt(ciphertext), True
+    cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    cipher.update(data[:len(HEADER)] + salt)
+    try:
+        return cipher.decrypt_and_verify(ciphertext[:-TAG_SIZE],
+            ciphertext[-TAG_SIZE:]), False
+    except ValueError:
+        raise AuthenticationError('Entry failed authentication')
+
+def decodeSecret(plaintext, version):
+    '''
+    Returns the text of a decrypted entry of the given format version.
+    Current entries hold UTF-8 and older ones CP1252, which entries moved to
+    the current format before that was told apart may still hold. Raises
+    DecodingError if the plaintext is neither
+    '''
+    if version >= 3:
+        try:
+            return plaintext.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    try:
+        return plaintext.decode('cp1252')
+    except UnicodeDecodeError:
+        raise DecodingError('Entry does not hold text')
+
+def upgradeSecret(plaintext, outdated, version):
+    '''
+    Returns the plaintext of a decrypted entry as it should be saved in the
+    current format: the text of an outdated entry as UTF-8. Plaintext that
+    does not decode is kept as it is
+    '''
+    if not outdated:
+        return plaintext
+    try:
+        return decodeSecret(plaintext, version).encode()
+    except DecodingError:
+        return plaintext
+
+def reencryptEntry(data, masterKey, password, newMasterKey):
+    '''
+    Decrypts the stored bytes of an entry in any supported format and returns
+    them encrypted under newMasterKey in the current format
+    '''
+    plaintext, outdated = decryptEntry(data, masterKey, password)
+    return encryptEntry(newMasterKey,
+        upgradeSecret(plaintext, outdated, entryVersion(data)))
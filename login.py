@@ -2,20 +2,22 @@
 The login window class that is opened when the program is first started
 '''
 
-from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit, QPushButton, QGridLayout
-from PyQt5.QtCore import Qt, QEvent
+from PyQt5.QtWidgets import (QWidget, QLabel, QLineEdit, QPushButton,
+    QGridLayout, QProgressBar)
+from PyQt5.QtCore import Qt, QEvent, pyqtSignal
 from PyQt5.QtGui import QFont
 
-from os import getenv
-from os.path import join
-from Crypto.Hash import SHA256
-
-from common import setColor, buttonStylesheet
+from common import setColor, buttonStylesheet, Worker
 
 class LoginScreen(QWidget):
-    def __init__(self):
+    #Emitted once the vault has been unlocked, before the window closes
+    unlocked = pyqtSignal()
+
+    def __init__(self, vault):
         super().__init__()
+        self.vault = vault
         self.password = None
+        self.worker = None
         self.initUI()
     
     def initUI(self):
@@ -50,6 +52,15 @@ class LoginScreen(QWidget):
         okayButton.setFont(font)
         okayButton.setStyleSheet(buttonStylesheet)
         okayButton.clicked.connect(lambda x: self.checkPassword(passwordBox, wrongPasswordLabel))
+        self.okayButton = okayButton
+
+        #Shown while the password is being checked
+        progressBar = QProgressBar()
+        progressBar.setRange(0, 0)
+        progressBar.setTextVisible(False)
+        progressBar.setFixedHeight(8)
+        progressBar.setVisible(False)
+        self.progressBar = progressBar
 
         #Layout setup
         grid = QGridLayout()
@@ -60,32 +71,67 @@ class LoginScreen(QWidget):
         grid.addWidget(wrongPasswordLabel, 2, 1)
         grid.addWidget(exitButton, 2, 0)
         grid.addWidget(okayButton, 2, 2)
+        grid.addWidget(progressBar, 3, 0, 1, 3)
 
         #Set up the window
         setColor(self, 51, 51, 51)
 
         self.setLayout(grid)
         self.setWindowTitle("Login")
-        self.setFixedSize(350, 150)
+        self.setFixedSize(350, 170)
         self.show()
 
     def checkPassword(self, box, label):        
-        """Reads the hashed password from a file and checks it against the entered password"""
-
-        password = box.text()
-        savedPass = ""
-
-        with open(join(join(getenv('APPDATA'), 'PassManData'),
-            'savedpassword'), 'rb') as file:
-            savedPass = file.read()
-
-        sha3_256 = SHA256.new()
-        sha3_256.update(password.encode())
-        if sha3_256.digest() == savedPass:
-            self.password = password.encode()
+        """Starts checking the entered password against the saved one on a
+        worker thread, so that the window keeps responding while it runs"""
+
+        #The vault is still being opened, see Startup
+        if self.worker is not None or self.vault is None:
+            return
+        label.setVisible(False)
+        self.setBusy(True)
+
+        password = box.text().encode()
+        self.worker = Worker(self.unlock, password)
+        self.worker.done.connect(
+            lambda matched: self.passwordChecked(password, matched))
+        self.worker.start()
+
+    def unlock(self, password):
+        '''
+        Unlocks the vault on the worker thread. Errors are handed back rather
+        than raised, which would abort the program from that thread
+        '''
+        try:
+            return self.vault.unlock(password)
+        except Exception as error:
+            #Moving an older vault over runs a whole master password change
+            return error
+
+    def passwordChecked(self, password, matched):
+        """Called back on the GUI thread once the password has been checked"""
+
+        self.worker = None
+        self.setBusy(False)
+        if isinstance(matched, Exception):
+            self.wrongPasswordLabel.setText(
+                "<font color='red'>%s</font>" % matched)
+            self.wrongPasswordLabel.setVisible(True)
+        elif matched:
+            self.password = password
+            self.unlocked.emit()
             self.close()
         else:
-            label.setVisible(True)
+            self.wrongPasswordLabel.setText(
+                "<font color='red'>Incorrect Password</font>")
+            self.wrongPasswordLabel.setVisible(True)
+
+    def setBusy(self, busy):
+        """Shows the progress bar and locks the inputs while checking"""
+
+        self.progressBar.setVisible(busy)
+        self.passwordBox.setEnabled(not busy)
+        self.okayButton.setEnabled(not busy)
 
     def event(self, event):
         """Checks to see one of the enter keys were pressed, and passes it to the
@@ -0,0 +1,154 @@
+'''
+The record that is used to check the master password at login.
+
+The record is stored in the savedpassword file as JSON holding the format
+version, the algorithm, a random salt, the scrypt cost parameters and a check
+value. The cost is calibrated when the vault is created so that checking the
+password takes about TARGET_SECONDS on the machine it was created on.
+
+The scrypt output is never stored. The check value and the vault's master key
+are both expanded from it, so the one slow derivation at login both checks
+the password and gives the key, and the entries cannot be attacked any faster
+than the record can. Older versions stored the scrypt output itself (version
+2) or a single unsalted SHA-256 of the password; those files are still
+accepted and are replaced with a new record after the next successful login.
+'''
+
+from hashlib import scrypt, sha256
+from hmac import compare_digest
+from json import dumps, loads
+from os import urandom
+from time import perf_counter
+
+from keys import expandKey
+
+VERSION = 3
+LEGACY_VERSION = 2
+TARGET_SECONDS = 0.5
+#scrypt parameters. N is raised during calibration, starting from MIN_N, and is
+#never raised past the point where it would need more than MAX_MEMORY bytes
+MIN_N = 1 << 14
+MAX_MEMORY = 256 << 20
+R = 8
+P = 1
+
+def memoryNeeded(n, r, p):
+    """Returns a memory limit for hashlib.scrypt with some room to spare"""
+    return 128 * r * (n + p + 2) + (1 << 20)
+
+def hashPassword(password, salt, n, r, p):
+    return scrypt(password, salt=salt, n=n, r=r, p=p,
+        maxmem=memoryNeeded(n, r, p), dklen=32)
+
+def checkValue(derived):
+    return expandKey(derived, b'PassMan password check')
+
+def deriveMasterKey(derived):
+    """Returns the vault's master key for the output of hashPassword"""
+    return expandKey(derived, b'PassMan master key')
+
+def calibrate(targetSeconds=TARGET_SECONDS):
+    '''
+    Returns the scrypt N that makes one hash take at least targetSeconds here,
+    doubling it from MIN_N until it does or the memory limit is reached
+    '''
+    n = MIN_N
+    salt = urandom(16)
+    while 128 * R * n * 2 <= MAX_MEMORY:
+        start = perf_counter()
+        hashPassword(b'calibration', salt, n, R, P)
+        elapsed = perf_counter() - start
+        #Doubling N roughly doubles the time, so stop once doubling it again
+        #would overshoot by more than going without
+        if elapsed * 1.5 >= targetSeconds:
+            break
+        n *= 2
+    return n
+
+def createRecord(password, n=None):
+    '''
+    Returns the contents of a new savedpassword file for password and the
+    master key it gives
+    '''
+    if n is None:
+        n = calibrate()
+    salt = urandom(16)
+    derived = hashPassword(password, salt, n, R, P)
+    return dumps({
+        'version': VERSION,
+        'algorithm': 'scrypt',
+        'salt': salt.hex(),
+        'n': n,
+        'r': R,
+        'p': P,
+        'check': checkValue(derived).hex()
+        }).encode(), deriveMasterKey(derived)
+
+def isLegacy(record):
+    '''
+    Checks if the record is the bare SHA-256 older versions saved. That is
+    32 raw bytes, which can start with anything, while a JSON record is
+    always longer
+    '''
+    return len(record) == sha256().digest_size
+
+def verify(password, record):
+    '''
+    Checks password against the contents of a savedpassword file. Returns
+    the master key, or None if it did not match. When the file is in an older
+    format a replacement record is returned too, and the master key is the
+    one that record gives, which only takes effect once it is saved
+    '''
+    if isLegacy(record):
+        if compare_digest(sha256(password).digest(), record):
+            record, key = createRecord(password)
+            return key, record
+        return None, None
+
+    fields = readFields(record)
+    try:
+        salt = bytes.fromhex(fields['salt'])
+        n, r, p = fields['n'], fields['r'], fields['p']
+        if fields['version'] == LEGACY_VERSION:
+            expected = bytes.fromhex(fields['hash'])
+        else:
+            expected = bytes.fromhex(fields['check'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('The master password record is damaged')
+    derived = hashPassword(password, salt, n, r, p)
+    if fields['version'] == LEGACY_VERSION:
+        #The stored hash is the scrypt output itself, so no key can come
+        #from it. A new salt is drawn at the same cost
+        if compare_digest(expected, derived):
+            record, key = createRecord(password, n)
+            return key, record
+        return None, None
+    if compare_digest(expected, checkValue(derived)):
+        return deriveMasterKey(derived), None
+    return None, None
+
+def readFields(record):
+    '''
+    Returns the fields of a JSON record. Raises ValueError if it is damaged
+    or of an unsupported version
+    '''
+    try:
+        fields = loads(record.decode())
+        supported = (fields.get('version') in (VERSION, LEGACY_VERSION) and
+            fields.get('algorithm') == 'scrypt')
+    except (UnicodeDecodeError, ValueError, AttributeError):
+        raise ValueError('The master password record is damaged')
+    if not supported:
+        raise ValueError('Unsupported master password record')
+    return fields
+
+def isCurrent(record):
+    '''
+    Checks if the record is in the current format, which means the master
+    key comes from it and not from a separate key salt
+    '''
+    try:
+        return (not isLegacy(record) and
+            readFields(record)['version'] == VERSION)
+    except ValueError:
+        return False
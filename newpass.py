@@ -4,20 +4,22 @@ will ask for a new password, check that it is the same in both boxes, and
 saves it to disk
 '''
 
-from PyQt5.QtWidgets import QWidget, QLabel, QLineEdit, QPushButton, QGridLayout
-from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtWidgets import (QWidget, QLabel, QLineEdit, QPushButton,
+    QGridLayout, QProgressBar)
+from PyQt5.QtCore import QEvent, Qt, pyqtSignal
 from PyQt5.QtGui import QFont
 
-from Crypto.Hash import SHA256
-from os.path import join
-from os import getenv
-
-from common import setColor, buttonStylesheet
+from common import setColor, buttonStylesheet, Worker
 
 class NewPasswordScreen(QWidget):
-    def __init__(self):
+    #Emitted once the password has been saved, before the window closes
+    unlocked = pyqtSignal()
+
+    def __init__(self, vault):
         super().__init__()
+        self.vault = vault
         self.password = None
+        self.worker = None
         self.initUI()
     
     def initUI(self):
@@ -53,12 +55,21 @@ class NewPasswordScreen(QWidget):
         exitButton = QPushButton('Exit')
         exitButton.setFont(font)
         exitButton.setStyleSheet(buttonStylesheet)
-        exitButton.clicked.connect(lambda x: exit())
+        exitButton.clicked.connect(lambda x: self.cancel())
 
         okayButton = QPushButton('Enter')
         okayButton.setFont(font)
         okayButton.setStyleSheet(buttonStylesheet)
         okayButton.clicked.connect(self.checkPassword)
+        self.okayButton = okayButton
+
+        #Shown while the new password is being saved
+        progressBar = QProgressBar()
+        progressBar.setRange(0, 0)
+        progressBar.setTextVisible(False)
+        progressBar.setFixedHeight(8)
+        progressBar.setVisible(False)
+        self.progressBar = progressBar
 
         #Layout setup
         grid = QGridLayout()
@@ -70,11 +81,12 @@ class NewPasswordScreen(QWidget):
         grid.addWidget(differentPasswordLabel, 3, 1)
         grid.addWidget(exitButton, 3, 0)
         grid.addWidget(okayButton, 3, 2)
+        grid.addWidget(progressBar, 4, 0, 1, 3)
 
         setColor(self, 51, 51, 51)
         self.setLayout(grid)
         self.setWindowTitle("Enter a New Password")
-        self.setFixedSize(350, 200)
+        self.setFixedSize(350, 220)
         self.show()
 
     def checkPassword(self, **kwargs):
@@ -82,19 +94,62 @@ class NewPasswordScreen(QWidget):
         Checks to be sure that the password boxes match and saves it if
         they do.
         '''
+        #The vault is still being opened, see Startup
+        if self.worker is not None or self.vault is None:
+            return
         if self.passwordBox0.text() != self.passwordBox1.text():
-            self.differentPasswordLabel.setVisible(True)
+            self.showError("Passwords do not match")
             return
+        self.differentPasswordLabel.setVisible(False)
+        self.setBusy(True)
+
+        password = self.passwordBox0.text().encode()
+        #Calibrating and saving the new password takes a moment
+        self.worker = Worker(self.save, password)
+        self.worker.done.connect(
+            lambda error: self.passwordSaved(password, error))
+        self.worker.start()
 
-        with open(join(join(getenv('APPDATA'), 'PassManData'),
-            'savedpassword'), 'wb') as file:
-            sha3_256 = SHA256.new()
-            sha3_256.update(self.passwordBox0.text().encode())
-            file.write(sha3_256.digest())
+    def save(self, password):
+        '''
+        Saves the new password on the worker thread. Errors are handed back
+        rather than raised, which would abort the program from that thread
+        '''
+        try:
+            self.vault.create(password)
+        except (OSError, ValueError) as error:
+            return error
+
+    def showError(self, message):
+        self.differentPasswordLabel.setText(
+            "<font color='red'>%s</font>" % message)
+        self.differentPasswordLabel.setVisible(True)
 
-        self.password = self.passwordBox0.text().encode()
+    def cancel(self):
+        exit()
+
+    def passwordSaved(self, password, error):
+        '''
+        Called back on the GUI thread once the new password has been saved,
+        or with the error that kept it from being saved
+        '''
+        self.worker = None
+        if error is not None:
+            self.setBusy(False)
+            self.showError(error)
+            return
+        self.password = password
+        self.unlocked.emit()
         self.close()
 
+    def setBusy(self, busy):
+        """Shows the progress bar and locks the inputs while saving"""
+
+        self.progressBar.setVisible(busy)
+        self.passwordBox0.setEnabled(not busy)
+        self.passwordBox1.setEnabled(not busy)
+        self.okayButton.setEnabled(not busy)
+
 
     def event(self, event):
         """Checks to see one of the enter keys were pressed, and passes it to 
@@ -116,4 +171,51 @@ class NewPasswordScreen(QWidget):
         if self.password == None:
             quit()
         else:
-            self.close()
\ No newline at end of file
+            self.close()
+
+class ChangePasswordScreen(NewPasswordScreen):
+    '''
+    The same window, used from the main screen to change the master password
+    of an unlocked vault. Every entry is re-encrypted, see rotate.py
+    '''
+    def __init__(self, vault, parent):
+        self.parent = parent
+        super().__init__(vault)
+        self.setWindowTitle("Change the Master Password")
+
+    def initUI(self):
+        #Only takes effect if set before the window is shown
+        self.setWindowModality(Qt.ApplicationModal)
+        super().initUI()
+
+    def save(self, password):
+        from rotate import rotateMasterPassword
+        try:
+            rotateMasterPassword(self.vault, password)
+        except Exception as error:
+            #The old password still works, and running this again resumes
+            return error
+
+    def cancel(self):
+        if self.worker is None:
+            self.close()
+
+    def passwordSaved(self, password, error):
+        #Keys derived from the old master key are no use any more
+        self.parent.decryptor.forgetAll()
+        self.parent.visibleEntriesChanged()
+        if error is not None:
+            self.worker = None
+            self.setBusy(False)
+            self.parent.tray.showMessage("Password Manager",
+                "Unable to change the master password: %s" % error)
+            return
+        super().passwordSaved(password, None)
+        self.parent.tray.showMessage("Password Manager",
+            "The master password has been changed")
+
+    def closeEvent(self, event):
+        if self.worker is None:
+            event.accept()
+        else:
+            event.ignore()
@@ -2,48 +2,91 @@
 Main class for the program. 
 '''
 
-from sys import argv
+from time import perf_counter
+#Startup times are measured from here, the first thing the program runs
+STARTED = perf_counter()
+
+from os import getenv
+from os.path import exists, join
+from sys import argv, stderr
 from PyQt5.QtWidgets import (QWidget, 
     QLabel, QLineEdit, QGridLayout, QMenu, QApplication, qApp, QPushButton,
-    QFrame, QSystemTrayIcon, QMenu)
+    QFrame, QSystemTrayIcon, QMenu, QFileDialog, QInputDialog)
 from PyQt5.QtGui import QFont, QKeySequence, QIcon
 from PyQt5.QtCore import Qt, QCoreApplication, QEvent, QTimer, QRect
 
-from os import getenv, makedirs, listdir
-from os.path import exists as dirExists
-from os.path import join, isfile
-
-from Crypto.Hash import SHA256
-from Crypto.Protocol.KDF import PBKDF2
-from Crypto.Cipher import Salsa20
-
 from login import LoginScreen
-from newpass import NewPasswordScreen
+from newpass import NewPasswordScreen, ChangePasswordScreen
 from addpass import AddPasswordScreen
-from passwordbutton import PasswordButton
-from common import setColor, buttonStylesheet
+from passwordbutton import PasswordList
+from entrymodel import EntryListModel
+from entrytable import EntryTable
+from decryptservice import DecryptService
+from common import setColor, buttonStylesheet, Worker
+from searchindex import buildIndex, scanNames, RESULT_LIMIT
+from storage import dataDir, RECORD_NAME
+from watcher import EntryWatcher
+import tracing
+import clipboard
 from math import floor
+from threading import Thread
 
-from pyperclip import copy
 from codecs import decode
 
+#The vault (and the cryptography, storage backends and process pools behind
+#it) is loaded once the login window is up, and the modules behind the tray
+#menu's actions when they are first used
+
 class MainScreen(QWidget):
-    def __init__(self, password):
+    def __init__(self, vault, files=None, show=True):
+        '''
+        Builds the main window. The entry names can be passed in if they were
+        already listed, and with show off the window and tray icon stay
+        hidden until open() is called
+        '''
         super().__init__()
-        self.password = password
+        self.vault = vault
         self.lastGenerated = None
         self.minimized = False
-        self.scrollPos = 0
-        self.entriesPerPage = 12
-        self.initUI()
-    
-    def initUI(self):
+        self.statuses = {}
+        self.agent = None
+        #Jobs still running, see startJob
+        self.jobs = set()
+        self.decryptor = DecryptService(vault)
+        self.decryptor.decrypted.connect(self.passwordDecrypted)
+        self.decryptor.failed.connect(self.showStatus)
+        self.initUI(files)
+        if show:
+            self.open()
+
+    def initUI(self, files):
         layout = QGridLayout()  
 
         #System Tray
         icon = QIcon('icon.png')
 
         menu = QMenu()
+        importAct = menu.addAction("Import passwords...")
+        importAct.triggered.connect(lambda x: self.importPasswords())
+        exportAct = menu.addAction("Export backup...")
+        exportAct.triggered.connect(lambda x: self.exportBackup())
+        restoreAct = menu.addAction("Restore backup...")
+        restoreAct.triggered.connect(lambda x: self.restoreBackup())
+        changeAct = menu.addAction("Change master password...")
+        changeAct.triggered.connect(lambda x: self.changePassword())
+        auditAct = menu.addAction("Audit passwords...")
+        auditAct.triggered.connect(lambda x: self.auditPasswords())
+
+        #Timing actions, only shown when the menu is opened with Shift held
+        self.traceAct = menu.addAction("Start timing")
+        self.traceAct.triggered.connect(lambda x: self.toggleTracing())
+        self.reportAct = menu.addAction("Save timing report...")
+        self.reportAct.triggered.connect(lambda x: self.saveTimingReport())
+        menu.aboutToShow.connect(self.showDebugActions)
+        import agent
+        if agent.isSupported():
+            self.agentAct = menu.addAction("Start unlock agent")
+            self.agentAct.triggered.connect(lambda x: self.toggleAgent())
         exitAct = menu.addAction("Exit")
         exitAct.triggered.connect(lambda x: self.close())
 
@@ -51,7 +94,6 @@ class MainScreen(QWidget):
         self.tray.setIcon(icon)
         self.tray.activated.connect(self.maximize)
         self.tray.setContextMenu(menu)
-        self.tray.show()
 
         #Buttons
         newPassBtn = QPushButton("New Password")
@@ -82,36 +124,62 @@ class MainScreen(QWidget):
         layout.addWidget(line, 1, 0, 1, 3)
         
 
-        #Buttons
-        self.buttons = []
-        self.files =  [x for x in listdir(
-            join(getenv('APPDATA'), 'PassManData')) if (isfile(
-                join(join(getenv('APPDATA'), 'PassManData'),
-                x)) and x != 'savedpassword')]
-
-        for x in range(self.entriesPerPage):
-            self.buttons.append(PasswordButton(str(x), password, self))
-            self.buttons[-1].setFocusPolicy(Qt.NoFocus)
-
-            self.buttons[-1].contextMenu = QMenu()
-            deleteAct = self.buttons[-1].contextMenu.addAction('Delete')
-            deleteAct.triggered.connect(self.buttons[-1].remove)
-            self.buttons[-1].setContextMenuPolicy(Qt.CustomContextMenu)
-            self.buttons[-1].customContextMenuRequested.connect(
-                self.buttons[-1].onContextMenu)
-            
-            layout.addWidget(self.buttons[-1], x+2, 0, 1, 3)
+        #Search box
+        self.searchIndex = None
+        self.searchBox = QLineEdit()
+        self.searchBox.setFont(QFont("Arial", 15))
+        self.searchBox.setPlaceholderText("Search")
+        self.searchBox.setStyleSheet(""" QLineEdit {
+            background-color: #444444;
+            border: 0px;
+            border-bottom: 1px solid #555555;
+            color: white;
+            padding: 5px;
+        }
+        """)
+        self.searchBox.textChanged.connect(lambda x: self.filterEntries())
+        self.searchBox.returnPressed.connect(self.copyFirstResult)
+        layout.addWidget(self.searchBox, 2, 0, 1, 3)
+
+        #Password list
+        if files is None:
+            with tracing.span('startup.listing'):
+                files = self.vault.names()
+        if not isinstance(files, EntryTable):
+            files = EntryTable(files)
+        self.files = files
+        self.model = EntryListModel(self.files, self.statuses)
+        self.list = PasswordList(self.model, self)
+        layout.addWidget(self.list, 3, 0, 1, 3)
+        layout.setRowStretch(3, 1)
 
-        self.updateButtons()
+        #Shown when a search matched more entries than are listed
+        self.truncatedLabel = QLabel("<font color='white'>Showing the first "
+            "%d matches, keep typing to narrow them down</font>" %
+            RESULT_LIMIT)
+        self.truncatedLabel.setFont(QFont("Arial", 12))
+        self.truncatedLabel.setAlignment(Qt.AlignCenter)
+        self.truncatedLabel.hide()
+        layout.addWidget(self.truncatedLabel, 4, 0, 1, 3)
+
+        #The search index is built on a worker thread. Entries added or
+        #removed meanwhile are applied to it once it is done
+        self.indexChanges = []
+        self.indexer = Worker(buildIndex, list(self.files))
+        self.indexer.done.connect(self.indexBuilt)
+        self.indexer.start()
+
+        #Picks up entries saved or deleted by other programs
+        self.watcher = EntryWatcher(self.vault, self.files)
+        self.watcher.changed.connect(self.applyChanges)
 
         line1 = QFrame()
         line1.setGeometry(QRect(320, 150, 118, 3))
         line1.setFrameShape(QFrame.HLine)
         line1.setFrameShadow(QFrame.Sunken)
-        layout.addWidget(line1, self.entriesPerPage+2, 0, 1, 3)
+        layout.addWidget(line1, 5, 0, 1, 3)
         
         #Layout setup
-        layout.setAlignment(Qt.AlignTop)
         layout.setSpacing(0)
         layout.setContentsMargins(0, 20, 0, 0)
         self.setStyleSheet("""
@@ -124,6 +192,10 @@ class MainScreen(QWidget):
         self.setWindowTitle("Password Manager")
         self.setWindowIcon(icon)
         #self.setWindowFlags(Qt.FramelessWindowHint)
+
+    def open(self):
+        """Shows the window and the tray icon"""
+        self.tray.show()
         self.show()
    
     def addPassword(self, **kwargs):
@@ -140,17 +212,349 @@ class MainScreen(QWidget):
         if not addPass.password == None: 
             self.lastGenerated = addPass.password
 
-    def updateButtons(self):
+    def addEntry(self, name):
+        '''
+        Adds a newly saved entry to the list
+        '''
+        if name in self.files:
+            return
+        self.indexEntry(name, True)
+        if self.searchBox.text().strip():
+            self.files.add(name)
+            self.filterEntries()
+        else:
+            self.model.insert(name)
+        self.visibleEntriesChanged()
+
+    def addEntries(self, names):
+        '''
+        Adds a batch of imported entries to the list, skipping any it already
+        has
+        '''
+        names = set(names).difference(self.files)
+        if not names:
+            return
+        self.files.extend(names)
+        for name in names:
+            self.indexEntry(name, True)
+        self.filterEntries()
+
+    def removeEntries(self, names):
+        '''
+        Removes deleted entries from the list, redrawing it once
+        '''
+        for name in names:
+            self.statuses.pop(name, None)
+            self.indexEntry(name, False)
+        self.model.removeMany(names)
+        #Already done if the list was showing the whole table
+        self.files.removeMany(names)
+        self.visibleEntriesChanged()
+
+    def applyChanges(self, added, removed, modified):
+        '''
+        Brings the list up to date with changes the watcher found in the
+        store, redrawing it once however many entries changed
+        '''
+        if removed:
+            for name in removed:
+                self.decryptor.forget(name)
+            self.removeEntries(removed)
+        if added:
+            self.addEntries(added)
+        for name in modified:
+            #A cached key is for the entry as it was before
+            self.decryptor.forget(name)
+            self.model.refresh(name)
+
+    def indexEntry(self, name, added):
+        '''
+        Adds a name to the search index or removes it, or saves the change
+        for when the index has been built
+        '''
+        if self.searchIndex is None:
+            self.indexChanges.append((name, added))
+        elif added:
+            self.searchIndex.add(name)
+        else:
+            self.searchIndex.remove(name)
+
+    def indexBuilt(self, index):
+        '''
+        Called when the worker thread has built the search index
+        '''
+        for name, added in self.indexChanges:
+            if added:
+                index.add(name)
+            else:
+                index.remove(name)
+        self.indexChanges = []
+        self.searchIndex = index
+        if self.searchBox.text().strip():
+            self.filterEntries()
+
+    def filterEntries(self, **kwargs):
+        '''
+        Shows only the entries matching the search box, best matches first.
+        Until the search index is built the names are scanned in order
+        instead. At most RESULT_LIMIT are shown, with a note when there were
+        more
+        '''
+        query = self.searchBox.text()
+        truncated = False
+        if query.strip() == '':
+            self.model.setEntries(self.files)
+        else:
+            if self.searchIndex is None:
+                results = scanNames(self.files, query, RESULT_LIMIT + 1)
+            else:
+                results = self.searchIndex.search(query, RESULT_LIMIT + 1)
+            truncated = len(results) > RESULT_LIMIT
+            self.model.setEntries(results[:RESULT_LIMIT])
+        self.truncatedLabel.setVisible(truncated)
+        self.list.scrollToTop()
+        self.visibleEntriesChanged()
+
+    def copyFirstResult(self, **kwargs):
+        '''
+        Copies the best match when enter is pressed in the search box
+        '''
+        if self.model.rowCount() > 0:
+            self.list.loadPassword(self.model.index(0))
+
+    def visibleEntriesChanged(self):
+        '''
+        Called when the list scrolls, resizes or changes, so that the keys for
+        the entries on screen can be prefetched
+        '''
+        self.decryptor.prefetch(self.list.visibleEntries())
+
+    def passwordDecrypted(self, name, secret):
+        '''
+        Copies a password that the decryption service finished with to the
+        clipboard, from where it is cleared again after a while
+        '''
+        with tracing.span('clipboard.copy'):
+            clipboard.copy(secret, clipboard.CLEAR_SECONDS)
+        self.showStatus(name, 'Password copied to clipboard')
+
+    def showStatus(self, name, message):
+        '''
+        Shows a message in place of an entry's name for a couple of seconds
+        '''
+        self.statuses[name] = message
+        self.model.refresh(name)
+        QTimer.singleShot(2000, lambda: self.clearStatus(name, message))
+
+    def clearStatus(self, name, message):
+        if self.statuses.get(name) == message:
+            del self.statuses[name]
+            self.model.refresh(name)
+
+    def importPasswords(self):
+        '''
+        Imports a csv or json export from another password manager. The
+        import runs on its own thread so the window stays responsive
+        '''
+        path, _ = QFileDialog.getOpenFileName(self, "Import passwords", "",
+            "Password exports (*.csv *.json)")
+        if path == '':
+            return
+        from importer import importFile
+        self.startJob(importFile, self.entriesAdded, self.vault, path)
+
+    def exportBackup(self):
+        '''
+        Writes a backup archive of the vault as it is right now
+        '''
+        path, _ = QFileDialog.getSaveFileName(self, "Export backup",
+            "passman-backup.pmb", "PassMan backups (*.pmb)")
+        if path == '':
+            return
+        from backup import exportArchive
+        self.startJob(exportArchive, self.backupExported, self.vault, path)
+
+    def restoreBackup(self):
+        '''
+        Adds the entries of a backup archive to the vault, after checking the
+        whole archive. Entries whose names are taken are left alone
+        '''
+        path, _ = QFileDialog.getOpenFileName(self, "Restore backup", "",
+            "PassMan backups (*.pmb)")
+        if path == '':
+            return
+        password, ok = QInputDialog.getText(self, "Restore backup",
+            "Master password of the backup (blank if it is this one):",
+            QLineEdit.Password)
+        if not ok:
+            return
+        password = password.encode() if password else self.vault.password
+        from backup import restoreArchive
+        self.startJob(restoreArchive, self.entriesAdded, path, password,
+            self.vault)
+
+    def changeEntry(self, name):
+        '''
+        Opens the add password screen for an existing entry, whose old
+        password is kept in its history when the new one is saved
+        '''
+        addPass = AddPasswordScreen(self)
+        addPass.userBox.setText(name)
+        addPass.setWindowTitle("Change Password")
+        addPass.passBox.setFocus()
+
+    def copyRevision(self, name, number):
+        '''
+        Copies one of an entry's earlier passwords, numbered from the newest
+        '''
+        from vault import DecodingError, WrongPasswordError
+        try:
+            when, secret = self.vault.revisions(name)[number]
+        except (IndexError, DecodingError, WrongPasswordError):
+            self.showStatus(name, 'Unable to read that revision')
+            return
+        clipboard.copy(secret, clipboard.CLEAR_SECONDS)
+        self.showStatus(name, 'Earlier password copied to clipboard')
+
+    def attachFile(self, name):
+        '''
+        Attaches a file to an entry. It is encrypted on its own thread a
+        chunk at a time, so files of any size can be attached
+        '''
+        path, _ = QFileDialog.getOpenFileName(self, "Attach file to %s" % name)
+        if path == '':
+            return
+        from attachments import attachPath
+        self.startJob(attachPath, self.attachmentDone, self.vault, name, path)
+
+    def saveAttachment(self, name, label):
+        '''
+        Decrypts one of an entry's attachments into a file, on its own thread
+        '''
+        path, _ = QFileDialog.getSaveFileName(self, "Save attachment", label)
+        if path == '':
+            return
+        from attachments import extractTo
+        self.startJob(extractTo, self.attachmentDone, self.vault, name, label,
+            path)
+
+    def attachmentDone(self, result):
+        if isinstance(result, Exception):
+            self.tray.showMessage("Password Manager", "Failed: %s" % result)
+        else:
+            self.tray.showMessage("Password Manager",
+                "%s (%d bytes)" % result)
+
+    def auditPasswords(self):
         '''
-        Updates the buttons that display the current website/applications that
-        have passwords currently saved
+        Looks for reused and weak passwords on its own thread. Only entries
+        saved since the last audit are decrypted again
         '''
-        for i in range(len(self.buttons)):
-            if i+self.scrollPos >= len(self.files):
-                self.buttons[i].setVisible(False)
-                continue
-            self.buttons[i].setText(self.files[i+self.scrollPos])
-            self.buttons[i].setVisible(True)
+        from audit import auditVault
+        self.startJob(auditVault, self.auditDone, self.vault)
+
+    def auditDone(self, report):
+        if isinstance(report, Exception):
+            self.tray.showMessage("Password Manager", "Failed: %s" % report)
+        else:
+            from auditscreen import AuditScreen
+            self.auditScreen = AuditScreen(report, self)
+
+    def changePassword(self):
+        '''
+        Opens the window for changing the master password
+        '''
+        self.changeScreen = ChangePasswordScreen(self.vault, self)
+
+    def startJob(self, function, finished, *args):
+        '''
+        Runs a long import or backup on its own thread so the window stays
+        responsive, then calls finished with its result or error. The thread
+        is kept in jobs until it is done so that it is not collected while
+        it runs
+        '''
+        job = Worker(self.runJob, function, *args)
+        self.jobs.add(job)
+        job.done.connect(finished)
+        job.finished.connect(lambda: self.jobs.discard(job))
+        job.start()
+
+    def runJob(self, function, *args):
+        #Anything raised here would end the program
+        try:
+            return function(*args)
+        except Exception as error:
+            return error
+
+    def entriesAdded(self, report):
+        from vault import WrongPasswordError
+        if isinstance(report, WrongPasswordError):
+            self.tray.showMessage("Password Manager", "Incorrect password")
+        elif isinstance(report, Exception):
+            self.tray.showMessage("Password Manager", "Failed: %s" % report)
+        else:
+            self.addEntries(report.imported)
+            self.tray.showMessage("Password Manager", report.summary())
+
+    def backupExported(self, count):
+        if isinstance(count, Exception):
+            self.tray.showMessage("Password Manager", "Failed: %s" % count)
+        else:
+            self.tray.showMessage("Password Manager",
+                "Backed up %d passwords" % count)
+
+    def showDebugActions(self):
+        shown = bool(QApplication.keyboardModifiers() & Qt.ShiftModifier)
+        self.traceAct.setText(
+            "Stop timing" if tracing.enabled else "Start timing")
+        self.traceAct.setVisible(shown)
+        self.reportAct.setVisible(shown and bool(tracing.histograms))
+
+    def toggleTracing(self):
+        '''
+        Starts or stops timing the hot paths, see tracing.py
+        '''
+        if tracing.enabled:
+            tracing.disable()
+        else:
+            tracing.enable()
+
+    def saveTimingReport(self):
+        '''
+        Writes the timings collected so far, either as histograms or as a
+        Chrome trace
+        '''
+        path, kind = QFileDialog.getSaveFileName(self, "Save timing report",
+            "passman-timing.json",
+            "Timing histograms (*.json);;Chrome trace (*.json)")
+        if path == '':
+            return
+        if kind.startswith("Chrome"):
+            tracing.writeChromeTrace(path)
+        else:
+            tracing.writeReport(path)
+
+    def toggleAgent(self):
+        '''
+        Starts or stops an unlock agent serving this window's vault, so that
+        passmancli.py can read entries without asking for the master password
+        '''
+        if self.agent is not None:
+            self.agent.stop()
+            self.agent = None
+            self.agentAct.setText("Start unlock agent")
+            return
+        import agent
+        server = agent.Agent(self.vault, lockOnExit=False)
+        try:
+            server.listen()
+        except (agent.AgentError, OSError) as error:
+            self.tray.showMessage("Password Manager",
+                "Unable to start the unlock agent: %s" % error)
+            return
+        self.agent = server
+        Thread(target=self.agent.serve, daemon=True).start()
+        self.agentAct.setText("Stop unlock agent")
 
     def maximize(self, **kwargs):
         '''
@@ -161,29 +565,17 @@ class MainScreen(QWidget):
 
     def closeEvent(self, event):
         '''
-        Removes the icon from the tray before the window closes
+        Removes the icon from the tray and closes the vault before the window
+        closes
         '''
         self.tray.setVisible(False)
+        self.watcher.stop()
+        self.decryptor.shutdown()
+        if self.agent is not None:
+            self.agent.stop()
+        self.vault.close()
         event.accept()
 
-    def wheelEvent(self, event):
-        '''
-        Handles mouse wheel events in order to allow scrolling through passwords
-        '''
-        steps = round(event.angleDelta().y()/120) * -1
-        if steps > 0:
-            for _ in range(steps):
-                if self.scrollPos + self.entriesPerPage < len(self.files):
-                    self.scrollPos += 1 
-            self.updateButtons()
-        else:
-            for _ in range(0, steps, -1):
-                if self.scrollPos > 0:
-                    self.scrollPos -= 1
-            self.updateButtons()
-        
-
-
     def event(self, event):
         '''
         Handles both key input and the window minimizing, or passes the event
@@ -192,16 +584,12 @@ class MainScreen(QWidget):
         if (event.type() == QEvent.KeyPress):
             #Down arrow
             if event.key() == 16777237: 
-                if self.scrollPos + self.entriesPerPage < len(self.files):
-                    self.scrollPos += 1 
-                    self.updateButtons()
+                self.list.scrollRows(1)
                 return True
 
             #Up arrow
             elif event.key() == 16777235:
-                if self.scrollPos > 0:
-                    self.scrollPos -= 1
-                    self.updateButtons()
+                self.list.scrollRows(-1)
                 return True
             else:
                 return QWidget.event(self, event)
@@ -216,26 +604,101 @@ class MainScreen(QWidget):
             
             
 
-if __name__ == '__main__':
-    app = QApplication(argv)
+class Startup:
+    '''
+    Runs the program in a single event loop. The login window comes up
+    first, and while the master password is being typed the entries are
+    listed on a worker thread and the main window is built hidden behind it,
+    so unlocking only has to show it.
 
-    #Checks to be sure that there is a folder for passwords in appdata
-    if not dirExists(join(getenv('APPDATA'), 'PassManData')):
-            makedirs(join(getenv('APPDATA'), 'PassManData'))
+    Unless a vault is passed in, the one in directory (the data folder by
+    default) is opened once the login window has been shown, since loading
+    the vault module takes longer than everything before it.
 
-    #Attemps to find the master password hash and open the login window
-    Login = None
-    try:
-        open(join(join(getenv('APPDATA'), 'PassManData'),
-            'savedpassword'), 'rb').close()
+    The time from STARTED until the login window is up and from unlocking
+    until the list is usable are kept in timings, added to the tracing
+    histograms, and printed if PASSMAN_STARTUP_TIMES is set
+    '''
+    def __init__(self, vault=None, started=STARTED, directory=None):
+        self.vault = vault
+        self.started = started
+        self.main = None
+        self.files = None
+        self.timings = {}
 
-        login = LoginScreen()
-    except FileNotFoundError:
-        login = NewPasswordScreen()
+        if vault is None:
+            self.directory = directory or dataDir()
+            found = isVault(self.directory)
+        else:
+            found = vault.exists()
+        if found:
+            self.login = LoginScreen(vault)
+        else:
+            self.login = NewPasswordScreen(vault)
+        self.login.unlocked.connect(self.unlocked)
+        QTimer.singleShot(0, lambda: self.measure('prompt', self.started))
+        if vault is None:
+            QTimer.singleShot(0, self.openVault)
+        else:
+            self.startScan()
 
-    app.exec()
+    def openVault(self):
+        '''
+        Opens the vault once the login window is up. The window cannot be
+        used for those few moments, but anything typed into it is kept
+        '''
+        from vault import Vault
+        #Creates the data folder if needed
+        self.vault = Vault(self.directory)
+        self.login.vault = self.vault
+        self.startScan()
+
+    def startScan(self):
+        self.scanner = Worker(self.scan)
+        self.scanner.done.connect(lambda x: self.build())
+        self.scanner.start()
+
+    def scan(self):
+        """Lists and sorts the entries. Run on the worker thread"""
+        with tracing.span('startup.listing'):
+            self.files = EntryTable(self.vault.names())
+
+    def build(self):
+        if self.main is None:
+            self.main = MainScreen(self.vault, self.files, show=False)
 
-    password = login.password
+    def unlocked(self):
+        '''
+        Swaps the login window for the main one. If the password was entered
+        before the listing finished this waits for it
+        '''
+        unlockedAt = perf_counter()
+        if self.main is None:
+            self.scanner.wait()
+            self.build()
+        self.main.open()
+        QTimer.singleShot(0, lambda: self.measure('usable', unlockedAt))
+
+    def measure(self, name, since):
+        '''
+        Called from the event loop once the window in question has been
+        shown and painted
+        '''
+        now = perf_counter()
+        self.timings[name] = now - since
+        if tracing.enabled:
+            tracing.record('startup.' + name, since, now)
+        if getenv('PASSMAN_STARTUP_TIMES'):
+            print('startup %s: %.1f ms' % (name, self.timings[name] * 1000),
+                file=stderr)
+
+def isVault(directory):
+    """Checks if a master password has been set for the vault in directory"""
+    return exists(join(directory, RECORD_NAME))
 
-    main = MainScreen(password)
+if __name__ == '__main__':
+    from multiprocessing import freeze_support
+    freeze_support()
+    app = QApplication(argv)
+    startup = Startup()
     app.exec()
@@ -0,0 +1,433 @@
+'''
+Command line interface to the vault, for scripts that need to fetch secrets
+without the GUI. Only the vault modules are imported (no Qt), so it starts in
+a fraction of the time the GUI takes. When an agent answers, not even those
+are: each command imports what it uses, after the agent has been tried.
+
+python passmancli.py list
+python passmancli.py get NAME
+python passmancli.py put NAME      (the password is read from standard input)
+python passmancli.py update NAME   (keeps the old password in its history)
+python passmancli.py history NAME
+python passmancli.py delete NAME
+python passmancli.py attach NAME FILE [--label LABEL]
+python passmancli.py attachments NAME
+python passmancli.py extract NAME LABEL [--output FILE] [--offset N] [--length N]
+python passmancli.py detach NAME LABEL
+python passmancli.py import FILE      (a csv or json export, see importer.py)
+python passmancli.py export FILE
+python passmancli.py restore FILE
+python passmancli.py passwd          (changes the master password)
+python passmancli.py upgrade         (rewrites old entries in the current format)
+python passmancli.py verify          (checks that every entry decrypts)
+python passmancli.py audit [--json FILE]  (finds reused and weak passwords)
+python passmancli.py generate [--count N] [--length N] ...
+python passmancli.py agent [--background] [--idle-timeout SECONDS]
+python passmancli.py lock
+
+The master password is taken from the PASSMAN_PASSWORD environment variable,
+or asked for if that is not set. When an unlock agent is running (see
+agent.py), list and get are answered by it instead and need no password.
+Restoring into a folder with no vault makes a new one from the backup; into
+an existing vault it adds the backup's entries, using PASSMAN_BACKUP_PASSWORD
+as the backup's master password if it was made with a different one.
+'''
+
+from argparse import ArgumentParser
+from getpass import getpass
+from os import getenv
+import sys
+from sys import exit, stderr, stdin, stdout
+from time import localtime, strftime
+
+import agent
+
+def readPassword():
+    password = getenv('PASSMAN_PASSWORD')
+    if password is None:
+        password = getpass('Master password: ')
+    return password.encode()
+
+def openVault(args):
+    '''
+    Opens and unlocks the vault, exiting if that is not possible
+    '''
+    from vault import Vault
+    vault = Vault(args.data_dir)
+    if not vault.exists():
+        print('No master password has been set. Run the GUI first.',
+            file=stderr)
+        exit(1)
+
+    if not vault.unlock(readPassword()):
+        print('Incorrect master password', file=stderr)
+        exit(1)
+    return vault
+
+def listEntries(vault, args):
+    for name in sorted(vault.names()):
+        print(name)
+
+def getEntry(vault, args):
+    print(vault.get(args.name))
+
+def readSecret(name):
+    if stdin.isatty():
+        secret = getpass('Password for %s: ' % name)
+    else:
+        secret = stdin.readline().rstrip('\n')
+    if secret == '' or name == '':
+        print('The name and password cannot be empty', file=stderr)
+        exit(1)
+    return secret
+
+def putEntry(vault, args):
+    from vault import cleanTitle
+    name = cleanTitle(args.name)
+    vault.put(name, readSecret(name))
+
+def updateEntry(vault, args):
+    vault.update(args.name, readSecret(args.name))
+
+def showHistory(vault, args):
+    '''
+    Prints the earlier passwords of an entry, newest first, with the time
+    each one was replaced
+    '''
+    for when, secret in vault.revisions(args.name):
+        print('%s  %s' % (strftime('%Y-%m-%d %H:%M', localtime(when)),
+            secret))
+
+def deleteEntry(vault, args):
+    vault.delete(args.name)
+
+def attachFile(vault, args):
+    from attachments import attachPath
+    label, size = attachPath(vault, args.name, args.file, args.label)
+    print('Attached %s (%d bytes)' % (label, size))
+
+def listAttachments(vault, args):
+    for label, size in vault.attachments(args.name):
+        print('%12d  %s' % (size, label))
+
+def extractAttachment(vault, args):
+    '''
+    Writes an attachment, or a byte range of one, to a file or to standard
+    output
+    '''
+    if args.output and args.offset == 0 and args.length is None:
+        from attachments import extractTo
+        extractTo(vault, args.name, args.label, args.output)
+        return
+    with vault.openAttachment(args.name, args.label) as reader:
+        if args.offset == 0 and args.length is None:
+            reader.copyTo(stdout.buffer)
+            return
+        data = reader.read(args.offset, args.length)
+    if args.output:
+        with open(args.output, 'wb') as file:
+            file.write(data)
+    else:
+        stdout.buffer.write(data)
+
+def detachAttachment(vault, args):
+    vault.detach(args.name, args.label)
+
+def importEntries(vault, args):
+    from importer import importFile
+    report = importFile(vault, args.file, args.format)
+    for name in report.duplicates:
+        print('An entry named %s already exists' % name, file=stderr)
+    print(report.summary())
+
+def exportBackup(vault, args):
+    from backup import exportArchive
+    print('Backed up %d passwords' % exportArchive(vault, args.file))
+
+def restoreBackup(vault, args):
+    from backup import restoreArchive
+    password = getenv('PASSMAN_BACKUP_PASSWORD')
+    password = password.encode() if password else vault.password
+    print(restoreArchive(args.file, password, vault).summary())
+
+def restoreNew(args):
+    '''
+    Makes a new vault in the data folder from a backup
+    '''
+    from backup import restoreArchive
+    report = restoreArchive(args.file, readPassword(),
+        directory=args.data_dir)
+    print(report.summary())
+
+def changePassword(vault, args):
+    '''
+    Changes the master password. If this is interrupted the old password
+    keeps working, and running it again with the same new password resumes
+    '''
+    password = getenv('PASSMAN_NEW_PASSWORD')
+    if password is None:
+        password = getpass('New master password: ')
+        if getpass('New master password again: ') != password:
+            print('The passwords do not match', file=stderr)
+            exit(1)
+    if password == '':
+        print('The password cannot be empty', file=stderr)
+        exit(1)
+    from rotate import rotateMasterPassword
+    count = rotateMasterPassword(vault, password.encode())
+    print('Re-encrypted %d passwords' % count)
+
+def upgradeEntries(vault, args):
+    from upgrade import upgradeVault
+    report = upgradeVault(vault)
+    showFailures(report)
+    print(report.summary())
+
+def verifyEntries(vault, args):
+    from upgrade import verifyVault
+    report = verifyVault(vault)
+    showFailures(report)
+    print(report.summary())
+    if not report.ok():
+        exit(1)
+
+def auditEntries(vault, args):
+    from audit import auditVault
+    report = auditVault(vault)
+    for group in report.reused():
+        print('Same password: %s' % ', '.join(group))
+    for name, result in report.weak():
+        print('%s: %s, %s bits%s' % (name, result['rating'], result['bits'],
+            ''.join('; ' + x for x in result['problems'])))
+    for name, reason in report.failed():
+        print('%s: %s' % (name, reason), file=stderr)
+    if args.json:
+        report.writeJson(args.json)
+    print(report.summary())
+
+def showFailures(report):
+    for name in sorted(report.failed):
+        print('%s: %s' % (name, report.failed[name]), file=stderr)
+
+def runAgent(vault, args):
+    '''
+    Serves the unlocked vault until the agent is locked or times out. With
+    --background the agent forks off once the password has been checked
+    '''
+    from os import fork, setsid
+    server = agent.Agent(vault, idleTimeout=args.idle_timeout)
+    #Before forking, so a running agent is reported here
+    server.listen()
+    if args.background and fork():
+        exit(0)
+    if args.background:
+        setsid()
+    server.serve()
+
+def generatePasswords(args):
+    '''
+    Prints random passwords, one per line, without touching the vault
+    '''
+    from generator import Policy, generateMany
+    try:
+        policy = Policy(args.length, not args.no_letters, not args.no_digits,
+            not args.no_symbols, {'lower': args.min_lower,
+            'upper': args.min_upper, 'digits': args.min_digits,
+            'symbols': args.min_symbols}, args.no_lookalikes, args.exclude)
+    except ValueError as error:
+        print(error, file=stderr)
+        return 1
+    if args.entropy:
+        print(policy.report(), file=stderr)
+    print('\n'.join(generateMany(args.count, policy)))
+    return 0
+
+def fromAgent(args):
+    '''
+    Answers list and get with a running agent. Returns None if there is no
+    agent to ask
+    '''
+    if args.no_agent or args.command not in ('list', 'get', 'lock'):
+        return None
+    if not agent.isSupported():
+        return None
+    try:
+        client = agent.AgentClient()
+    except OSError:
+        return None
+
+    try:
+        if args.command == 'list':
+            for name in sorted(client.names()):
+                print(name)
+        elif args.command == 'get':
+            print(client.get(args.name))
+        else:
+            client.lock()
+    except FileNotFoundError:
+        print('No entry named %s' % args.name, file=stderr)
+        return 1
+    except agent.AgentError as error:
+        print(error, file=stderr)
+        return 1
+    finally:
+        client.close()
+    return 0
+
+def main(argv=None):
+    parser = ArgumentParser(prog='passman-cli',
+        description='Reads and writes PassMan entries')
+    parser.add_argument('--data-dir',
+        help='folder the vault is kept in, %%APPDATA%%/PassManData by default')
+    parser.add_argument('--no-agent', action='store_true',
+        help='unlock the vault here even if an agent is running')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    commands.add_parser('list', help='list the saved entries').set_defaults(
+        run=listEntries)
+    for name, run, description in (
+            ('get', getEntry, 'print the password saved under NAME'),
+            ('put', putEntry, 'save a new password under NAME'),
+            ('update', updateEntry, 'change the password saved under NAME'),
+            ('history', showHistory, 'print the earlier passwords of NAME'),
+            ('delete', deleteEntry, 'delete the entry saved under NAME')):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('name')
+        command.set_defaults(run=run)
+
+    command = commands.add_parser('attach',
+        help='attach FILE to the entry saved under NAME')
+    command.add_argument('name')
+    command.add_argument('file')
+    command.add_argument('--label', help='name of the attachment, the file '
+        'name by default')
+    command.set_defaults(run=attachFile)
+    command = commands.add_parser('attachments',
+        help='list the attachments of NAME')
+    command.add_argument('name')
+    command.set_defaults(run=listAttachments)
+    command = commands.add_parser('extract',
+        help='write out an attachment, or a byte range of it')
+    command.add_argument('name')
+    command.add_argument('label')
+    command.add_argument('--output', help='file to write, standard output '
+        'by default')
+    command.add_argument('--offset', type=int, default=0)
+    command.add_argument('--length', type=int)
+    command.set_defaults(run=extractAttachment)
+    command = commands.add_parser('detach',
+        help='delete an attachment of NAME')
+    command.add_argument('name')
+    command.add_argument('label')
+    command.set_defaults(run=detachAttachment)
+
+    command = commands.add_parser('import',
+        help='import the passwords in a csv or json export')
+    command.add_argument('file')
+    command.add_argument('--format', choices=('csv', 'json'),
+        help='format of the file, taken from its extension by default')
+    command.set_defaults(run=importEntries)
+
+    for name, run, description in (
+            ('export', exportBackup, 'write a backup archive of the vault'),
+            ('restore', restoreBackup, 'restore the entries in a backup')):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('file')
+        command.set_defaults(run=run)
+
+    commands.add_parser('passwd', help='change the master password'
+        ).set_defaults(run=changePassword)
+    commands.add_parser('upgrade',
+        help='rewrite every entry saved in an older format in the current one'
+        ).set_defaults(run=upgradeEntries)
+    commands.add_parser('verify',
+        help='check that every entry decrypts and authenticates'
+        ).set_defaults(run=verifyEntries)
+    command = commands.add_parser('audit',
+        help='find passwords that are reused or weak')
+    command.add_argument('--json', metavar='FILE',
+        help='also write the report to FILE, without any passwords')
+    command.set_defaults(run=auditEntries)
+
+    command = commands.add_parser('generate',
+        help='print random passwords without opening the vault')
+    command.add_argument('--count', type=int, default=1)
+    command.add_argument('--length', type=int, default=24)
+    for name in ('letters', 'digits', 'symbols', 'lookalikes'):
+        command.add_argument('--no-' + name, action='store_true')
+    for name in ('lower', 'upper', 'digits', 'symbols'):
+        command.add_argument('--min-' + name, type=int, default=0,
+            metavar='N')
+    command.add_argument('--exclude', default='',
+        help='characters to leave out')
+    command.add_argument('--entropy', action='store_true',
+        help='report the strength of the passwords on standard error')
+
+    command = commands.add_parser('agent',
+        help='start an unlock agent that answers list and get')
+    command.add_argument('--background', action='store_true')
+    command.add_argument('--idle-timeout', type=float,
+        default=agent.IDLE_TIMEOUT, help='seconds before the agent locks')
+    command.set_defaults(run=runAgent)
+    commands.add_parser('lock', help='stop the running unlock agent')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        return generatePasswords(args)
+    result = fromAgent(args)
+    if result is not None:
+        return result
+    if args.command == 'lock':
+        print('No unlock agent is running', file=stderr)
+        return 1
+
+    #Only once the agent could not answer
+    from vault import Vault, LockedError, WrongPasswordError
+    from backup import CorruptArchiveError
+    try:
+        if args.command == 'restore' and not Vault(args.data_dir).exists():
+            restoreNew(args)
+            return 0
+        vault = openVault(args)
+    except WrongPasswordError:
+        print('Incorrect master password', file=stderr)
+        return 1
+    except (CorruptArchiveError, OSError) as error:
+        print(error, file=stderr)
+        return 1
+
+    try:
+        args.run(vault, args)
+    except FileNotFoundError as error:
+        if hasattr(args, 'name') and not hasattr(args, 'label'):
+            print('No entry named %s' % args.name, file=stderr)
+        else:
+            print(error, file=stderr)
+        return 1
+    except FileExistsError as error:
+        if hasattr(args, 'label'):
+            print(error, file=stderr)
+        else:
+            print('An entry named %s already exists' % args.name, file=stderr)
+        return 1
+    except WrongPasswordError:
+        if args.command == 'restore':
+            print('Incorrect password for the backup', file=stderr)
+        else:
+            print('Unable to decode %s' % args.name, file=stderr)
+        return 1
+    except (CorruptArchiveError, LockedError, OSError, ValueError,
+        agent.AgentError) as error:
+        print(error, file=stderr)
+        return 1
+    finally:
+        vault.close()
+    return 0
+
+if __name__ == '__main__':
+    #Only frozen executables need it, and multiprocessing is slow to import
+    if getattr(sys, 'frozen', False):
+        from multiprocessing import freeze_support
+        freeze_support()
+    exit(main())
@@ -1,107 +1,224 @@
 '''
-Class for the password button that show what applications/websites have
-currently saved passwords.
+Classes for the list of password buttons that show what applications/websites
+have currently saved passwords. Only the rows that are on screen are drawn,
+each one painted to look like a flat button.
 '''
 
-from PyQt5.QtWidgets import QPushButton, QGraphicsDropShadowEffect, QMessageBox
-from PyQt5.QtGui import QFont
-from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtWidgets import (QListView, QStyledItemDelegate, QStyle, QMenu,
+    QMessageBox, QAbstractItemView, QApplication)
+from PyQt5.QtGui import QFont, QFontMetrics, QColor, QPen
+from PyQt5.QtCore import Qt, QSize
+from time import localtime, strftime
 
-from Crypto.Cipher import Salsa20
-from Crypto.Protocol.KDF import PBKDF2
+class PasswordDelegate(QStyledItemDelegate):
+    '''
+    Paints each row with the same look the password buttons used to have
+    '''
+    padding = 5
 
-from os import getenv, listdir, makedirs, remove
-from os.path import join, isfile
-from pyperclip import copy
-from codecs import decode
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.font = QFont("Arial", 18)
+        self.height = QFontMetrics(self.font).height() + self.padding * 2 + 1
 
-class PasswordButton(QPushButton):
-    def __init__(self, text, password, parent, **kwargs):
-        super().__init__()
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.height)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect
+
+        if self.view.pressedRow == index.row():
+            background = QColor('#404040')
+        elif option.state & QStyle.State_Selected:
+            background = QColor('#505050')
+        elif option.state & QStyle.State_MouseOver:
+            background = QColor('#444444')
+        else:
+            background = QColor('#333333')
+        painter.fillRect(rect, background)
+
+        painter.setPen(QPen(QColor('#555555'), 1))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+
+        painter.setPen(QColor('white'))
+        painter.setFont(self.font)
+        painter.drawText(rect.adjusted(self.padding, 0, -self.padding, -1),
+            Qt.AlignCenter, index.data(Qt.DisplayRole))
+        painter.restore()
 
-        passBtnStyle = """QPushButton {
-            background-color: #333333;
-            border-left: 0px solid black;
-            border-right: 0px solid black;
-            border-bottom: 1px solid #555555;
-            border-top: 0px solid #555555;
-            color: white;
-            padding: 5px;
-        }
-        QPushButton:hover {
-            background-color: #444444;
-        }
-        QPushButton:pressed {
-            background-color: #404040;
-        }
-        """
-
-        self.setText(text)
-        self.password = password
-        self.setFont(QFont("Arial", 18))
-        self.setShortcut('Ctrl-N')
-        self.setStyleSheet(passBtnStyle)
-        self.clicked.connect(self.loadPassword)
+class PasswordList(QListView):
+    def __init__(self, model, parent, **kwargs):
+        super().__init__()
         self.parent = parent
-        self.contextMenu = None
+        self.pressedRow = None
+
+        self.setModel(model)
+        self.setItemDelegate(PasswordDelegate(self))
+        #Every row is the same height, which lets the view work out what is
+        #on screen without asking about any of the other rows
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        #Ctrl and Shift clicks select entries to delete together
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setMouseTracking(True)
+        self.setStyleSheet("QListView { border: 0px; }")
+
+        self.clicked.connect(self.onClicked)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.onContextMenu)
+        self.verticalScrollBar().valueChanged.connect(
+            lambda x: self.parent.visibleEntriesChanged())
+
+    def visibleEntries(self):
+        """Returns the names of the entries that are currently on screen"""
+        model = self.model()
+        if model.rowCount() == 0:
+            return []
+        viewport = self.viewport().rect()
+        first = self.indexAt(viewport.topLeft()).row()
+        last = self.indexAt(viewport.bottomLeft()).row()
+        if first < 0:
+            return []
+        if last < 0:
+            last = model.rowCount() - 1
+        return [model.name(x) for x in range(first, last + 1)]
+
+    def scrollRows(self, rows):
+        """Scrolls the list by a number of rows"""
+        scrollBar = self.verticalScrollBar()
+        scrollBar.setValue(scrollBar.value()
+            + rows * self.itemDelegate().height)
 
-    def loadPassword(self, **kwargs):
+    def onClicked(self, index):
         '''
-        Gets the encrypted password that corresponds to the website/application
-        and copies the decrypted password to the clipboard
+        Copies the password of a plainly clicked entry. Clicks with Ctrl or
+        Shift held only change the selection
         '''
-        filename = self.text()
-        if (filename == "File not found" or
-            filename == "Password copied to clipboard" or 
-            filename == "Incorrect login password. Unable to decode"):
+        if QApplication.keyboardModifiers() & (Qt.ControlModifier
+            | Qt.ShiftModifier):
             return
-        try:
-            with open(join(join(getenv('APPDATA'), 'PassManData'), 
-            filename), 'rb') as file:
-                data = file.read()
-            nonce, salt, data = data[:8], data[8:24], data[24:]
-
-            derivedKey = PBKDF2(
-                self.password,
-                salt,
-                dkLen=32
-            )
-            cipher = Salsa20.new(derivedKey, nonce)
-            decrypted = cipher.decrypt(data)
-            copy(decode(decrypted, 'CP1252'))
-            self.setText('Password copied to clipboard')
-            QTimer.singleShot(2000, lambda: self.setText(filename))
-        except FileNotFoundError:
-            self.setText('File not found')
-            QTimer.singleShot(2000, lambda: self.setText(filename))
-        except UnicodeDecodeError:
-            self.setText('Incorrect login password. Unable to decode')
-            QTimer.singleShot(2000, lambda: self.setText(filename))
+        self.clearSelection()
+        self.loadPassword(index)
+
+    def selectedNames(self):
+        model = self.model()
+        return [model.name(x.row()) for x in self.selectedIndexes()]
+
+    def loadPassword(self, index):
+        '''
+        Asks for the password that corresponds to the website/application to
+        be decrypted. The main screen copies it to the clipboard once the
+        decryption service is done
+        '''
+        name = self.model().name(index.row())
+        if name in self.parent.statuses:
+            return
+        self.parent.decryptor.request(name)
 
     def onContextMenu(self, point):
         '''
         Handles right clicks
         '''
-        self.contextMenu.exec(self.mapToGlobal(point))
+        index = self.indexAt(point)
+        if not index.isValid():
+            return
+        #Right clicking a selected entry acts on the whole selection
+        if self.selectionModel().isSelected(index):
+            names = self.selectedNames()
+        else:
+            names = [self.model().name(index.row())]
+        contextMenu = QMenu()
+        if len(names) == 1:
+            name = names[0]
+            attachAct = contextMenu.addAction('Attach file...')
+            attachAct.triggered.connect(lambda x: self.parent.attachFile(name))
+            try:
+                labels = [x[0] for x in self.parent.vault.attachments(name)]
+            except (OSError, ValueError):
+                #A damaged or unreadable key file, which saving would fail on
+                #anyway
+                labels = []
+            if labels:
+                saveMenu = contextMenu.addMenu('Save attachment')
+                for label in labels:
+                    saveAct = saveMenu.addAction(label)
+                    saveAct.triggered.connect(
+                        lambda x, label=label: self.parent.saveAttachment(
+                            name, label))
+            changeAct = contextMenu.addAction('Change password...')
+            changeAct.triggered.connect(lambda x: self.parent.changeEntry(name))
+            revisions = self.parent.vault.history.records(name)
+            if revisions:
+                historyMenu = contextMenu.addMenu('Copy earlier password')
+                for number, (when, _) in enumerate(reversed(revisions)):
+                    historyAct = historyMenu.addAction(
+                        strftime('%Y-%m-%d %H:%M', localtime(when)))
+                    historyAct.triggered.connect(
+                        lambda x, number=number: self.parent.copyRevision(
+                            name, number))
+            deleteAct = contextMenu.addAction('Delete')
+        else:
+            deleteAct = contextMenu.addAction('Delete %d passwords' % len(names))
+        deleteAct.triggered.connect(lambda x: self.remove(names))
+        contextMenu.exec(self.viewport().mapToGlobal(point))
 
-    def remove(self, **kwargs):
+    def remove(self, filenames):
         '''
-        Handles removing the password corresponding to the buttons
-        website/application
+        Handles removing the passwords corresponding to the buttons
+        websites/applications
         '''
-        filename = self.text()
-        if (filename == "File not found" or
-            filename == "Password copied to clipboard" or 
-            filename == "Incorrect login password. Unable to decode"):
+        #Entries that are showing a status are busy being copied
+        filenames = [x for x in filenames if x not in self.parent.statuses]
+        if not filenames:
             return
         msg = QMessageBox()
-        msg.setText("Are you sure that you want to delete this password file?")
+        if len(filenames) == 1:
+            msg.setText("Are you sure that you want to delete this password file?")
+        else:
+            msg.setText("Are you sure that you want to delete these %d "
+                "password files?" % len(filenames))
         msg.setInformativeText("This action cannot be undone")
         msg.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         msg.setDefaultButton(QMessageBox.Cancel)
         ret = msg.exec()
 
         if ret == QMessageBox.Ok:
-            self.parent.files.remove(filename)
-            remove(join(join(getenv('APPDATA'), 'PassManData'), filename))
-            self.parent.updateButtons()
+            try:
+                self.parent.vault.deleteMany(filenames)
+            except (OSError, ValueError) as error:
+                self.parent.tray.showMessage("Password Manager",
+                    "Failed: %s" % error)
+                #Still take out the entries that went before it failed
+                try:
+                    remaining = set(self.parent.vault.names())
+                except OSError:
+                    return
+                filenames = [x for x in filenames if x not in remaining]
+            for filename in filenames:
+                self.parent.decryptor.forget(filename)
+            #Removing several entries resets the view, which should not lose
+            #the place in the list
+            scrollBar = self.verticalScrollBar()
+            position = scrollBar.value()
+            self.parent.removeEntries(filenames)
+            scrollBar.setValue(position)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.pressedRow = self.indexAt(event.pos()).row()
+            self.viewport().update()
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        self.pressedRow = None
+        self.viewport().update()
+        super().mouseReleaseEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.parent.visibleEntriesChanged()
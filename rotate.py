@@ -0,0 +1,388 @@
+'''
+Changing the master password. Every entry has to be re-encrypted under the
+new master key, which is spread over a process pool. The revisions in the
+entries' history logs and the key files of their attachments are too, but
+not the attachments' contents.
+
+The new vault is built in a staging folder (.rotate) next to the old one, in
+the same kind of store the vault already uses, while the old vault stays
+untouched and usable. Entries saved or deleted in the meantime are caught up
+with by comparing the store's stamps (see Store.stamps) with the ones each
+entry had when it was staged, and the last pass is made with the vault's
+writes held back until the swap is done. A journal file records how far the
+rotation got:
+
+    staging     the staging folder is being filled. Running the rotation
+                again with the same new password picks up where it stopped,
+                since the staged store already holds the finished entries
+    swapping    the staged files are complete and are being moved into
+                place. Opening the vault finishes the swap
+
+Once the journal says swapping, the new vault is the real one, so a crash at
+any point leaves either the old vault or the new one and never a mix. Every
+step of the swap can be repeated, and the journal goes last.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from json import dumps, loads
+from os import cpu_count, makedirs, remove, rename, replace
+from os.path import join, exists
+from itertools import islice
+from shutil import rmtree
+
+from attachments import stageAttachmentKeys, swapAttachmentKeys
+from history import stageHistory, swapHistory
+from keys import reencryptEntry, writeKeyCheck, KEYCHECK_NAME, KEYSALT_NAME
+from masterkey import createRecord, isCurrent, verify
+from shardstore import removeShards, ShardStore
+from sqlitestore import removeDatabase, SqliteStore
+from storage import (DirectoryStore, SHARDS_NAME, SQLITE_NAME, VAULT_NAME,
+    syncDirectory, writeAtomic)
+from vaultfile import VaultFile
+
+STAGING_NAME = '.rotate'
+JOURNAL_NAME = '.rotate.journal'
+RECORD_NAME = 'savedpassword'
+#In the staging folder: the entries of a vault in the flat layout, the
+#stamps the entries had when they were staged, and a mark left once the
+#old flat entries that were deleted during the rotation are gone
+ENTRIES_NAME = 'entries'
+STAMPS_NAME = 'stamps'
+MOVING_NAME = 'moving'
+
+STAGING = 'staging'
+SWAPPING = 'swapping'
+
+BATCH = 500
+#Passes over the entries saved during the rotation before the vault's
+#writes are held back for the last one
+MAX_PASSES = 5
+
+def readJournal(directory):
+    """Returns the state in the journal, or None if no rotation is underway"""
+    try:
+        with open(join(directory, JOURNAL_NAME)) as file:
+            return loads(file.read())['state']
+    except FileNotFoundError:
+        return None
+
+def writeJournal(directory, state):
+    '''
+    Records the rotation's state, on disk before it takes effect
+    '''
+    writeAtomic(join(directory, JOURNAL_NAME), dumps({'state': state}).encode())
+
+def recover(directory):
+    '''
+    Finishes a rotation that crashed while swapping the new vault into place.
+    Called whenever a vault is opened
+    '''
+    if readJournal(directory) == SWAPPING:
+        swap(directory)
+
+def stagedPath(store, staging):
+    """Returns where the entries of a vault with this store are staged"""
+    if isinstance(store, VaultFile):
+        return join(staging, VAULT_NAME)
+    if isinstance(store, SqliteStore):
+        return join(staging, SQLITE_NAME)
+    if isinstance(store, ShardStore):
+        return join(staging, SHARDS_NAME)
+    return join(staging, ENTRIES_NAME)
+
+def openStaged(store, staging):
+    '''
+    Opens a store of the same kind as the vault's in the staging folder
+    '''
+    path = stagedPath(store, staging)
+    if isinstance(store, VaultFile):
+        return VaultFile(path)
+    if isinstance(store, SqliteStore):
+        return SqliteStore(path)
+    if isinstance(store, ShardStore):
+        return ShardStore(staging, path)
+    makedirs(path, exist_ok=True)
+    return DirectoryStore(path)
+
+def clearFlat(directory, kept=()):
+    """Deletes the entry files of the flat layout, other than those in kept"""
+    old = DirectoryStore(directory)
+    kept = set(kept)
+    with old.group():
+        for name in old.names():
+            if name not in kept:
+                try:
+                    old.delete(name)
+                except FileNotFoundError:
+                    pass
+
+def swapEntries(staging, directory):
+    '''
+    Moves the staged entries over the vault's, for whichever kind of store
+    they were staged in
+    '''
+    staged = join(staging, VAULT_NAME)
+    if exists(staged):
+        #Older versions staged every vault as a vault file, which is what
+        #gets opened from now on, so the other backends go first
+        clearFlat(directory)
+        removeShards(directory)
+        removeDatabase(directory)
+        replace(staged, join(directory, VAULT_NAME))
+
+    staged = join(staging, SQLITE_NAME)
+    if exists(staged):
+        #The old database's log would be applied to the new one
+        for suffix in ('-wal', '-shm'):
+            if exists(join(directory, SQLITE_NAME + suffix)):
+                remove(join(directory, SQLITE_NAME + suffix))
+        replace(staged, join(directory, SQLITE_NAME))
+
+    staged = join(staging, SHARDS_NAME)
+    if exists(staged):
+        removeShards(directory)
+        rename(staged, join(directory, SHARDS_NAME))
+
+    staged = join(staging, ENTRIES_NAME)
+    if exists(staged):
+        moving = join(staging, MOVING_NAME)
+        #Which old entries were deleted can only be told while every staged
+        #one is still there
+        if not exists(moving):
+            clearFlat(directory, DirectoryStore(staged).names())
+            writeAtomic(moving, b'')
+        for name in DirectoryStore(staged).names():
+            replace(join(staged, name), join(directory, name))
+        syncDirectory(directory)
+        rmtree(staged)
+
+def swap(directory):
+    '''
+    Moves the staged vault into place and removes what is left of the old
+    one. Every step can be repeated, so a crash part way through is finished
+    by running this again
+    '''
+    staging = join(directory, STAGING_NAME)
+    if exists(staging):
+        if (exists(join(staging, KEYSALT_NAME)) and
+            not exists(join(staging, KEYCHECK_NAME)) and
+            exists(join(directory, KEYCHECK_NAME))):
+            #Staged by a version without key checks. The old one would not
+            #match the new key, and is made again at the next unlock
+            remove(join(directory, KEYCHECK_NAME))
+        swapEntries(staging, directory)
+        for name in (KEYSALT_NAME, KEYCHECK_NAME, RECORD_NAME):
+            if exists(join(staging, name)):
+                replace(join(staging, name), join(directory, name))
+        with open(join(directory, RECORD_NAME), 'rb') as file:
+            current = isCurrent(file.read())
+        if current and exists(join(directory, KEYSALT_NAME)):
+            #The new master key comes from the new record
+            remove(join(directory, KEYSALT_NAME))
+        swapAttachmentKeys(staging, directory)
+        swapHistory(staging, directory)
+        syncDirectory(directory)
+        #Only files that were not moved are left
+        rmtree(staging)
+    #Last, so that until it is gone opening the vault runs the swap again
+    if exists(join(directory, JOURNAL_NAME)):
+        remove(join(directory, JOURNAL_NAME))
+    syncDirectory(directory)
+
+def reencryptBatch(oldMasterKey, oldPassword, newMasterKey, entries):
+    '''
+    Decrypts entries under the old key and encrypts them under the new one,
+    moving older formats to the current one. Run in the worker processes
+    '''
+    return [reencryptEntry(x, oldMasterKey, oldPassword, newMasterKey)
+        for x in entries]
+
+def prepareStaging(store, directory, newPassword, n):
+    '''
+    Creates the staging folder with the new master password record, or
+    reuses the one left by an interrupted rotation to the same
+    password of the same kind of store. Returns the new master key
+    '''
+    staging = join(directory, STAGING_NAME)
+    recordPath = join(staging, RECORD_NAME)
+    if (readJournal(directory) == STAGING and exists(recordPath) and
+        exists(stagedPath(store, staging))):
+        with open(recordPath, 'rb') as file:
+            masterKey, upgraded = verify(newPassword, file.read())
+        #A record staged by an older version gives no master key of its own
+        if masterKey is not None and upgraded is None:
+            writeKeyCheck(staging, masterKey)
+            return masterKey
+
+    #Nothing to resume, or it was a rotation to a different password or of
+    #a vault since moved to another store
+    if exists(staging):
+        rmtree(staging)
+    makedirs(staging)
+    record, masterKey = createRecord(newPassword, n)
+    writeKeyCheck(staging, masterKey)
+    writeAtomic(recordPath, record)
+    writeJournal(directory, STAGING)
+    return masterKey
+
+def currentStamps(store):
+    """Returns the store's stamps as they read back from the stamps file"""
+    return loads(dumps(store.stamps()))
+
+def loadStamps(staging):
+    '''
+    Returns the stamps the staged entries had in the vault when they were
+    staged. A line cut off by a crash is skipped, and its entry staged again
+    '''
+    try:
+        with open(join(staging, STAMPS_NAME), 'rb') as file:
+            lines = file.read().split(b'\n')
+    except FileNotFoundError:
+        return {}
+    stamps = {}
+    for line in lines[:-1]:
+        try:
+            name, stamp = loads(line.decode())
+        except ValueError:
+            continue
+        stamps[name] = stamp
+    return stamps
+
+def saveStamps(staging, stamps):
+    """Adds the (name, stamp) of entries that were just staged"""
+    with open(join(staging, STAMPS_NAME), 'a') as file:
+        file.write(''.join(dumps([x, y]) + '\n' for x, y in stamps))
+
+def putStaged(staged, entries):
+    """Saves re-encrypted entries, replacing any staged before"""
+    entries = dict(entries)
+    with staged.group():
+        for name in staged.createMany(list(entries.items())):
+            staged.write(name, entries[name])
+
+def stageEntries(vault, staged, staging, newMasterKey, workers):
+    '''
+    Re-encrypts a snapshot of the vault's entries into the staged store,
+    other than those an interrupted run staged that are unchanged since.
+    Returns the number of entries re-encrypted
+    '''
+    #Taken before the snapshot, so an entry saved in between shows as changed
+    stamps = currentStamps(vault.store)
+    copied = loadStamps(staging)
+    snapshot = vault.snapshot()
+    count = 0
+    try:
+        current = snapshot.names()
+        existing = set(staged.names())
+        #Entries deleted from the old vault since an interrupted run
+        with staged.group():
+            for name in existing - set(current):
+                staged.delete(name)
+        done = set(x for x in existing
+            if stamps.get(x) is not None and copied.get(x) == stamps[x])
+        remaining = iter([x for x in current if x not in done])
+
+        workers = workers or cpu_count() or 1
+        pending = deque()
+        def finish(names, future):
+            putStaged(staged, zip(names, future.result()))
+            saveStamps(staging, [(x, stamps.get(x)) for x in names])
+
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                names = list(islice(remaining, BATCH))
+                if not names:
+                    break
+                entries = [snapshot.read(x) for x in names]
+                names = [x for x, y in zip(names, entries) if y is not None]
+                entries = [x for x in entries if x is not None]
+                pending.append((names, pool.submit(reencryptBatch,
+                    vault.masterKey, vault.password, newMasterKey, entries)))
+                count += len(names)
+                #A bounded number of batches in flight keeps memory flat
+                if len(pending) >= workers * 2:
+                    finish(*pending.popleft())
+            while pending:
+                finish(*pending.popleft())
+        staged.sync()
+    finally:
+        snapshot.close()
+    return count
+
+def catchUp(vault, staged, staging, newMasterKey):
+    '''
+    Re-encrypts the entries saved since they were staged, along with their
+    history logs, and removes the staged copies of entries deleted since.
+    Returns the number of entries re-encrypted
+    '''
+    stamps = currentStamps(vault.store)
+    copied = loadStamps(staging)
+    deleted = [x for x in staged.names() if x not in stamps]
+    names = []
+    entries = []
+    for name, stamp in stamps.items():
+        if copied.get(name) == stamp:
+            continue
+        try:
+            entries.append(vault.store.read(name))
+        except FileNotFoundError:
+            continue
+        names.append(name)
+    with staged.group():
+        for name in deleted:
+            staged.delete(name)
+    if names:
+        putStaged(staged, zip(names, reencryptBatch(vault.masterKey,
+            vault.password, newMasterKey, entries)))
+        saveStamps(staging, [(x, stamps[x]) for x in names])
+        stageHistory(vault.directory, staging, vault.masterKey,
+            vault.password, newMasterKey, names)
+    staged.sync()
+    return len(names)
+
+def rotateMasterPassword(vault, newPassword, workers=None, n=None):
+    '''
+    Changes the master password of an unlocked vault, re-encrypting every
+    entry. The vault is left unlocked with the new password. Returns the
+    number of entries that were re-encrypted by this run
+    '''
+    vault.checkUnlocked()
+    directory = vault.directory
+    staging = join(directory, STAGING_NAME)
+    newMasterKey = prepareStaging(vault.store, directory, newPassword, n)
+    staged = openStaged(vault.store, staging)
+    try:
+        count = stageEntries(vault, staged, staging, newMasterKey, workers)
+        #Attachments keep their contents, only their keys are re-encrypted
+        stageAttachmentKeys(directory, staging, vault.masterKey, newMasterKey)
+        stageHistory(directory, staging, vault.masterKey, vault.password,
+            newMasterKey)
+        for _ in range(MAX_PASSES):
+            caught = catchUp(vault, staged, staging, newMasterKey)
+            if not caught:
+                break
+            count += caught
+    except BaseException:
+        staged.close()
+        raise
+
+    #Saves wait from the last pass until the new vault is in place, in every
+    #process with the vault open
+    with vault.writeLock:
+        try:
+            #Another process changed the master password first
+            vault.checkWritable()
+            count += catchUp(vault, staged, staging, newMasterKey)
+            stageAttachmentKeys(directory, staging, vault.masterKey,
+                newMasterKey)
+        finally:
+            staged.close()
+        #The point of no return: from here on opening the vault finishes
+        #the swap
+        vault.store.close()
+        writeJournal(directory, SWAPPING)
+        swap(directory)
+        vault.reopen()
+        vault.setUnlocked(newPassword, newMasterKey)
+    return count
@@ -0,0 +1,227 @@
+'''
+In-memory search index over entry names, used by the search box on the main
+screen.
+
+Results are ranked in tiers: names starting with the query, then names with
+another word starting with it, then names containing it anywhere, and then
+(when nothing matched so far) names that share most of the query's trigrams.
+Each tier is only looked at if the ones before it did not fill the result
+limit, so the common case never touches more than a few hundred names:
+
+- Names, and the part of each name from every later word onward, are kept in
+  sorted lists so the first two tiers are found with binary searches.
+- Every name is indexed by the bigrams and trigrams it contains, so the other
+  tiers only look at names that share the query's n-grams.
+
+The index is updated one name at a time as entries are added and removed.
+Building it allocates millions of containers, so buildIndex pauses the
+garbage collector while it runs rather than have it start collection after
+collection over objects that are all still in use.
+'''
+
+from bisect import bisect_left, insort
+from collections import Counter
+from gc import disable, enable, isenabled
+
+#How many results a search returns
+RESULT_LIMIT = 500
+#Fuzzy matches are only looked for when nothing matches exactly, and are
+#skipped when the query's trigrams are too common to narrow the names down to
+#fewer than FUZZY_CANDIDATES
+FUZZY_CANDIDATES = 5000
+#Separates a word suffix from the name it came from in the word list. Names
+#only contain letters, digits and spaces, and this sorts before all of them
+SEPARATOR = '\x00'
+END = '\U0010ffff'
+
+def ngrams(text):
+    """Returns the bigrams and trigrams in an already lower cased string"""
+    grams = {text[i:i+3] for i in range(len(text) - 2)}
+    grams.update(text[i:i+2] for i in range(len(text) - 1))
+    return grams
+
+def queryGrams(query):
+    """Returns the n-grams used to look up candidates for a query"""
+    if len(query) >= 3:
+        return {query[i:i+3] for i in range(len(query) - 2)}
+    if len(query) == 2:
+        return {query}
+    return set()
+
+def wordSuffixes(lowered):
+    """Returns the part of the name from each word after the first one on"""
+    return [lowered[i+1:] + SEPARATOR + lowered
+        for i in range(len(lowered) - 1)
+        if lowered[i] == ' ' and lowered[i+1] != ' ']
+
+def buildIndex(names):
+    '''
+    Builds an index over names with the garbage collector paused. Slow for
+    large vaults, so it is run on a worker thread
+    '''
+    enabled = isenabled()
+    disable()
+    try:
+        return SearchIndex(names)
+    finally:
+        if enabled:
+            enable()
+
+def scanNames(names, query, limit=RESULT_LIMIT):
+    '''
+    Returns up to limit names containing query, in the order given. Used
+    while the index is still being built
+    '''
+    query = query.strip().lower()
+    results = []
+    for name in names:
+        if query in name.lower():
+            results.append(name)
+            if len(results) >= limit:
+                break
+    return results
+
+class SearchIndex:
+    def __init__(self, names=()):
+        #Lower cased name -> the names with that lower case form
+        self.names = {}
+        #Trigram or bigram -> set of lower cased names that contain it
+        self.postings = {}
+        self.count = 0
+        for name in names:
+            self.names.setdefault(name.lower(), []).append(name)
+            self.count += 1
+
+        self.sortedNames = sorted(self.names)
+        self.sortedWords = []
+        for lowered in self.sortedNames:
+            self.sortedWords.extend(wordSuffixes(lowered))
+            self.indexGrams(lowered)
+        self.sortedWords.sort()
+
+    def __len__(self):
+        return self.count
+
+    def indexGrams(self, lowered):
+        postings = self.postings
+        for gram in ngrams(lowered):
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = {lowered}
+            else:
+                posting.add(lowered)
+
+    def add(self, name):
+        """Adds a name to the index"""
+        lowered = name.lower()
+        self.count += 1
+        if lowered in self.names:
+            self.names[lowered].append(name)
+            return
+        self.names[lowered] = [name]
+        insort(self.sortedNames, lowered)
+        for suffix in wordSuffixes(lowered):
+            insort(self.sortedWords, suffix)
+        self.indexGrams(lowered)
+
+    def remove(self, name):
+        """Removes a name from the index"""
+        lowered = name.lower()
+        sameName = self.names.get(lowered)
+        if sameName is None or name not in sameName:
+            return
+        self.count -= 1
+        sameName.remove(name)
+        if sameName:
+            return
+        del self.names[lowered]
+        del self.sortedNames[bisect_left(self.sortedNames, lowered)]
+        for suffix in wordSuffixes(lowered):
+            del self.sortedWords[bisect_left(self.sortedWords, suffix)]
+        for gram in ngrams(lowered):
+            posting = self.postings[gram]
+            posting.discard(lowered)
+            if not posting:
+                del self.postings[gram]
+
+    def search(self, query, limit=RESULT_LIMIT):
+        '''
+        Returns up to limit names that match query, best matches first
+        '''
+        query = query.strip().lower()
+        if not query:
+            return self.expand(self.sortedNames[:limit])
+
+        results = []
+        seen = set()
+        def take(matches):
+            for x in matches:
+                if x not in seen:
+                    seen.add(x)
+                    results.append(x)
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        #Names starting with the query, then names with a later word starting
+        #with it. Both sit next to each other in their sorted lists
+        start = bisect_left(self.sortedNames, query)
+        end = bisect_left(self.sortedNames, query + END, start)
+        if take(self.sortedNames[start:min(end, start + limit)]):
+            return self.expand(results)
+
+        start = bisect_left(self.sortedWords, query)
+        end = bisect_left(self.sortedWords, query + END, start)
+        if take(x.split(SEPARATOR, 1)[1]
+            for x in self.sortedWords[start:end]):
+            return self.expand(results)
+
+        #Names containing the query anywhere else
+        grams = queryGrams(query)
+        if grams:
+            postings = sorted((self.postings.get(x, ()) for x in grams),
+                key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            candidates.difference_update(seen)
+            if take(sorted(x for x in candidates if query in x)):
+                return self.expand(results)
+        elif take(x for x in self.sortedNames if query in x):
+            return self.expand(results)
+
+        if not results and len(grams) > 1:
+            take(self.fuzzy(grams, seen, limit))
+        return self.expand(results)
+
+    def fuzzy(self, grams, exclude, limit):
+        '''
+        Returns names that share at least two thirds of the query's trigrams,
+        the ones sharing the most first. Any such name has to contain one of
+        the rarest (count - needed + 1) trigrams, so only those postings are
+        used to find candidates
+        '''
+        needed = max(2, -(-2 * len(grams) // 3))
+        postings = sorted((self.postings.get(x, set()) for x in grams), key=len)
+        candidates = set().union(*postings[:len(postings) - needed + 1])
+        candidates.difference_update(exclude)
+        if not candidates or len(candidates) > FUZZY_CANDIDATES:
+            return []
+
+        counts = Counter()
+        for posting in postings:
+            counts.update(candidates.intersection(posting))
+        byCount = {}
+        for x, count in counts.items():
+            if count >= needed:
+                byCount.setdefault(count, []).append(x)
+
+        matches = []
+        for count in sorted(byCount, reverse=True):
+            matches.extend(sorted(byCount[count])[:limit - len(matches)])
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def expand(self, lowered):
+        """Turns lower cased names back into the names that were added"""
+        names = self.names
+        return [name for x in lowered for name in names[x]]
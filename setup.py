@@ -26,4 +26,5 @@ setup(  name = "PassMan",
         version = "0.1",
         description = "Password Manager",
         options = {"build_exe": build_exe_options},
-        executables = [Executable("passman.py", base=base, icon='icon.ico')])
+        executables = [Executable("passman.py", base=base, icon='icon.ico'),
+            Executable("passmancli.py", targetName="passman-cli")])
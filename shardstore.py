@@ -0,0 +1,481 @@
+'''
+Sharded layout for very large vaults. Entries are kept under .shards in the
+data folder, spread over 256 subfolders by a hash of their names, so no one
+folder grows past a small share of the vault and entry names no longer share
+a folder with the program's own files.
+
+Each entry file is named by the hash of the entry's name and starts with the
+name itself, followed by the stored bytes. The names file in .shards is a log
+that maps hashes back to names, so that listing reads one file instead of
+every folder. Saves append a line with the hash and name, deletions one with
+the hash alone, and listing appends the modification time of each shard
+folder it found the log to be complete for. A later listing takes the names
+of a shard from the log as long as the folder's time is unchanged, and scans
+only the folders that changed since, reading the names of entries missing
+from the log from their own files. Times less than RACY_SECONDS old are not
+trusted, since a file system with coarse times could give the same time to a
+later change. The log is only a cache, appended to without syncing, and
+saves rewrite it without the lines that no longer count once it grows too
+large.
+
+Run this file directly to move a PassManData folder into the sharded layout.
+This can be done while PassMan is running: entries saved or deleted during
+the move are caught up with before it switches over, and entries another
+process still saves or deletes in the old layout are picked up the next time
+the vault is opened. Its deletions leave tombstones in .shards/deleted, see
+DirectoryStore.delete.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import listdir, makedirs, remove, rename, scandir, stat
+from os.path import join, exists
+from shutil import rmtree
+from struct import Struct
+from threading import Lock
+from time import time
+
+from storage import (dataDir, removeStaleTemporary, syncDirectory,
+    writeAtomic, DirectoryStore, DELETED_NAME, SHARDS_NAME, SQLITE_NAME, STALE_SECONDS,
+    TEMP_PREFIX, VAULT_NAME)
+
+NAMES_NAME = 'names'
+NAME_LENGTH = Struct('<H')
+SHARDS = ['%02x' % x for x in range(256)]
+#Hex digits of the name hash used for file names
+HASH_LENGTH = 32
+#Threads listing shard folders at once, when there are enough to scan
+SCAN_WORKERS = 8
+#The names file is rewritten once this many lines were appended to it
+NAMES_SLACK = 1000
+#Lines with the time of a shard folder start with this instead of a hash
+STAMP_PREFIX = '#'
+#First line of a names file rewritten by compactNames
+COMPACT_HEADER = '#names'
+#How old a shard folder's time has to be before the names file relies on it
+RACY_SECONDS = 2
+#Catch up passes the migration makes before switching over regardless
+MAX_PASSES = 5
+
+def hashName(name):
+    return sha256(name.encode()).hexdigest()[:HASH_LENGTH]
+
+def nameLine(name):
+    return '%s\t%s\n' % (hashName(name), name)
+
+class NamesFile:
+    '''
+    The contents of a names file: the part last rewritten by compactNames,
+    kept as each shard folder's time, hashes and names, and the lines
+    appended after it. Appended lines torn by a crash are skipped
+    '''
+    def __init__(self, contents):
+        lines = contents.decode('utf-8', 'replace').split('\n')
+        #Shard folder -> (time or None, hashes run together, names)
+        self.sections = {}
+        position = self.readSections(lines)
+        #Shard folder -> {hash: name, or '' for a deleted entry}
+        self.appended = {}
+        self.stamps = {}
+        self.appendedLines = len(lines) - 1 - position
+        #A line torn by a crash is either the last one, with no newline
+        #after it, or runs into the next one and has a second tab or a key
+        #that is neither a hash nor a shard folder
+        for line in lines[position:-1]:
+            key, tab, value = line.partition('\t')
+            if not tab or '\t' in value:
+                continue
+            if key.startswith(STAMP_PREFIX):
+                if key[1:] in SHARDS and value.isdigit():
+                    self.stamps[key[1:]] = int(value)
+            elif len(key) == HASH_LENGTH and key.isalnum():
+                self.appended.setdefault(key[:2], {})[key] = value
+
+    def readSections(self, lines):
+        '''
+        Reads the rewritten part, if there is one, and returns the number of
+        lines it takes up. Each shard folder has a line with its time and
+        number of entries, a line of their hashes and a line for each name
+        '''
+        header = lines[0].split('\t')
+        if header[0] != COMPACT_HEADER:
+            return 0
+        try:
+            position = 1
+            for _ in range(int(header[1])):
+                shard, when, size = lines[position].split('\t')
+                size = int(size)
+                hashes = lines[position + 1]
+                names = lines[position + 2:position + 2 + size]
+                if (len(names) != size or len(hashes) != size * HASH_LENGTH
+                    or shard[1:] not in SHARDS):
+                    raise ValueError('Damaged names file')
+                self.sections[shard[1:]] = (int(when) if when else None,
+                    hashes, names)
+                position += 2 + size
+        except (IndexError, ValueError):
+            #Nothing in it is relied on, so every folder is scanned
+            self.sections = {}
+            return 0
+        return position
+
+    def stamp(self, shard):
+        """Returns the last time recorded for a shard folder, or None"""
+        if shard in self.stamps:
+            return self.stamps[shard]
+        return self.sections.get(shard, (None,))[0]
+
+    def entries(self, shard):
+        """Returns a dictionary of hash to name for a shard folder"""
+        _, hashes, names = self.sections.get(shard, (None, '', []))
+        entries = dict(zip([hashes[x:x + HASH_LENGTH]
+            for x in range(0, len(hashes), HASH_LENGTH)], names))
+        for hashed, name in self.appended.get(shard, {}).items():
+            if name:
+                entries[hashed] = name
+            else:
+                entries.pop(hashed, None)
+        return entries
+
+    def names(self, shard):
+        """Returns the names of the entries in a shard folder"""
+        if shard not in self.appended:
+            return self.sections.get(shard, (None, '', []))[2]
+        return list(self.entries(shard).values())
+
+    def pack(self):
+        """Returns the whole file rewritten with no appended lines"""
+        parts = ['%s\t%d\n' % (COMPACT_HEADER, len(SHARDS))]
+        for shard in SHARDS:
+            entries = self.entries(shard)
+            when = self.stamp(shard)
+            parts.append('%s%s\t%s\t%d\n%s\n' % (STAMP_PREFIX, shard,
+                '' if when is None else when, len(entries), ''.join(entries)))
+            parts.extend(x + '\n' for x in entries.values())
+        return ''.join(parts).encode()
+
+def modifiedAt(path):
+    """Returns when a file was last written, or None if it is gone"""
+    try:
+        return stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+class ShardStore(DirectoryStore):
+    '''
+    Entry store with every entry in its own file under .shards. Only where
+    the files are kept differs from DirectoryStore
+    '''
+    def __init__(self, directory, root=None):
+        super().__init__(directory)
+        self.root = root or join(directory, SHARDS_NAME)
+        self.namesPath = join(self.root, NAMES_NAME)
+        #Appends and rewrites of the names file by this process take turns
+        self.namesLock = Lock()
+        #Set by listing when the names file should be rewritten smaller
+        self.compactDue = False
+        #The last shard folder is made last, so its absence means the layout
+        #was never finished
+        if not exists(join(self.root, SHARDS[-1])):
+            for shard in SHARDS:
+                makedirs(join(self.root, shard), exist_ok=True)
+            syncDirectory(self.root)
+            syncDirectory(directory)
+        if root is None:
+            self.adoptFlat()
+
+    def path(self, name):
+        hashed = hashName(name)
+        return join(self.root, hashed[:2], hashed)
+
+    def encode(self, name, data):
+        encodedName = name.encode()
+        return NAME_LENGTH.pack(len(encodedName)) + encodedName + data
+
+    def decode(self, contents):
+        length, = NAME_LENGTH.unpack_from(contents)
+        return contents[NAME_LENGTH.size + length:]
+
+    def bury(self, name):
+        return False
+
+    def saved(self, names):
+        if names:
+            self.appendNames(''.join(nameLine(x) for x in names))
+
+    def removeFile(self, name):
+        super().removeFile(name)
+        self.appendNames('%s\t\n' % hashName(name))
+
+    def appendNames(self, lines):
+        '''
+        Appends lines to the names file in one write, first rewriting it
+        without the lines that no longer count if listing asked for that
+        '''
+        with self.namesLock:
+            if self.compactDue:
+                self.compactDue = False
+                self.compactNames()
+            with open(self.namesPath, 'ab', buffering=0) as file:
+                file.write(lines.encode())
+
+    def compactNames(self):
+        '''
+        Rewrites the names file with only the last line for each entry that
+        is left and each shard folder. Lines another process appends while
+        this runs may be lost, but the times of the folders they were about
+        will have changed, so those folders are scanned again
+        '''
+        try:
+            with open(self.namesPath, 'rb') as file:
+                contents = NamesFile(file.read())
+        except FileNotFoundError:
+            return
+        writeAtomic(self.namesPath, contents.pack())
+
+    def readName(self, hashed):
+        """Returns the name stored in an entry file, or None if it is gone"""
+        try:
+            with open(join(self.root, hashed[:2], hashed), 'rb') as file:
+                length, = NAME_LENGTH.unpack(file.read(NAME_LENGTH.size))
+                return file.read(length).decode()
+        except FileNotFoundError:
+            return None
+
+    def scanShards(self, shards):
+        '''
+        Returns the hashes of the entries in some shard folders, removing
+        temporary files left there by a crash, and the folders that still
+        have temporary files in them
+        '''
+        hashes = []
+        busy = set()
+        cutoff = time() - STALE_SECONDS
+        for shard in shards:
+            for entry in scandir(join(self.root, shard)):
+                if not entry.name.startswith(TEMP_PREFIX):
+                    hashes.append(entry.name)
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        remove(entry.path)
+                    else:
+                        busy.add(shard)
+                except FileNotFoundError:
+                    pass
+        return hashes, busy
+
+    def scan(self, shards):
+        '''
+        Returns what scanShards does for the given shard folders, listing
+        them in parallel if there are many
+        '''
+        if len(shards) <= SCAN_WORKERS:
+            return self.scanShards(shards)
+        #scandir releases the GIL, so each thread takes an even share
+        share = -(-len(shards) // SCAN_WORKERS)
+        hashes = []
+        busy = set()
+        with ThreadPoolExecutor(SCAN_WORKERS) as pool:
+            for found, unfinished in pool.map(self.scanShards,
+                [shards[x:x + share] for x in range(0, len(shards), share)]):
+                hashes += found
+                busy |= unfinished
+        return hashes, busy
+
+    def names(self):
+        '''
+        Returns the names of all of the saved entries, from the names file
+        for the shard folders that have not changed since it was last found
+        complete for them, and by scanning the others
+        '''
+        #What is found is appended through the file it was read from, so if
+        #a save rewrote the file in the meantime it goes nowhere
+        with open(self.namesPath, 'a+b', buffering=0) as file:
+            file.seek(0)
+            saved = NamesFile(file.read())
+            current = {x: modifiedAt(join(self.root, x)) for x in SHARDS}
+            changed = [x for x in SHARDS if current[x] != saved.stamp(x)]
+
+            names = []
+            unchanged = set(SHARDS) - set(changed)
+            for shard in SHARDS:
+                if shard in unchanged:
+                    names += saved.names(shard)
+            known = {}
+            for shard in changed:
+                known.update(saved.entries(shard))
+            hashes, busy = self.scan(changed)
+            found = []
+            for hashed in hashes:
+                name = known.get(hashed)
+                if name is None:
+                    name = self.readName(hashed)
+                    if name is None:
+                        continue
+                    found.append(nameLine(name))
+                names.append(name)
+            #Entries deleted without a line saying so, by a crash or an
+            #older version
+            hashes = set(hashes)
+            found += ['%s\t\n' % x for x in known if x not in hashes]
+
+            #Times recorded before a folder was scanned, which a change
+            #during the scan would not match
+            racy = (time() - RACY_SECONDS) * 1e9
+            found += ['%s%s\t%d\n' % (STAMP_PREFIX, x, current[x])
+                for x in changed if x not in busy and current[x] < racy]
+            if found:
+                file.write(''.join(found).encode())
+        if saved.appendedLines + len(found) > NAMES_SLACK:
+            self.compactDue = True
+        return names
+
+    def stamps(self):
+        stamps = {}
+        for name in self.names():
+            try:
+                info = stat(self.path(name))
+            except FileNotFoundError:
+                continue
+            stamps[name] = (info.st_mtime_ns, info.st_size)
+        return stamps
+
+    def watchPaths(self):
+        return [join(self.root, x) for x in SHARDS]
+
+    def adoptFlat(self):
+        '''
+        Brings in what a process that still had the vault open in the old
+        layout did: entry files it saved in the data folder itself are moved
+        into the shards, and entries it deleted are deleted. Either only
+        happens if the entry was not saved again in the shards afterwards
+        '''
+        flat = DirectoryStore(self.directory)
+        names = flat.names()
+        deletedFolder = join(self.root, DELETED_NAME)
+        try:
+            removeStaleTemporary(deletedFolder)
+            deleted = [x for x in listdir(deletedFolder)
+                if not x.startswith(TEMP_PREFIX)]
+        except FileNotFoundError:
+            deleted = []
+        if not names and not deleted:
+            return
+
+        with self.group():
+            for name in deleted:
+                buried = modifiedAt(join(deletedFolder, name))
+                saved = modifiedAt(self.path(name))
+                if buried is None or saved is None or saved > buried:
+                    continue
+                try:
+                    self.delete(name)
+                except FileNotFoundError:
+                    pass
+            for name in names:
+                adopted = modifiedAt(flat.path(name))
+                saved = modifiedAt(self.path(name))
+                if adopted is None or (saved is not None and saved > adopted):
+                    #Older than the copy in the shards
+                    continue
+                try:
+                    self.write(name, flat.read(name))
+                except FileNotFoundError:
+                    continue
+
+        with flat.group():
+            for name in names:
+                try:
+                    flat.removeFile(name)
+                except FileNotFoundError:
+                    pass
+        for name in deleted:
+            try:
+                remove(join(deletedFolder, name))
+            except FileNotFoundError:
+                pass
+
+def removeShards(directory):
+    """Removes the sharded layout's folder, once its entries are elsewhere"""
+    root = join(directory, SHARDS_NAME)
+    if exists(root):
+        rmtree(root)
+        syncDirectory(directory)
+
+def catchUp(old, new, copied):
+    '''
+    Copies flat entries that are new or changed since they were last copied
+    into the sharded store, and deletes the ones that were deleted. copied
+    maps each copied name to the stamp it had. Returns whether anything was
+    done
+    '''
+    current = old.stamps()
+    changed = False
+    with new.group():
+        for name, stamp in current.items():
+            if copied.get(name) == stamp:
+                continue
+            try:
+                data = old.read(name)
+            except FileNotFoundError:
+                continue
+            new.write(name, data)
+            copied[name] = stamp
+            changed = True
+        for name in [x for x in copied if x not in current]:
+            new.delete(name)
+            del copied[name]
+            changed = True
+    return changed
+
+def migrateToShards(directory=None, vault=None):
+    '''
+    Moves the entries of a flat data folder into the sharded layout while it
+    stays in use. The shards are filled in a staging folder, passes over the
+    flat files copy whatever was saved, changed or deleted in the meantime,
+    and the staging folder is renamed into place once a pass finds nothing
+    to do. A vault passed in is switched to the new layout right away.
+    Returns the number of entries moved
+    '''
+    directory = directory or dataDir()
+    root = join(directory, SHARDS_NAME)
+    if exists(root):
+        raise FileExistsError(root)
+    for existing in (VAULT_NAME, SQLITE_NAME):
+        if exists(join(directory, existing)):
+            raise FileExistsError(join(directory, existing))
+
+    staging = root + '.migrate'
+    if exists(staging):
+        rmtree(staging)
+    old = DirectoryStore(directory)
+    copied = {}
+    new = ShardStore(directory, staging)
+    for _ in range(MAX_PASSES):
+        if not catchUp(old, new, copied):
+            break
+
+    rename(staging, root)
+    syncDirectory(directory)
+    #Entries saved in the old layout between the last pass and the switch
+    shards = ShardStore(directory, root)
+    catchUp(old, shards, copied)
+    #One line per entry, so the first listing does not replay the whole move
+    shards.compactNames()
+    #Files changed since they were copied are left for the next open to adopt
+    current = old.stamps()
+    with old.group():
+        for name, stamp in copied.items():
+            if current.get(name) == stamp:
+                try:
+                    old.removeFile(name)
+                except FileNotFoundError:
+                    pass
+    if vault is not None:
+        vault.reopen()
+    return len(copied)
+
+if __name__ == '__main__':
+    print('Moved %d entries into %s' % (migrateToShards(),
+        join(dataDir(), SHARDS_NAME)))
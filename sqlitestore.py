@@ -0,0 +1,207 @@
+'''
+Storage backend that keeps every entry in an SQLite database in WAL mode.
+
+Entries are rows of a table keyed by name, so a lookup is an index search
+whatever the size of the vault. In WAL mode readers never wait for a writer,
+and each thread gets its own connection, so the decryption workers and the
+GUI read at the same time. store.group() is a real transaction: it commits
+atomically, with one sync, and is rolled back if the block raises.
+
+Run this file directly to move a PassManData folder into a database.
+'''
+
+from contextlib import contextmanager
+from hashlib import sha256
+from os import remove, replace
+from os.path import join, exists
+from sqlite3 import connect, IntegrityError
+from threading import Lock, RLock, local
+
+from shardstore import removeShards
+from storage import (dataDir, openStore, syncDirectory, Store, SQLITE_NAME,
+    VAULT_NAME)
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+    ) WITHOUT ROWID'''
+#Seconds a connection waits for another process's write to finish
+BUSY_TIMEOUT = 30
+
+def openConnection(path):
+    connection = connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+        check_same_thread=False)
+    #Every commit is synced, as it is for the other backends
+    connection.execute('PRAGMA synchronous=FULL')
+    return connection
+
+class SqliteStore(Store):
+    '''
+    Entry store backed by an SQLite database
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.local = local()
+        self.connections = []
+        self.connectionsLock = Lock()
+        #Held by the thread writing, for the length of a whole group
+        self.writeLock = RLock()
+        self.grouped = 0
+        connection = self.connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(SCHEMA)
+
+    def connection(self):
+        """Returns this thread's connection to the database"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = openConnection(self.path)
+            self.local.connection = connection
+            with self.connectionsLock:
+                self.connections.append(connection)
+        return connection
+
+    def names(self):
+        return [x[0] for x in
+            self.connection().execute('SELECT name FROM entries')]
+
+    def read(self, name):
+        row = self.connection().execute(
+            'SELECT data FROM entries WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(name)
+        return row[0]
+
+    def create(self, name, data):
+        with self.writeLock:
+            try:
+                self.connection().execute(
+                    'INSERT INTO entries VALUES (?, ?)', (name, data))
+            except IntegrityError:
+                raise FileExistsError(name)
+
+    def write(self, name, data):
+        with self.writeLock:
+            self.connection().execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?)', (name, data))
+
+    def delete(self, name):
+        with self.writeLock:
+            cursor = self.connection().execute(
+                'DELETE FROM entries WHERE name = ?', (name,))
+            if cursor.rowcount == 0:
+                raise FileNotFoundError(name)
+
+    @contextmanager
+    def group(self):
+        with self.writeLock:
+            connection = self.connection()
+            if self.grouped == 0:
+                #Takes the write lock now, so the transaction cannot fail to
+                #upgrade from a read part way through
+                connection.execute('BEGIN IMMEDIATE')
+            self.grouped += 1
+            try:
+                yield
+            except BaseException:
+                self.grouped -= 1
+                if self.grouped == 0:
+                    connection.execute('ROLLBACK')
+                raise
+            self.grouped -= 1
+            if self.grouped == 0:
+                connection.execute('COMMIT')
+
+    def createMany(self, entries):
+        with self.group():
+            return super().createMany(entries)
+
+    def stamps(self):
+        #One query rather than a read per entry
+        return dict((name, sha256(data).hexdigest()) for name, data in
+            self.connection().execute('SELECT name, data FROM entries'))
+
+    def watchPaths(self):
+        #Commits land in the write-ahead log first
+        return [self.path, self.path + '-wal']
+
+    def snapshot(self):
+        '''
+        Returns a point in time view, which is a read transaction on a
+        connection of its own
+        '''
+        return SqliteSnapshot(self.path)
+
+    def sync(self):
+        """Moves the write-ahead log into the database file"""
+        self.connection().execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        with self.connectionsLock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = local()
+
+class SqliteSnapshot:
+    def __init__(self, path):
+        self.connection = openConnection(path)
+        self.connection.execute('BEGIN')
+        self.entries = [x[0] for x in
+            self.connection.execute('SELECT name FROM entries')]
+
+    def names(self):
+        return self.entries
+
+    def read(self, name):
+        row = self.connection.execute(
+            'SELECT data FROM entries WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        self.connection.execute('COMMIT')
+        self.connection.close()
+
+def removeDatabase(directory):
+    """Removes the database and its log files, once its entries are elsewhere"""
+    path = join(directory, SQLITE_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if exists(path + suffix):
+            remove(path + suffix)
+    syncDirectory(directory)
+
+def migrateToSqlite(directory=None):
+    '''
+    Moves every entry in the data folder, in either the flat or the sharded
+    layout, into a new database. The database is built under a temporary
+    name in one transaction so an interrupted migration leaves the old files
+    untouched. Returns the number of entries moved
+    '''
+    directory = directory or dataDir()
+    path = join(directory, SQLITE_NAME)
+    for existing in (path, join(directory, VAULT_NAME)):
+        if exists(existing):
+            raise FileExistsError(existing)
+
+    old = openStore(directory)
+    names = old.names()
+    tempPath = path + '.migrate'
+    for suffix in ('', '-wal', '-shm'):
+        if exists(tempPath + suffix):
+            remove(tempPath + suffix)
+    database = SqliteStore(tempPath)
+    database.createMany((x, old.read(x)) for x in names)
+    #Closing the last connection folds the log into the database file, so
+    #only the database itself has to be renamed
+    database.close()
+    replace(tempPath, path)
+    syncDirectory(directory)
+    with old.group():
+        for name in names:
+            old.delete(name)
+    removeShards(directory)
+    return len(names)
+
+if __name__ == '__main__':
+    print('Moved %d entries into %s' % (migrateToSqlite(),
+        join(dataDir(), SQLITE_NAME)))
@@ -0,0 +1,494 @@
+'''
+Storage backends for the entries. Every backend implements Store, and
+openStore picks the one the data folder uses: one file per entry in the
+PassManData folder, the same in hashed subfolders of it (shardstore.py), a
+single vault file (vaultfile.py) or an SQLite database (sqlitestore.py).
+
+Files are never written in place. Data goes to a temporary file that is
+synced and then renamed over the real one, so after a crash a file holds
+either its old contents or its new ones and never part of either. Syncing
+the folder after every rename makes each save durable on its own. Inside
+store.group() the temporary files are written without syncing and are synced
+and renamed when the group ends, followed by a single folder sync.
+'''
+
+from contextlib import contextmanager
+from hashlib import sha256
+from os import getenv, makedirs, remove, fsync, scandir, replace, urandom
+import os
+from os.path import join, exists, basename, dirname
+from threading import local, Lock, RLock
+from time import time
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+    #Windows
+    flock = None
+    from msvcrt import locking, LK_LOCK, LK_UNLCK
+
+#Files in the data folder that are not password entries. Names starting with a
+#dot can never collide with an entry since entry names are letters, digits and
+#spaces only
+RECORD_NAME = 'savedpassword'
+RESERVED = (RECORD_NAME,)
+VAULT_NAME = '.vault'
+SHARDS_NAME = '.shards'
+SQLITE_NAME = '.vault.db'
+#Held by every process that saves to the vault, see Vault.writeLock
+LOCK_NAME = '.passman.lock'
+#Folder in SHARDS_NAME with a tombstone for every entry a process still using
+#the flat layout deleted after the move to the sharded one
+DELETED_NAME = 'deleted'
+
+def dataDir():
+    """Returns the folder that all of the program's data is stored in"""
+    return join(getenv('APPDATA'), 'PassManData')
+
+#Temporary files are named TEMP_PREFIX + the file's name + a random suffix
+TEMP_PREFIX = '.~'
+#Temporary files older than this were left by a crash and are removed
+STALE_SECONDS = 10 * 60
+
+def isReserved(name):
+    """Checks if a file name in the data folder is used by the program itself"""
+    return name in RESERVED or name.startswith('.')
+
+def syncDirectory(directory):
+    '''
+    Makes renames and new files in directory durable. Windows has no way to
+    do this and does not need it
+    '''
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def writeTemporary(path, data, sync=True):
+    """Writes data to a new temporary file next to path and returns its path"""
+    tempPath = join(dirname(path) or '.', TEMP_PREFIX + basename(path) + '.'
+        + urandom(4).hex())
+    with open(tempPath, 'xb') as file:
+        file.write(data)
+        if sync:
+            file.flush()
+            fsync(file.fileno())
+    return tempPath
+
+def syncFiles(paths):
+    '''
+    Makes the contents of a group of files durable. Each file is synced on
+    its own: os.sync would flush every file system on the machine, and is not
+    required to wait until the data is written
+    '''
+    for path in paths:
+        with open(path, 'r+b') as file:
+            fsync(file.fileno())
+
+def moveIntoPlace(tempPath, path, exclusive):
+    '''
+    Renames a temporary file over path. With exclusive set path must not
+    exist yet, and FileExistsError is raised if it does
+    '''
+    try:
+        if not exclusive:
+            replace(tempPath, path)
+        elif hasattr(os, 'link'):
+            #A hard link fails if the name is taken, where rename would
+            #silently replace it
+            os.link(tempPath, path)
+        else:
+            #Windows, where rename refuses to replace an existing file
+            os.rename(tempPath, path)
+    finally:
+        if exists(tempPath):
+            remove(tempPath)
+
+def writeAtomic(path, data, exclusive=False):
+    '''
+    Replaces the file at path with data through a synced temporary file and
+    a rename, then syncs the folder. With exclusive set the file must not
+    exist yet and FileExistsError is raised if it does
+    '''
+    moveIntoPlace(writeTemporary(path, data), path, exclusive)
+    syncDirectory(dirname(path) or '.')
+
+class FileLock:
+    '''
+    A lock held across processes through a lock file, and across the threads
+    of this one. The thread holding it can take it again
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'a+b')
+        self.lock = RLock()
+        self.depth = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if self.depth == 0:
+                self.lockFile()
+        except BaseException:
+            self.lock.release()
+            raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        try:
+            if self.depth == 0:
+                self.unlockFile()
+        finally:
+            self.lock.release()
+
+    def lockFile(self):
+        descriptor = self.file.fileno()
+        if flock is not None:
+            flock(descriptor, LOCK_EX)
+        else:
+            #Locks the first byte, retrying for ten seconds at most
+            self.file.seek(0)
+            locking(descriptor, LK_LOCK, 1)
+
+    def unlockFile(self):
+        descriptor = self.file.fileno()
+        if flock is None:
+            self.file.seek(0)
+            locking(descriptor, LK_UNLCK, 1)
+        else:
+            flock(descriptor, LOCK_UN)
+
+    def close(self):
+        self.file.close()
+
+def removeStaleTemporary(directory):
+    """Removes temporary files left behind by a crash"""
+    cutoff = time() - STALE_SECONDS
+    for entry in scandir(directory):
+        if entry.name.startswith(TEMP_PREFIX) and entry.is_file():
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+class Store:
+    '''
+    What every storage backend provides. Entries are opaque bytes under a
+    name; reading or deleting a missing entry raises FileNotFoundError and
+    creating one that exists raises FileExistsError, whatever the backend
+    '''
+    def names(self):
+        """Returns the names of all of the saved entries"""
+        raise NotImplementedError
+
+    def read(self, name):
+        """Returns the stored bytes for an entry"""
+        raise NotImplementedError
+
+    def create(self, name, data):
+        """Saves a new entry, raising FileExistsError if it already exists"""
+        raise NotImplementedError
+
+    def write(self, name, data):
+        """Saves an entry, replacing it if it exists"""
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Removes an entry"""
+        raise NotImplementedError
+
+    @contextmanager
+    def group(self):
+        '''
+        Transaction: the writes inside the block are committed together when
+        it ends, which is much cheaper than committing them one at a time.
+        How much of a group survives an exception or a crash part way through
+        depends on the backend; only the SQLite one rolls it back
+        '''
+        yield
+
+    def createMany(self, entries):
+        '''
+        Saves a batch of (name, bytes) pairs as one group. Returns the names
+        that were skipped because they already exist
+        '''
+        skipped = []
+        with self.group():
+            for name, data in entries:
+                try:
+                    self.create(name, data)
+                except FileExistsError:
+                    skipped.append(name)
+        return skipped
+
+    def snapshot(self):
+        '''
+        Returns a view of the entries as they are now, with names(),
+        read(name), which gives None for an entry deleted since, and close()
+        '''
+        raise NotImplementedError
+
+    def stamps(self):
+        '''
+        Returns a dictionary of every entry's name to a value that changes
+        when the entry is saved again. Here that is a hash of its stored
+        bytes, which backends with a cheaper way to tell replace
+        '''
+        stamps = {}
+        for name in self.names():
+            try:
+                stamps[name] = sha256(self.read(name)).hexdigest()
+            except FileNotFoundError:
+                continue
+        return stamps
+
+    def watchPaths(self):
+        '''
+        Returns the files and folders that change when another process saves
+        or deletes entries, for a QFileSystemWatcher. Empty if this backend
+        would not see such changes anyway
+        '''
+        return []
+
+    def sync(self):
+        """Makes sure everything saved so far is on disk"""
+        pass
+
+    def close(self):
+        pass
+
+class DirectoryStore(Store):
+    '''
+    The original layout, where every entry is its own file in the data folder
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        #Every thread has its own group, see groupState
+        self.local = local()
+        #Folders with renames or deletions that have not been synced yet
+        self.unsynced = set()
+        self.unsyncedLock = Lock()
+        removeStaleTemporary(directory)
+
+    def groupState(self):
+        '''
+        Returns the calling thread's group: how deeply it is nested, the
+        (temporary path, entry name, exclusive) of each write in it and the
+        names it could not create when it was last committed
+        '''
+        state = self.local
+        if not hasattr(state, 'grouped'):
+            state.grouped = 0
+            state.pending = []
+            state.pendingNames = set()
+            state.conflicts = []
+        return state
+
+    @contextmanager
+    def group(self):
+        '''
+        Group commit: entries written inside the block can only be read once
+        it ends, when they are synced and renamed into place together. Groups
+        on different threads are committed separately
+        '''
+        state = self.groupState()
+        state.grouped += 1
+        try:
+            yield
+        finally:
+            state.grouped -= 1
+            if state.grouped == 0:
+                self.commit(state)
+
+    def commit(self, state):
+        '''
+        Finishes a group. New entries whose names were taken by another
+        thread or process in the meantime are left out and kept in conflicts
+        '''
+        pending = state.pending
+        state.pending = []
+        state.pendingNames = set()
+        syncFiles([x[0] for x in pending])
+        state.conflicts = []
+        saved = []
+        for tempPath, name, exclusive in pending:
+            path = self.path(name)
+            try:
+                moveIntoPlace(tempPath, path, exclusive)
+            except FileExistsError:
+                state.conflicts.append(name)
+                continue
+            saved.append(name)
+            self.markUnsynced(dirname(path))
+        self.syncFolders()
+        self.saved(saved)
+
+    def markUnsynced(self, folder):
+        with self.unsyncedLock:
+            self.unsynced.add(folder)
+
+    def syncFolders(self):
+        #Held while syncing, so a thread finding nothing left to sync knows
+        #that its changes are already on disk
+        with self.unsyncedLock:
+            for folder in self.unsynced:
+                syncDirectory(folder)
+            self.unsynced = set()
+
+    def path(self, name):
+        """Returns the path of the file an entry is kept in"""
+        return join(self.directory, name)
+
+    def encode(self, name, data):
+        """Returns what is written to an entry's file"""
+        return data
+
+    def decode(self, contents):
+        """Returns an entry's stored bytes from what is in its file"""
+        return contents
+
+    def saved(self, names):
+        """Called with the entries whose files were just put in place"""
+        pass
+
+    def save(self, name, data, exclusive):
+        path = self.path(name)
+        data = self.encode(name, data)
+        state = self.groupState()
+        if not state.grouped:
+            writeAtomic(path, data, exclusive)
+            self.saved([name])
+            return
+        if exclusive and (name in state.pendingNames or exists(path)):
+            raise FileExistsError(path)
+        state.pending.append((writeTemporary(path, data, False), name,
+            exclusive))
+        state.pendingNames.add(name)
+
+    def names(self):
+        """Returns the names of all of the saved entries"""
+        #scandir knows each entry's type from the listing itself, so this
+        #does not need a stat call per file like isfile would
+        return [x.name for x in scandir(self.directory)
+            if not isReserved(x.name) and x.is_file()]
+
+    def read(self, name):
+        """Returns the stored bytes for an entry"""
+        with open(self.path(name), 'rb') as file:
+            return self.decode(file.read())
+
+    def stamps(self):
+        stamps = {}
+        for entry in scandir(self.directory):
+            if isReserved(entry.name) or not entry.is_file():
+                continue
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            stamps[entry.name] = (info.st_mtime_ns, info.st_size)
+        return stamps
+
+    def watchPaths(self):
+        return [self.directory]
+
+    def create(self, name, data):
+        """Saves a new entry, raising FileExistsError if it already exists"""
+        self.save(name, data, True)
+
+    def write(self, name, data):
+        """Replaces the stored bytes of an existing entry"""
+        self.save(name, data, False)
+
+    def delete(self, name):
+        '''
+        Removes an entry. If the folder has been moved into the sharded layout
+        since the store was opened, the entry's copy in the shards would come
+        back, so a tombstone is left for ShardStore to find
+        '''
+        try:
+            self.removeFile(name)
+        except FileNotFoundError:
+            #Its file may have been moved into the shards already
+            if not self.bury(name):
+                raise
+            return
+        self.bury(name)
+
+    def removeFile(self, name):
+        """Removes an entry's file without leaving a tombstone"""
+        path = self.path(name)
+        remove(path)
+        self.markUnsynced(dirname(path))
+        if not self.groupState().grouped:
+            self.syncFolders()
+
+    def bury(self, name):
+        '''
+        Leaves a tombstone for a deleted entry if the sharded layout exists.
+        This is checked after the file is removed, so a move that was not
+        finished by then sees the deletion itself. Returns whether it did
+        '''
+        shards = join(self.directory, SHARDS_NAME)
+        if not exists(shards):
+            return False
+        folder = join(shards, DELETED_NAME)
+        makedirs(folder, exist_ok=True)
+        writeAtomic(join(folder, name), b'')
+        return True
+
+    def createMany(self, entries):
+        skipped = super().createMany(entries)
+        return skipped + self.groupState().conflicts
+
+    def snapshot(self):
+        '''
+        Returns a view of the entries that exist right now. Files are read
+        when asked for, so an entry deleted in the meantime is left out
+        '''
+        return DirectorySnapshot(self)
+
+    def sync(self):
+        self.markUnsynced(self.directory)
+        self.syncFolders()
+
+class DirectorySnapshot:
+    def __init__(self, store):
+        self.store = store
+        self.entries = sorted(store.names())
+
+    def names(self):
+        return self.entries
+
+    def read(self, name):
+        """Returns an entry's bytes, or None if it has since been deleted"""
+        try:
+            return self.store.read(name)
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        pass
+
+def openStore(directory=None):
+    '''
+    Opens the entry store for the data folder, using the single file vault or
+    the SQLite database if one has been created, then the sharded layout if
+    the folder was moved to it, and the one file per entry layout otherwise
+    '''
+    directory = directory or dataDir()
+    if exists(join(directory, VAULT_NAME)):
+        from vaultfile import VaultFile
+        return VaultFile(join(directory, VAULT_NAME))
+    if exists(join(directory, SQLITE_NAME)):
+        from sqlitestore import SqliteStore
+        return SqliteStore(join(directory, SQLITE_NAME))
+    if exists(join(directory, SHARDS_NAME)):
+        from shardstore import ShardStore
+        return ShardStore(directory)
+    return DirectoryStore(directory)
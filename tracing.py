@@ -0,0 +1,178 @@
+'''
+Lightweight timing of the program's hot paths.
+
+Code that might be slow is wrapped in a span:
+
+    with span('kdf.entry'):
+        key = deriveEntryKey(data, masterKey, password)
+
+While tracing is off, span() returns a shared object whose enter and exit do
+nothing, so the cost is a function call and a flag check. While it is on,
+every span's duration is added to a histogram for its name and kept as an
+event for a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+
+Tracing is turned on by setting PASSMAN_TRACE to a file name for a JSON
+report of the histograms, and/or PASSMAN_TRACE_CHROME to a file name for a
+Chrome trace; the files are written when the program exits. In the GUI it
+can also be started from the tray menu, where the entries only show up if
+the menu is opened with Shift held down.
+'''
+
+from atexit import register
+from collections import deque
+from json import dump
+from os import getenv, getpid
+from threading import Lock, get_ident
+from time import perf_counter
+
+#Spans kept for the Chrome trace. The histograms keep everything
+MAX_EVENTS = 100000
+#Histogram buckets are powers of two microseconds
+BUCKETS = 40
+
+enabled = False
+lock = Lock()
+histograms = {}
+events = deque(maxlen=MAX_EVENTS)
+origin = perf_counter()
+
+class Histogram:
+    '''
+    Durations of one kind of span, bucketed by powers of two
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        self.maximum = max(self.maximum, seconds)
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[min(bucket, BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        '''
+        Returns the upper edge of the bucket holding the percentile, in
+        seconds
+        '''
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted and count:
+                return min((1 << bucket) / 1e6, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'totalMs': self.total * 1000,
+            'meanMs': self.total * 1000 / self.count,
+            'minMs': self.minimum * 1000,
+            'maxMs': self.maximum * 1000,
+            'p50Ms': self.percentile(0.5) * 1000,
+            'p90Ms': self.percentile(0.9) * 1000,
+            'p99Ms': self.percentile(0.99) * 1000,
+            #Count of spans that took under 2**i microseconds
+            'buckets': self.buckets[:max(i for i, x in
+                enumerate(self.buckets) if x) + 1]
+            }
+
+class Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        record(self.name, self.start, perf_counter())
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name):
+    """Returns a context manager that times the code inside it"""
+    if not enabled:
+        return NULL_SPAN
+    return Span(name)
+
+def record(name, start, end):
+    """Adds a finished span, with perf_counter times"""
+    with lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(end - start)
+        events.append((name, start, end, get_ident()))
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with lock:
+        histograms.clear()
+        events.clear()
+
+def report():
+    """Returns a summary of every histogram, keyed by span name"""
+    with lock:
+        return dict((name, histogram.summary())
+            for name, histogram in sorted(histograms.items()))
+
+def writeReport(path):
+    with open(path, 'w') as file:
+        dump(report(), file, indent=2)
+
+def writeChromeTrace(path):
+    '''
+    Writes the kept spans in the Chrome trace event format
+    '''
+    with lock:
+        kept = list(events)
+    pid = getpid()
+    with open(path, 'w') as file:
+        dump({'traceEvents': [{
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': (start - origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': pid,
+            'tid': thread
+            } for name, start, end, thread in kept],
+            'displayTimeUnit': 'ms'}, file)
+
+def writeFromEnvironment():
+    """Writes the files named by the environment variables, if any"""
+    if getenv('PASSMAN_TRACE'):
+        writeReport(getenv('PASSMAN_TRACE'))
+    if getenv('PASSMAN_TRACE_CHROME'):
+        writeChromeTrace(getenv('PASSMAN_TRACE_CHROME'))
+
+if getenv('PASSMAN_TRACE') or getenv('PASSMAN_TRACE_CHROME'):
+    enable()
+    register(writeFromEnvironment)
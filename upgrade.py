@@ -0,0 +1,182 @@
+'''
+Moving a whole vault to the current entry format, and checking one.
+
+Entries are upgraded one at a time as they are read, which leaves entries
+that are never copied in an old, unauthenticated format. upgradeVault
+rewrites all of them at once and verifyVault checks every entry without
+changing anything. Both read the vault from a point in time snapshot a batch
+at a time, and spread the decryption over a process pool with a bounded
+number of batches in flight, so they use all cores in one pass and their
+memory use does not depend on the size of the vault.
+
+python passmancli.py upgrade
+python passmancli.py verify
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count
+
+from keys import (decodeSecret, decryptEntry, encryptEntry, entryVersion,
+    DecodingError, VERSION)
+
+BATCH = 500
+
+#What checkEntry found
+CURRENT = 'current'
+OUTDATED = 'outdated'
+FAILED = 'failed'
+
+class VerifyReport:
+    '''
+    What a verify or upgrade pass found: how many entries were checked, the
+    names of those in an older format, and the entries that could not be
+    read with the reason why
+    '''
+    def __init__(self):
+        self.checked = 0
+        self.outdated = []
+        self.upgraded = []
+        self.failed = {}
+
+    def ok(self):
+        return not self.failed
+
+    def summary(self):
+        parts = ['%d checked' % self.checked]
+        if self.upgraded:
+            parts.append('%d upgraded' % len(self.upgraded))
+        if self.outdated:
+            parts.append('%d in an older format' % len(self.outdated))
+        parts.append('%d failed' % len(self.failed))
+        return ', '.join(parts)
+
+def checkEntry(data, masterKey, password):
+    '''
+    Decrypts the stored bytes of an entry. Returns CURRENT, OUTDATED or
+    FAILED, the plaintext as UTF-8 (None if it failed) and a reason for
+    failing
+    '''
+    try:
+        secret, outdated = decryptEntry(data, masterKey, password)
+    except ValueError as error:
+        return FAILED, None, str(error)
+    if outdated:
+        #Older formats are not authenticated, and text that does not decode
+        #is all a wrong key or a damaged file shows
+        try:
+            secret = decodeSecret(secret, entryVersion(data))
+        except DecodingError:
+            return FAILED, None, 'Unable to decode'
+        return OUTDATED, secret.encode(), None
+    return CURRENT, secret, None
+
+def verifyBatch(masterKey, password, entries):
+    """Checks a batch of entries. Run in the worker processes"""
+    return [checkEntry(x, masterKey, password)[::2] for x in entries]
+
+def upgradeBatch(masterKey, password, entries):
+    '''
+    Checks a batch of entries, re-encrypting the outdated ones in the current
+    format. Run in the worker processes
+    '''
+    results = []
+    for data in entries:
+        status, secret, reason = checkEntry(data, masterKey, password)
+        if status == OUTDATED:
+            results.append((status, encryptEntry(masterKey, secret)))
+        else:
+            results.append((status, reason))
+    return results
+
+def mapVault(vault, function, finish, workers=None, wanted=None,
+    names=None):
+    '''
+    Runs function(masterKey, password, entries) over the vault's entries, or
+    the given names of them, in batches on a process pool, calling
+    finish(names, entries, results) with each batch's results in order.
+    wanted can pick which stored bytes are worth sending to the pool.
+    Returns the number of entries read
+    '''
+    vault.checkUnlocked()
+    snapshot = vault.snapshot()
+    count = 0
+    try:
+        remaining = iter(snapshot.names() if names is None else names)
+        workers = workers or cpu_count() or 1
+        pending = deque()
+        def collect():
+            names, entries, future = pending.popleft()
+            finish(names, entries, future.result())
+
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                names = list(islice(remaining, BATCH))
+                if not names:
+                    break
+                entries = [snapshot.read(x) for x in names]
+                #None if deleted since the snapshot was taken
+                count += sum(1 for x in entries if x is not None)
+                batch = [(x, y) for x, y in zip(names, entries)
+                    if y is not None and (wanted is None or wanted(y))]
+                if not batch:
+                    continue
+                names = [x for x, _ in batch]
+                entries = [y for _, y in batch]
+                pending.append((names, entries, pool.submit(function,
+                    vault.masterKey, vault.password, entries)))
+                #A bounded number of batches in flight keeps memory flat
+                if len(pending) >= workers * 2:
+                    collect()
+            while pending:
+                collect()
+    finally:
+        snapshot.close()
+    return count
+
+def verifyVault(vault, workers=None):
+    '''
+    Checks that every entry of an unlocked vault decrypts and, for the
+    current format, authenticates. Returns a VerifyReport
+    '''
+    report = VerifyReport()
+    def finish(names, entries, results):
+        for name, (status, reason) in zip(names, results):
+            if status == OUTDATED:
+                report.outdated.append(name)
+            elif status == FAILED:
+                report.failed[name] = reason
+    report.checked = mapVault(vault, verifyBatch, finish, workers)
+    return report
+
+def upgradeVault(vault, workers=None):
+    '''
+    Rewrites every entry of an unlocked vault that is in an older format in
+    the current one, a batch per group commit. Entries saved again while
+    this runs are left as they were saved, and entries that fail to decrypt
+    are left alone and reported. Returns a VerifyReport
+    '''
+    report = VerifyReport()
+    store = vault.store
+    def finish(names, entries, results):
+        with vault.writeLock, store.group():
+            vault.checkWritable()
+            for name, data, (status, result) in zip(names, entries, results):
+                if status == FAILED:
+                    report.failed[name] = result
+                    continue
+                if status != OUTDATED:
+                    continue
+                try:
+                    if store.read(name) != data:
+                        continue
+                except FileNotFoundError:
+                    continue
+                store.write(name, result)
+                report.upgraded.append(name)
+    #Entries already in the current format are not sent to be decrypted
+    report.checked = mapVault(vault, upgradeBatch, finish, workers,
+        lambda x: entryVersion(x) < VERSION)
+    store.sync()
+    return report
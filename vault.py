@@ -0,0 +1,388 @@
+'''
+The vault itself, with no Qt involved: finding the data folder, checking the
+master password, and listing, reading, saving and deleting entries. The GUI
+is built on this, and it can be used on its own from scripts and passmancli.py.
+
+    vault = Vault()
+    if vault.unlock(b'master password'):
+        for name in vault.names():
+            print(name, vault.get(name))
+'''
+
+from hmac import compare_digest
+from os import makedirs
+from os.path import join, exists
+from string import ascii_letters, digits
+
+from attachments import AttachmentStore
+from history import History
+from keys import (checkKey, decodeSecret, decryptEntry, deriveEntryKey,
+    deriveLegacyMasterKey, encryptEntry, entryVersion, keyCheckValue,
+    readKeyCheck, readKeySalt, writeKeyCheck, AuthenticationError,
+    DecodingError)
+from masterkey import createRecord, readFields, verify
+from rotate import recover, rotateMasterPassword
+from storage import (dataDir, isReserved, openStore, writeAtomic, FileLock,
+    LOCK_NAME, RECORD_NAME)
+from tracing import span
+
+class WrongPasswordError(Exception):
+    """An entry could not be decrypted with the vault's master password"""
+    pass
+
+class LockedError(Exception):
+    """Entries were used before the vault was unlocked"""
+    pass
+
+class KeyChangedError(LockedError):
+    '''
+    Another process changed the master password since the vault was
+    unlocked, so it has to be unlocked again before anything is saved
+    '''
+    pass
+
+def cleanTitle(title):
+    '''
+    Returns the entry name for a website/application title. Entry names are
+    made of letters, digits and spaces only
+    '''
+    return ''.join(filter(lambda x: x in ascii_letters + digits + ' ', title))
+
+def checkName(name):
+    '''
+    Raises ValueError unless name can be an entry's name: one cleanTitle
+    leaves as it is, which is not the name of one of the program's own files
+    '''
+    if name == '' or cleanTitle(name) != name or isReserved(name):
+        raise ValueError('Invalid entry name: %r' % name)
+
+class Vault:
+    def __init__(self, directory=None):
+        self.directory = directory or dataDir()
+        if not exists(self.directory):
+            makedirs(self.directory)
+        self.recordPath = join(self.directory, RECORD_NAME)
+        #Held for every save and delete, and by a master password change
+        #while it swaps the new vault in, so nothing is saved under the old
+        #key into the new vault or lost with the old one. It is a file lock,
+        #so this holds for every process with the vault open, and saves
+        #check that the key is still the vault's once they have it
+        self.writeLock = FileLock(join(self.directory, LOCK_NAME))
+        with self.writeLock:
+            #Finish a master password change that was interrupted
+            recover(self.directory)
+        self.store = openStore(self.directory)
+        self.attachmentStore = AttachmentStore(self.directory)
+        self.history = History(self.directory, self.writeLock)
+        self.history.sweep()
+        self.password = None
+        self.masterKey = None
+
+    def exists(self):
+        """Checks if a master password has been set for this vault"""
+        return exists(self.recordPath)
+
+    def create(self, password, n=None):
+        '''
+        Sets the master password of a new vault and unlocks it. The cost of
+        checking it is calibrated for this machine unless n is given
+        '''
+        record, masterKey = createRecord(password, n)
+        writeAtomic(self.recordPath, record)
+        self.setUnlocked(password, masterKey, fresh=True)
+
+    def unlock(self, password):
+        '''
+        Checks the master password, upgrading the saved record if it is in an
+        older format, and unlocks the vault if it matches and the key it
+        gives passes the key check. This is slow on purpose. A vault made
+        before the master key came from the record is re-encrypted under
+        the record's key, once, which takes as long as changing the master
+        password
+        '''
+        with open(self.recordPath, 'rb') as file:
+            record = file.read()
+
+        with span('login.verify'):
+            masterKey, upgraded = verify(password, record)
+        if masterKey is None:
+            return False
+        if upgraded is not None:
+            salt = readKeySalt(self.directory)
+            if salt is not None:
+                return self.moveKey(password, salt,
+                    readFields(upgraded)['n'])
+            #Saved before the key check value for its key can be
+            writeAtomic(self.recordPath, upgraded)
+        try:
+            self.setUnlocked(password, masterKey)
+        except WrongPasswordError:
+            return False
+        return True
+
+    def moveKey(self, password, salt, n):
+        '''
+        Unlocks a vault whose master key comes from its .keysalt file and
+        re-encrypts it under a new master password record for the same
+        password, the way a master password change does. The rotation
+        removes the .keysalt file
+        '''
+        with span('kdf.legacy'):
+            masterKey = deriveLegacyMasterKey(password, salt)
+        try:
+            self.setUnlocked(password, masterKey)
+        except WrongPasswordError:
+            return False
+        try:
+            rotateMasterPassword(self, password, n=n)
+        except KeyChangedError:
+            #Another process moved it over first
+            return self.unlock(password)
+        return True
+
+    def reopen(self):
+        """Opens the entry store again after its files were replaced"""
+        self.store = openStore(self.directory)
+
+    def setUnlocked(self, password, masterKey, fresh=False):
+        '''
+        Unlocks the vault with the master key from its record. For a new
+        vault (fresh) the key check value is saved, otherwise the key is
+        checked against it and WrongPasswordError raised if it does not
+        belong to this vault
+        '''
+        if fresh:
+            writeKeyCheck(self.directory, masterKey)
+        elif not checkKey(self.directory, masterKey):
+            raise WrongPasswordError(self.directory)
+        self.password = password
+        self.masterKey = masterKey
+
+    def checkUnlocked(self):
+        if self.masterKey is None:
+            raise LockedError('The vault has not been unlocked')
+
+    def keyChanged(self):
+        '''
+        Checks if the vault's master key is no longer the one it was unlocked
+        with, because another process changed the master password. Must be
+        called with the write lock held
+        '''
+        expected = readKeyCheck(self.directory)
+        return (expected is not None and
+            not compare_digest(expected, keyCheckValue(self.masterKey)))
+
+    def checkWritable(self):
+        '''
+        Raises LockedError if the vault is locked, or KeyChangedError if
+        anything saved now would be under the wrong key. Must be called with
+        the write lock held
+        '''
+        self.checkUnlocked()
+        if self.keyChanged():
+            raise KeyChangedError(
+                'The master password was changed by another process')
+
+    def names(self):
+        """Returns the names of all of the saved entries"""
+        return self.store.names()
+
+    def read(self, name):
+        """Returns the stored (encrypted) bytes of an entry"""
+        with span('disk.read'):
+            return self.store.read(name)
+
+    def deriveKey(self, data):
+        """Returns the key for the stored bytes of an entry"""
+        self.checkUnlocked()
+        with span('kdf.entry'):
+            return deriveEntryKey(data, self.masterKey, self.password)
+
+    def decrypt(self, name, data, key=None, upgrade=True):
+        '''
+        Decrypts the stored bytes of the named entry. Entries saved by older
+        versions are upgraded the first time they are read, unless upgrade
+        is off. Raises WrongPasswordError if the entry does not authenticate,
+        and DecodingError if it does but holds no text
+        '''
+        if key is None:
+            key = self.deriveKey(data)
+        with span('decrypt.cipher'):
+            try:
+                decrypted, outdated = decryptEntry(
+                    data, self.masterKey, self.password, key)
+            except AuthenticationError:
+                raise WrongPasswordError(name)
+        with span('decrypt.decode'):
+            try:
+                secret = decodeSecret(decrypted, entryVersion(data))
+            except DecodingError:
+                #Older formats are not authenticated, so there it is all a
+                #wrong key shows
+                if outdated:
+                    raise WrongPasswordError(name)
+                raise
+        if outdated and upgrade:
+            with span('decrypt.upgrade'):
+                with self.writeLock:
+                    #Unless it was saved again since it was read, or the
+                    #vault moved to another key
+                    if (not self.keyChanged() and
+                        self.store.read(name) == data):
+                        self.store.write(name,
+                            encryptEntry(self.masterKey, secret.encode()))
+        return secret
+
+    def get(self, name):
+        '''
+        Returns the password saved under name. Raises FileNotFoundError if
+        there is no such entry and ValueError if it is not a valid entry name
+        '''
+        checkName(name)
+        return self.decrypt(name, self.read(name))
+
+    def put(self, name, secret):
+        '''
+        Saves a new entry. Raises FileExistsError if the name is taken and
+        ValueError if it is not a valid entry name
+        '''
+        self.checkUnlocked()
+        checkName(name)
+        with self.writeLock:
+            self.checkWritable()
+            with span('save.encrypt'):
+                data = encryptEntry(self.masterKey, secret.encode())
+            with span('save.write'):
+                self.store.create(name, data)
+
+    def update(self, name, secret):
+        '''
+        Saves a new password for an existing entry. The old one is kept in
+        the entry's history. Raises FileNotFoundError if there is no such
+        entry and ValueError if it is not a valid entry name
+        '''
+        self.checkUnlocked()
+        checkName(name)
+        with self.writeLock:
+            self.checkWritable()
+            with span('save.encrypt'):
+                data = encryptEntry(self.masterKey, secret.encode())
+            with span('save.write'):
+                self.history.append(name, self.store.read(name))
+                self.store.write(name, data)
+
+    def revisions(self, name):
+        '''
+        Returns the (time replaced, password) of the earlier revisions of an
+        entry, newest first
+        '''
+        checkName(name)
+        revisions = []
+        for when, data in reversed(self.history.records(name)):
+            revisions.append((when, self.decrypt(name, data, upgrade=False)))
+        return revisions
+
+    def delete(self, name):
+        '''
+        Deletes the entry saved under name, with its attachments and history
+        '''
+        checkName(name)
+        with self.writeLock, span('delete'):
+            self.store.delete(name)
+            self.attachmentStore.removeAll([name])
+            self.history.remove([name])
+
+    def deleteMany(self, names):
+        '''
+        Deletes a batch of entries as one group commit. Entries that are
+        already gone are skipped
+        '''
+        for name in names:
+            checkName(name)
+        with self.writeLock, span('delete'):
+            with self.store.group():
+                for name in names:
+                    try:
+                        self.store.delete(name)
+                    except FileNotFoundError:
+                        #Deleted by another process since it was listed
+                        pass
+            self.attachmentStore.removeAll(names)
+            self.history.remove(names)
+
+    def attach(self, name, label, source):
+        '''
+        Saves everything read from the binary file object source as an
+        attachment of the named entry, streamed through in chunks. Raises
+        FileNotFoundError if there is no such entry and FileExistsError if it
+        already has an attachment with that label. Returns its size. Saves
+        only wait for the small key file, not for the contents
+        '''
+        self.checkUnlocked()
+        checkName(name)
+        with self.writeLock:
+            #Raises FileNotFoundError for a missing entry
+            self.store.read(name)
+            self.attachmentStore.checkLabel(self.masterKey, name, label)
+        with span('attachment.write'):
+            id, key, size = self.attachmentStore.writeContents(name, source)
+            #Under the master key in use now, which a password change made
+            #while the contents were written would have replaced
+            with self.writeLock:
+                try:
+                    self.checkWritable()
+                    #The entry may have been deleted while they were written
+                    self.store.read(name)
+                except BaseException:
+                    self.attachmentStore.discard(id)
+                    raise
+                self.attachmentStore.writeKey(self.masterKey, id, name,
+                    label, key, size)
+        return size
+
+    def attachments(self, name):
+        """Returns the (label, size) of each of an entry's attachments"""
+        self.checkUnlocked()
+        return self.attachmentStore.list(self.masterKey, name)
+
+    def openAttachment(self, name, label):
+        '''
+        Returns an AttachmentReader for an attachment, which decrypts byte
+        ranges of it with read(offset, length) and copies all of it with
+        copyTo(file)
+        '''
+        self.checkUnlocked()
+        return self.attachmentStore.open(self.masterKey, name, label)
+
+    def detach(self, name, label):
+        """Deletes one of an entry's attachments"""
+        self.checkUnlocked()
+        with self.writeLock:
+            self.checkWritable()
+            self.attachmentStore.remove(self.masterKey, name, label)
+
+    def createMany(self, entries):
+        '''
+        Saves a batch of (name, encrypted bytes) pairs, as made by
+        encryptEntry with the master key, without syncing. Returns the names
+        that were skipped because they already exist
+        '''
+        self.checkUnlocked()
+        with self.writeLock:
+            self.checkWritable()
+            return self.store.createMany(entries)
+
+    def snapshot(self):
+        '''
+        Returns a point in time view of the stored entries with names(),
+        read(name) and close()
+        '''
+        return self.store.snapshot()
+
+    def sync(self):
+        """Makes sure everything saved so far is on disk"""
+        self.store.sync()
+
+    def close(self):
+        self.store.close()
+        self.writeLock.close()
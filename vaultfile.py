@@ -0,0 +1,564 @@
+'''
+A single file vault that holds every entry in one append-only record log.
+
+The file starts with a header that points at the newest index record. Opening
+the vault reads that index and then only the few records written after it, so
+startup cost does not depend on the number of entries. Adding or deleting an
+entry appends a record, and space used by deleted or overwritten records is
+reclaimed by compacting the log in a background thread.
+
+Every record carries a checksum, and a torn record at the end of the log
+(from a crash part way through an append) is cut off when the vault is
+opened. Appends are synced before they return, or once at the end of a
+store.group() block.
+
+Other processes (passmancli.py, the unlock agent) can have the same vault
+open. Appends, checkpoints and compaction hold a lock on a file next to the
+vault (.vault.lock), and each one first replays whatever other processes
+appended since, or reopens the vault if another process compacted it.
+Reads catch up the same way, so every process sees the others' saves.
+
+Run this file directly to move an existing PassManData folder into a vault.
+'''
+
+from contextlib import contextmanager
+from os import fstat, getpid, remove, replace, fsync, stat, SEEK_END
+from os.path import join, exists
+from struct import Struct
+from threading import local, Lock, Thread
+from zlib import crc32
+
+from shardstore import removeShards
+from sqlitestore import removeDatabase
+from storage import (dataDir, openStore, FileLock, Store, LOCK_NAME,
+    VAULT_NAME)
+
+MAGIC = b'PMVAULT1'
+HEADER = Struct('<8sQ')         #magic, offset of the newest index record
+RECORD = Struct('<BHII')        #type, name length, payload length, crc32
+INDEX_ENTRY = Struct('<HQI')    #name length, payload offset, payload length
+INDEX_HEAD = Struct('<Q')       #bytes used by dead records
+
+PUT = 1
+DELETE = 2
+INDEX = 3
+
+#An index record is written after this many records have been appended since
+#the last one, which bounds how much of the log has to be replayed on open
+CHECKPOINT_INTERVAL = 256
+#Compaction starts once dead records take up this many bytes and outweigh the
+#live ones
+COMPACT_MIN_DEAD = 1 << 20
+LOCK_SUFFIX = '.lock'
+
+class CorruptVaultError(Exception):
+    pass
+
+class VaultFile(Store):
+    '''
+    Entry store backed by a single vault file
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self.dead = 0
+        self.sinceCheckpoint = 0
+        self.lock = Lock()
+        self.compactor = None
+        self.snapshots = 0
+        #Every thread has its own group, see grouped
+        self.local = local()
+
+        #Keeps other processes from appending to or compacting the vault at
+        #the same time. Only taken with the lock held
+        self.fileLock = FileLock(path + LOCK_SUFFIX)
+        with self.lock, self.fileLock:
+            if not exists(path):
+                with open(path, 'wb') as file:
+                    file.write(HEADER.pack(MAGIC, 0))
+            self.file = open(path, 'r+b')
+            self.load()
+
+    def changed(self):
+        '''
+        Checks if another process appended to the vault or replaced it since
+        it was last read. Must be called with the lock held
+        '''
+        try:
+            current = stat(self.path)
+        except FileNotFoundError:
+            return False
+        opened = fstat(self.file.fileno())
+        return (fileIdentity(current) != fileIdentity(opened) or
+            opened.st_size != self.end)
+
+    def refresh(self):
+        '''
+        Catches up with records appended by other processes, or reads the
+        vault again if another process compacted it. Must be called with
+        both locks held. Returns whether the vault was read again
+        '''
+        if not self.changed():
+            return False
+        if fileIdentity(stat(self.path)) == fileIdentity(
+            fstat(self.file.fileno())):
+            self.end = self.replay(self.end)
+            return False
+        self.file.close()
+        self.file = open(self.path, 'r+b')
+        self.index = {}
+        self.dead = 0
+        self.sinceCheckpoint = 0
+        self.load()
+        return True
+
+    def catchUp(self):
+        '''
+        Refreshes the index if another process changed the vault. Must be
+        called with the lock held
+        '''
+        if self.changed():
+            with self.fileLock:
+                self.refresh()
+
+    @contextmanager
+    def writing(self):
+        '''
+        Holds both locks, with the index caught up with the other processes,
+        for appending records
+        '''
+        with self.lock, self.fileLock:
+            self.refresh()
+            yield
+
+    def load(self):
+        '''
+        Reads the newest index and replays any records appended after it
+        '''
+        magic, indexOffset = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            raise CorruptVaultError('Not a PassMan vault: ' + self.path)
+
+        position = HEADER.size
+        if indexOffset:
+            self.file.seek(indexOffset)
+            try:
+                kind, name, payload, indexEnd = self.readRecord()
+            except CorruptVaultError:
+                kind = None
+            if kind == INDEX:
+                self.index, self.dead = parseIndex(payload)
+                position = indexEnd
+            #Otherwise the index was lost in a crash, and the whole log is
+            #replayed instead
+
+        self.end = self.replay(position)
+
+    def replay(self, position):
+        '''
+        Applies the records starting at position to the index and returns the
+        end of the log. Only the records written since the last index are
+        replayed, and a torn record at the end of the file is cut off
+        '''
+        self.file.seek(0, SEEK_END)
+        fileEnd = self.file.tell()
+        self.file.seek(position)
+        while position < fileEnd:
+            try:
+                kind, name, payload, nextPosition = self.readRecord()
+            except CorruptVaultError:
+                self.file.truncate(position)
+                break
+            self.apply(kind, name, position, nextPosition)
+            position = nextPosition
+        return position
+
+    def readRecord(self):
+        """Reads and checks the record at the current position"""
+        start = self.file.tell()
+        head = self.file.read(RECORD.size)
+        if len(head) < RECORD.size:
+            raise CorruptVaultError('Truncated record')
+        kind, nameLength, payloadLength, checksum = RECORD.unpack(head)
+        name = self.file.read(nameLength)
+        payload = self.file.read(payloadLength)
+        if (len(name) < nameLength or len(payload) < payloadLength
+            or crc32(payload, crc32(name)) != checksum):
+            raise CorruptVaultError('Bad record at offset %d' % start)
+        return kind, name.decode(), payload, self.file.tell()
+
+    def apply(self, kind, name, start, end):
+        """Updates the index for a record found while replaying the log"""
+        if kind == PUT:
+            if name in self.index:
+                self.dead += recordSize(name, self.index[name][1])
+            payloadOffset = start + RECORD.size + len(name.encode())
+            self.index[name] = (payloadOffset, end - payloadOffset)
+        elif kind == DELETE:
+            if name in self.index:
+                self.dead += recordSize(name, self.index.pop(name)[1])
+            self.dead += end - start
+        elif kind == INDEX:
+            self.dead += end - start
+        self.sinceCheckpoint += 1
+
+    def append(self, kind, name, payload):
+        '''
+        Appends a record to the end of the log and returns where its payload
+        starts. Must be called with the lock held
+        '''
+        encodedName = name.encode()
+        self.file.seek(self.end)
+        self.file.write(RECORD.pack(kind, len(encodedName), len(payload),
+            crc32(payload, crc32(encodedName))))
+        self.file.write(encodedName)
+        self.file.write(payload)
+        self.file.flush()
+        if not self.grouped():
+            fsync(self.file.fileno())
+        start = self.end
+        self.end = self.file.tell()
+        return start + RECORD.size + len(encodedName)
+
+    def checkpoint(self):
+        '''
+        Writes the current index to the log and points the header at it. Must
+        be called with the lock held
+        '''
+        if self.sinceCheckpoint == 0:
+            return
+        _, oldIndex = HEADER.unpack(self.pread(0, HEADER.size))
+        if oldIndex:
+            self.dead += self.recordLengthAt(oldIndex)
+        payload = buildIndex(self.index, self.dead)
+        start = self.end
+        self.append(INDEX, '', payload)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, start))
+        self.file.flush()
+        self.sinceCheckpoint = 0
+
+    def recordLengthAt(self, offset):
+        """Returns the full length of the record starting at offset"""
+        _, nameLength, payloadLength, _ = RECORD.unpack(
+            self.pread(offset, RECORD.size))
+        return RECORD.size + nameLength + payloadLength
+
+    def pread(self, offset, length):
+        """Reads length bytes at offset. Must be called with the lock held"""
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def names(self):
+        """Returns the names of all of the saved entries"""
+        with self.lock:
+            self.catchUp()
+            return list(self.index)
+
+    def read(self, name):
+        """Returns the stored bytes for an entry"""
+        with self.lock:
+            self.catchUp()
+            if name not in self.index:
+                raise FileNotFoundError(name)
+            return self.pread(*self.index[name])
+
+    def create(self, name, data):
+        """Saves a new entry, raising FileExistsError if it already exists"""
+        with self.writing():
+            if name in self.index:
+                raise FileExistsError(name)
+            self.put(name, data)
+
+    def write(self, name, data):
+        """Replaces the stored bytes of an existing entry"""
+        with self.writing():
+            self.put(name, data)
+
+    def put(self, name, data):
+        """Appends a record for an entry. Must be called with the lock held"""
+        if name in self.index:
+            self.dead += recordSize(name, self.index[name][1])
+        self.index[name] = (self.append(PUT, name, data), len(data))
+        self.afterAppend()
+
+    def delete(self, name):
+        """Removes an entry by appending a delete record"""
+        with self.writing():
+            if name not in self.index:
+                raise FileNotFoundError(name)
+            start = self.end
+            self.append(DELETE, name, b'')
+            self.dead += (self.end - start
+                + recordSize(name, self.index.pop(name)[1]))
+            self.afterAppend()
+
+    def grouped(self):
+        """Returns how deeply the calling thread is nested in groups"""
+        return getattr(self.local, 'grouped', 0)
+
+    @contextmanager
+    def group(self):
+        '''
+        Group commit: appends inside the block are synced once when it ends
+        rather than one at a time. Appends made by other threads meanwhile
+        are synced as usual
+        '''
+        self.local.grouped = self.grouped() + 1
+        try:
+            yield
+        finally:
+            self.local.grouped -= 1
+            if self.local.grouped == 0:
+                with self.lock:
+                    fsync(self.file.fileno())
+
+    def snapshot(self):
+        '''
+        Returns a point in time view of the vault. Records are never changed
+        once written, so the view only needs a copy of the index and its own
+        handle on the file. Compaction waits until every view is closed
+        '''
+        if self.compactor is not None:
+            self.compactor.join()
+        #Under the file lock, so another process cannot compact the vault
+        #between the index being read and the view opening the file
+        with self.writing():
+            self.snapshots += 1
+            return VaultSnapshot(self, dict(self.index))
+
+    def createMany(self, entries):
+        '''
+        Saves a batch of new entries with one write and no sync. Returns the
+        names that were skipped because they already exist
+        '''
+        skipped = []
+        with self.writing():
+            self.file.seek(self.end)
+            for name, data in entries:
+                if name in self.index:
+                    skipped.append(name)
+                    continue
+                self.index[name] = writeRecord(self.file, PUT, name, data)
+                self.sinceCheckpoint += 1
+            self.file.flush()
+            self.end = self.file.tell()
+            if self.sinceCheckpoint >= CHECKPOINT_INTERVAL:
+                self.checkpoint()
+            if not self.grouped():
+                fsync(self.file.fileno())
+        return skipped
+
+    def sync(self):
+        """Writes an index and flushes the vault file to disk"""
+        with self.writing():
+            self.checkpoint()
+            fsync(self.file.fileno())
+
+    def afterAppend(self):
+        """Checkpoints and starts compaction when they are due"""
+        self.sinceCheckpoint += 1
+        if self.sinceCheckpoint >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+        if (self.dead >= COMPACT_MIN_DEAD and self.dead > self.end - self.dead
+            and self.snapshots == 0
+            and (self.compactor is None or not self.compactor.is_alive())):
+            self.compactor = Thread(target=self.compact, daemon=True)
+            self.compactor.start()
+
+    def compact(self):
+        '''
+        Rewrites the vault with only its live records. Records written while
+        the copy is running are carried over before the new file replaces the
+        old one, so other threads only wait for that final step
+        '''
+        with self.writing():
+            entries = sorted(self.index.items(), key=lambda x: x[1][0])
+            copiedTo = self.end
+            copiedFrom = fileIdentity(fstat(self.file.fileno()))
+
+        #Named for this process, since another one may be compacting too
+        tempPath = '%s.compact.%d' % (self.path, getpid())
+        newIndex = {}
+        with open(self.path, 'rb') as source, open(tempPath, 'wb') as target:
+            target.write(HEADER.pack(MAGIC, 0))
+            for name, (offset, length) in entries:
+                source.seek(offset)
+                newIndex[name] = writeRecord(target, PUT, name,
+                    source.read(length))
+
+            with self.lock, self.fileLock:
+                self.refresh()
+                if fileIdentity(fstat(self.file.fileno())) != copiedFrom:
+                    #Another process compacted it first, and the offsets
+                    #copied from are gone
+                    target.close()
+                    remove(tempPath)
+                    return
+                #Carry over anything appended since the snapshot was taken,
+                #by this process or any other
+                self.file.seek(copiedTo)
+                while self.file.tell() < self.end:
+                    kind, name, payload, _ = self.readRecord()
+                    if kind == PUT:
+                        newIndex[name] = writeRecord(target, PUT, name, payload)
+                    elif kind == DELETE:
+                        newIndex.pop(name, None)
+
+                indexStart = target.tell()
+                writeRecord(target, INDEX, '', buildIndex(newIndex, 0))
+                target.seek(0)
+                target.write(HEADER.pack(MAGIC, indexStart))
+                target.flush()
+                fsync(target.fileno())
+                target.seek(0, SEEK_END)
+                newEnd = target.tell()
+
+                source.close()
+                target.close()
+                self.file.close()
+                try:
+                    replace(tempPath, self.path)
+                except OSError:
+                    #Windows will not replace a file another process has
+                    #open, and the vault stays as it was
+                    remove(tempPath)
+                    return
+                finally:
+                    self.file = open(self.path, 'r+b')
+                self.index = newIndex
+                self.end = newEnd
+                self.dead = 0
+                self.sinceCheckpoint = 0
+
+    def close(self):
+        """Writes a final index so that the next open only has to read it"""
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.writing():
+            self.checkpoint()
+            self.file.close()
+        self.fileLock.close()
+
+class VaultSnapshot:
+    def __init__(self, vault, index):
+        self.vault = vault
+        self.index = index
+        self.file = open(vault.path, 'rb')
+
+    def names(self):
+        """Returns the entry names in the order they are laid out on disk"""
+        return sorted(self.index, key=lambda x: self.index[x][0])
+
+    def read(self, name):
+        """Returns an entry's bytes, or None if it was not in the vault"""
+        if name not in self.index:
+            return None
+        offset, length = self.index[name]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def close(self):
+        self.file.close()
+        with self.vault.lock:
+            self.vault.snapshots -= 1
+
+def fileIdentity(info):
+    """Tells files apart, so a vault replaced by compaction is noticed"""
+    return (info.st_ino, info.st_dev)
+
+def recordSize(name, payloadLength):
+    """Returns the size of a record on disk"""
+    return RECORD.size + len(name.encode()) + payloadLength
+
+def writeRecord(file, kind, name, payload):
+    """Writes a record to file and returns the (offset, length) of its payload"""
+    encodedName = name.encode()
+    file.write(RECORD.pack(kind, len(encodedName), len(payload),
+        crc32(payload, crc32(encodedName))))
+    file.write(encodedName)
+    offset = file.tell()
+    file.write(payload)
+    return (offset, len(payload))
+
+def buildIndex(index, dead):
+    """Serializes the index into the payload of an index record"""
+    parts = [INDEX_HEAD.pack(dead)]
+    for name, (offset, length) in index.items():
+        encodedName = name.encode()
+        parts.append(INDEX_ENTRY.pack(len(encodedName), offset, length))
+        parts.append(encodedName)
+    return b''.join(parts)
+
+def parseIndex(payload):
+    """Reads the payload of an index record back into a dictionary"""
+    dead, = INDEX_HEAD.unpack_from(payload)
+    index = {}
+    position = INDEX_HEAD.size
+    while position < len(payload):
+        nameLength, offset, length = INDEX_ENTRY.unpack_from(payload, position)
+        position += INDEX_ENTRY.size
+        name = payload[position:position + nameLength].decode()
+        position += nameLength
+        index[name] = (offset, length)
+    return index, dead
+
+def migrateDirectory(directory=None):
+    '''
+    Moves every entry in the data folder, from any of the other backends,
+    into a new vault file. The vault is written under a
+    temporary name first so an interrupted migration leaves the old files
+    untouched. The bulk of the copy runs while the vault stays in use; the
+    entries saved or deleted meanwhile are caught up with, and the new file
+    swapped in, under the vault's write lock (see Vault.writeLock)
+    '''
+    directory = directory or dataDir()
+    path = join(directory, VAULT_NAME)
+    if exists(path):
+        raise FileExistsError(path)
+
+    old = openStore(directory)
+    copied = old.stamps()
+    tempPath = path + '.migrate'
+    if exists(tempPath):
+        remove(tempPath)
+    vault = VaultFile(tempPath)
+    with vault.group():
+        with vault.lock:
+            for name in list(copied):
+                try:
+                    vault.put(name, old.read(name))
+                except FileNotFoundError:
+                    del copied[name]
+
+    writeLock = FileLock(join(directory, LOCK_NAME))
+    try:
+        with writeLock:
+            current = old.stamps()
+            with vault.group():
+                with vault.lock:
+                    for name, stamp in current.items():
+                        if copied.get(name) != stamp:
+                            vault.put(name, old.read(name))
+                for name in copied:
+                    if name not in current:
+                        vault.delete(name)
+            with vault.lock:
+                vault.checkpoint()
+            vault.close()
+            remove(tempPath + LOCK_SUFFIX)
+
+            replace(tempPath, path)
+            with old.group():
+                for name in current:
+                    old.delete(name)
+            old.close()
+            removeShards(directory)
+            removeDatabase(directory)
+    finally:
+        writeLock.close()
+    return len(current)
+
+if __name__ == '__main__':
+    print('Moved %d entries into %s' % (migrateDirectory(),
+        join(dataDir(), VAULT_NAME)))
@@ -0,0 +1,128 @@
+'''
+Keeps the entry list in step with entries saved or deleted by something
+other than this window: a second instance, a sync tool or a restore.
+
+The store's files are watched with QFileSystemWatcher. Events only restart a
+short timer, so a burst of them, like thousands of files dropped in at once,
+ends in one rescan. The rescan compares the store's names and stamps with
+what the list shows on a worker thread, and the differences are sent back to
+the GUI thread in a single changed signal.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+
+class EntryWatcher(QObject):
+    #Names added, removed and saved again since the last scan
+    changed = pyqtSignal(list, list, list)
+    #Carries a scan's result from the worker thread back to the GUI thread
+    scanFinished = pyqtSignal(object)
+
+    #How long the files have to be quiet before they are rescanned
+    quietDelay = 250
+    #Longest a steady stream of events can put off a rescan, in seconds
+    maxDelay = 2.0
+
+    def __init__(self, vault, files):
+        '''
+        Watches vault's store. files is the list of names the window shows,
+        which is only read on the GUI thread
+        '''
+        super().__init__()
+        self.vault = vault
+        self.files = files
+        self.stamps = None
+        self.firstEvent = None
+        self.scanning = False
+        #Set by events that come in while a scan runs, which need another
+        self.dirty = False
+        #One thread, so the store is only ever scanned by one at a time
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(lambda x: self.touched())
+        self.watcher.fileChanged.connect(lambda x: self.touched())
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.rescan)
+        self.scanFinished.connect(self.finished)
+
+        self.rewatch()
+        if self.vault.store.watchPaths():
+            self.pool.submit(self.takeStamps)
+
+    def rewatch(self):
+        '''
+        Watches the store's current paths. The vault may have been moved to
+        another layout, and a file like SQLite's log comes and goes, so this
+        is done again after every scan
+        '''
+        wanted = set(self.vault.store.watchPaths())
+        watched = set(self.watcher.files() + self.watcher.directories())
+        if watched - wanted:
+            self.watcher.removePaths(list(watched - wanted))
+        #addPaths skips paths that do not exist
+        if wanted - watched:
+            self.watcher.addPaths(list(wanted - watched))
+
+    def takeStamps(self):
+        self.stamps = self.vault.store.stamps()
+
+    def touched(self):
+        if self.firstEvent is None:
+            self.firstEvent = perf_counter()
+        if self.scanning:
+            self.dirty = True
+        waited = perf_counter() - self.firstEvent
+        delay = min(self.quietDelay, max(0, self.maxDelay - waited) * 1000)
+        self.timer.start(int(delay))
+
+    def rescan(self):
+        if self.scanning:
+            #Tried again once the current scan is back
+            return
+        self.firstEvent = None
+        self.scanning = True
+        self.dirty = False
+        self.pool.submit(self.scan, set(self.files))
+
+    def scan(self, shown):
+        '''
+        Compares the store with the names shown. Run on the worker thread
+        '''
+        try:
+            stamps = self.vault.store.stamps()
+        except OSError:
+            #Caught part way through being moved, the next event rescans
+            self.scanFinished.emit(None)
+            return
+        previous = self.stamps or {}
+        listed = set(stamps)
+        added = sorted(listed - shown)
+        removed = sorted(shown - listed)
+        modified = sorted(x for x in listed & shown
+            if x in previous and previous[x] != stamps[x])
+        self.stamps = stamps
+        self.scanFinished.emit((added, removed, modified))
+
+    def finished(self, delta):
+        '''
+        Hands a scan's differences to the window. Names the window added or
+        removed itself while the scan ran can show up here again, which the
+        window ignores
+        '''
+        self.scanning = False
+        self.rewatch()
+        if self.dirty:
+            self.dirty = False
+            self.timer.start(self.quietDelay)
+        if delta is not None and any(delta):
+            self.changed.emit(*delta)
+
+    def stop(self):
+        self.timer.stop()
+        self.watcher.removePaths(self.watcher.files() +
+            self.watcher.directories())
+        self.pool.shutdown(wait=True)